@@ -0,0 +1,83 @@
+"""Unit tests of the Jobbergate Agent charm."""
+
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import ops
+from fakes import FakeSnapd
+from ops import testing
+
+SNAP = "jobbergate-agent"
+CONFIG = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+}
+MISSING_CONFIG = [f"{SNAP}-oidc-client-id", f"{SNAP}-oidc-client-secret"]
+# Empty resources, like the placeholders uploaded to Charmhub, so the snap comes from the store.
+RESOURCES = {
+    testing.Resource(name=f"{SNAP}-snap", path=Path(os.devnull)),
+    testing.Resource(name=f"{SNAP}-snap-assertion", path=Path(os.devnull)),
+}
+SERVICE_CONTROL = ("POST", "/v2/apps")
+
+
+def unit(leader: bool, config: Optional[Dict[str, str]] = None) -> testing.State:
+    """Return the state of a unit of the charm."""
+    return testing.State(leader=leader, config=config or {}, resources=RESOURCES)
+
+
+def test_leader_runs_the_daemon(ctx: testing.Context, snapd: FakeSnapd):
+    out = ctx.run(ctx.on.install(), unit(leader=True, config=CONFIG))
+
+    assert snapd.snaps[SNAP]["services"] == {"daemon": True}
+    assert snapd.snaps[SNAP]["config"]["oidc-client-id"] == "client-id"
+    assert out.unit_status == ops.ActiveStatus()
+
+
+def test_standby_unit_stops_the_daemon(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP, services={"daemon": True})
+
+    out = ctx.run(ctx.on.update_status(), unit(leader=False, config=CONFIG))
+
+    assert snapd.snaps[SNAP]["services"] == {"daemon": False}
+    assert out.unit_status == ops.ActiveStatus(f"{SNAP} status: standby")
+
+
+def test_config_change_bounces_the_daemon_only_when_the_snap_config_changes(
+    ctx: testing.Context, snapd: FakeSnapd
+):
+    snapd.add_snap(SNAP)
+    ctx.run(ctx.on.config_changed(), unit(leader=True, config=CONFIG))
+    snapd.requests.clear()
+
+    # A unit that lost its stored state finds the snap config up to date.
+    ctx.run(ctx.on.config_changed(), unit(leader=True, config=CONFIG))
+    assert SERVICE_CONTROL not in snapd.requests
+
+    config = {**CONFIG, f"{SNAP}-oidc-client-id": "other"}
+    out = ctx.run(ctx.on.config_changed(), unit(leader=True, config=config))
+    assert snapd.requests.count(SERVICE_CONTROL) == 2
+    assert snapd.snaps[SNAP]["config"]["oidc-client-id"] == "other"
+    assert snapd.snaps[SNAP]["services"] == {"daemon": True}
+    assert out.unit_status == ops.ActiveStatus()
+
+
+def test_collect_status_reports_the_missing_config(ctx: testing.Context, snapd: FakeSnapd):
+    out = ctx.run(ctx.on.install(), unit(leader=True))
+
+    assert out.unit_status == ops.BlockedStatus(
+        f"Cannot start {SNAP}. Missing Config: {', '.join(MISSING_CONFIG)}"
+    )
+    assert snapd.snaps[SNAP]["services"] == {"daemon": False}
+
+
+def test_collect_status_reports_a_daemon_that_does_not_start(
+    ctx: testing.Context, snapd: FakeSnapd
+):
+    snapd.add_snap(SNAP)
+    snapd.fail("POST", "/v2/apps", "cannot start the daemon")
+
+    out = ctx.run(ctx.on.update_status(), unit(leader=True, config=CONFIG))
+
+    assert out.unit_status == ops.BlockedStatus("Cannot start snap.")
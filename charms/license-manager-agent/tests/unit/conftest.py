@@ -0,0 +1,33 @@
+"""Fixtures of the License Manager Agent charm unit tests."""
+
+import sys
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from agent_snapper import AgentSnapper, charmed_agent
+from charm import LicenseManagerAgentCharm
+from ops import testing
+
+# The fakes of snapd and of the snap CLI live with the agent-snapper tests, at the same depth
+# from the charm tests whether they run from the charm sources or from the staged charm.
+sys.path.insert(0, str(Path(__file__).parents[4] / "pkgs" / "agent-snapper" / "tests"))
+
+from fakes import FakeSnapCli, FakeSnapd  # noqa: E402
+
+
+@pytest.fixture
+def snapd(tmp_path: Path) -> Iterator[FakeSnapd]:
+    """Fake snapd serving on a socket of the test directory."""
+    with FakeSnapd(tmp_path / "snapd.socket") as snapd:
+        yield snapd
+
+
+@pytest.fixture
+def ctx(monkeypatch: pytest.MonkeyPatch, tmp_path: Path, snapd: FakeSnapd) -> testing.Context:
+    """Context dispatching events to the charm, managing the snap of the fake snapd."""
+    monkeypatch.setattr(AgentSnapper, "_sys_exec", staticmethod(FakeSnapCli(snapd)))
+    monkeypatch.setattr(charmed_agent, "SNAPD_SOCKET", snapd.socket_path)
+    # Probe the daemon through the fakes, never through the host systemd.
+    monkeypatch.setattr(charmed_agent, "SYSTEM_BUS_SOCKET", tmp_path / "missing-bus.socket")
+    return testing.Context(LicenseManagerAgentCharm)
@@ -1,5 +1,5 @@
 """Chamed Agent Snapper Library."""
 
-from agent_snapper.charmed_agent import AgentSnapper
+from agent_snapper.charmed_agent import AgentSnapper, MultiAgentSnapper
 
-__all__ = ["AgentSnapper"]
+__all__ = ["AgentSnapper", "MultiAgentSnapper"]
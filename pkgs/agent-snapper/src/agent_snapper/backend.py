@@ -0,0 +1,544 @@
+"""Snap management backends used by the AgentSnapper.
+
+`SnapCliBackend` drives the `snap` command line tool, `SnapdRestBackend` talks to the snapd REST
+API directly and falls back to the command line tool when snapd cannot be reached.
+"""
+
+import functools
+import json
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from agent_snapper.errors import SnapdConnectionError, SnapperSysCallError
+from agent_snapper.snapd import SnapdClient
+
+logger = logging.getLogger()
+
+# Timeout in seconds of the snap operations, by `snap` command verb. Installs and refreshes
+# download from the store, so they get the most time.
+SNAP_TIMEOUTS = {
+    "install": 600.0,
+    "refresh": 600.0,
+    "remove": 300.0,
+    "run": 120.0,
+    "default": 60.0,
+}
+
+
+@dataclass(frozen=True)
+class SnapInfo:
+    """Information about an installed snap."""
+
+    name: str
+    revision: str
+    channel: str
+
+
+@dataclass(frozen=True)
+class SnapChange:
+    """Progress of a snapd change."""
+
+    id: str
+    status: str
+    ready: bool
+    err: str = ""
+    progress: str = ""
+
+
+class SnapBackend(ABC):
+    """Operations needed by the AgentSnapper to manage a snap.
+
+    Failures are raised as SnapperSysCallError.
+    """
+
+    @abstractmethod
+    def info(self, name: str) -> Optional[SnapInfo]:
+        """Return the installed snap information, or None if the snap is not installed."""
+
+    @abstractmethod
+    def refresh_available(self, name: str) -> bool:
+        """Return True if the store has a newer revision of the snap in its tracked channel."""
+
+    @abstractmethod
+    def services(self, name: str) -> Dict[str, str]:
+        """Return the current state (`active`/`inactive`) of each service of the snap."""
+
+    @abstractmethod
+    def get_config(self, name: str) -> Dict[str, Any]:
+        """Return the snap configuration."""
+
+    @abstractmethod
+    def set_config(self, name: str, config: Dict[str, Any]) -> None:
+        """Set all the given snap configuration keys in one change."""
+
+    @abstractmethod
+    def install(self, name: str, channel: str, classic: bool = True) -> None:
+        """Install the snap from the given channel."""
+
+    @abstractmethod
+    def refresh(self, name: str, channel: str, classic: bool = True) -> None:
+        """Refresh the snap to the given channel."""
+
+    @abstractmethod
+    def install_file(
+        self, name: str, snap_file: Path, assertion_file: Optional[Path], classic: bool = True
+    ) -> None:
+        """Install the snap from a local file, acknowledging its assertions first if given.
+
+        Without assertions the snap is installed in dangerous mode.
+        """
+
+    @abstractmethod
+    def submit_install(self, name: str, channel: str, classic: bool = True) -> str:
+        """Start installing the snap and return the snapd change ID without waiting."""
+
+    @abstractmethod
+    def submit_refresh(self, name: str, channel: str, classic: bool = True) -> str:
+        """Start refreshing the snap and return the snapd change ID without waiting."""
+
+    @abstractmethod
+    def change(self, change_id: str) -> SnapChange:
+        """Return the progress of a snapd change."""
+
+    @abstractmethod
+    def remove(self, name: str) -> None:
+        """Remove the snap."""
+
+    @abstractmethod
+    def run(self, name: str, app: str) -> None:
+        """Run an app of the snap (e.g. its `start`/`stop` apps)."""
+
+
+class SnapCliBackend(SnapBackend):
+    """Manage snaps by running the `snap` command line tool."""
+
+    # Task statuses of a change that is still in progress.
+    _PENDING_TASKS = ("Do", "Doing", "Undo", "Undoing", "Wait", "Abort")
+
+    def __init__(self, sys_exec: Callable[..., str], snap_path: Path = Path("/usr/bin/snap")):
+        """Initialize the backend.
+
+        Args:
+            sys_exec: Function used to run the commands, returning their stdout.
+            snap_path: Path of the `snap` binary.
+        """
+        self._sys_exec = sys_exec
+        self._snap_path = snap_path
+
+    def info(self, name: str) -> Optional[SnapInfo]:
+        """Return the installed snap information, or None if the snap is not installed."""
+        try:
+            output = self._sys_exec(self._snap_path, "list", name)
+        except SnapperSysCallError:
+            return None
+        # Name  Version  Rev  Tracking  Publisher  Notes
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) >= 4 and parts[0] == name:
+                return SnapInfo(name=name, revision=parts[2], channel=parts[3])
+        # `snap list` only succeeds for installed snaps, even if the table is not parsable.
+        return SnapInfo(name=name, revision="", channel="")
+
+    def refresh_available(self, name: str) -> bool:
+        """Return True if the store has a newer revision of the snap in its tracked channel."""
+        # Name  Version  Rev  Size  Publisher  Notes, or only "All snaps up to date."
+        output = self._sys_exec(self._snap_path, "refresh", "--list")
+        return any(line.split()[:1] == [name] for line in output.splitlines())
+
+    def services(self, name: str) -> Dict[str, str]:
+        """Return the current state (`active`/`inactive`) of each service of the snap."""
+        output = self._sys_exec(self._snap_path, "services", name)
+        # Service  Startup  Current  Notes
+        services = {}
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) >= 4 and parts[0].startswith(f"{name}."):
+                services[parts[0].removeprefix(f"{name}.")] = parts[2]
+        return services
+
+    def get_config(self, name: str) -> Dict[str, Any]:
+        """Return the snap configuration."""
+        output = self._sys_exec(self._snap_path, "get", "-d", name)
+        try:
+            return json.loads(output)
+        except json.JSONDecodeError:
+            logger.error("#### Error decoding snap config")
+            return {}
+
+    def set_config(self, name: str, config: Dict[str, Any]) -> None:
+        """Set all the given snap configuration keys in one change."""
+        self._sys_exec(self._snap_path, "set", name, *(f"{k}={v}" for k, v in config.items()))
+
+    def install(self, name: str, channel: str, classic: bool = True) -> None:
+        """Install the snap from the given channel."""
+        self._sys_exec(
+            self._snap_path,
+            "install",
+            "--channel",
+            channel,
+            *(["--classic"] if classic else []),
+            name,
+        )
+
+    def refresh(self, name: str, channel: str, classic: bool = True) -> None:
+        """Refresh the snap to the given channel."""
+        self._sys_exec(
+            self._snap_path,
+            "refresh",
+            "--channel",
+            channel,
+            *(["--classic"] if classic else []),
+            name,
+        )
+
+    def install_file(
+        self, name: str, snap_file: Path, assertion_file: Optional[Path], classic: bool = True
+    ) -> None:
+        """Install the snap from a local file, acknowledging its assertions first if given."""
+        if assertion_file is not None:
+            self._sys_exec(self._snap_path, "ack", assertion_file)
+        self._sys_exec(
+            self._snap_path,
+            "install",
+            *(["--classic"] if classic else []),
+            *(["--dangerous"] if assertion_file is None else []),
+            snap_file,
+        )
+
+    def submit_install(self, name: str, channel: str, classic: bool = True) -> str:
+        """Start installing the snap and return the snapd change ID without waiting."""
+        return self._sys_exec(
+            self._snap_path,
+            "install",
+            "--no-wait",
+            "--channel",
+            channel,
+            *(["--classic"] if classic else []),
+            name,
+        ).strip()
+
+    def submit_refresh(self, name: str, channel: str, classic: bool = True) -> str:
+        """Start refreshing the snap and return the snapd change ID without waiting."""
+        return self._sys_exec(
+            self._snap_path,
+            "refresh",
+            "--no-wait",
+            "--channel",
+            channel,
+            *(["--classic"] if classic else []),
+            name,
+        ).strip()
+
+    def change(self, change_id: str) -> SnapChange:
+        """Return the progress of a snapd change."""
+        output = self._sys_exec(self._snap_path, "tasks", change_id)
+        # Status  Spawn  Ready  Summary, followed by the logs of the failed tasks.
+        table, _, logs = output.partition("\n\n")
+        lines = table.splitlines()
+        if not lines or "Summary" not in lines[0]:
+            raise SnapperSysCallError(f"Cannot parse the tasks of snapd change {change_id}")
+        summary_column = lines[0].index("Summary")
+        tasks = [(line.split()[0], line[summary_column:].strip()) for line in lines[1:] if line]
+
+        pending = [summary for status, summary in tasks if status in self._PENDING_TASKS]
+        if pending:
+            return SnapChange(id=change_id, status="Doing", ready=False, progress=pending[0])
+        if any(status in ("Error", "Undone") for status, _ in tasks):
+            return SnapChange(id=change_id, status="Error", ready=True, err=logs.strip())
+        return SnapChange(id=change_id, status="Done", ready=True)
+
+    def remove(self, name: str) -> None:
+        """Remove the snap."""
+        self._sys_exec(self._snap_path, "remove", name)
+
+    def run(self, name: str, app: str) -> None:
+        """Run an app of the snap (e.g. its `start`/`stop` apps)."""
+        self._sys_exec(self._snap_path, "run", f"{name}.{app}")
+
+
+def _cli_fallback(method: Callable) -> Callable:
+    """Run `method` against snapd, or the CLI backend once snapd is found unreachable."""
+
+    @functools.wraps(method)
+    def wrapper(self: "SnapdRestBackend", *args: Any, **kwargs: Any) -> Any:
+        if not self._use_fallback:
+            try:
+                return method(self, *args, **kwargs)
+            except SnapdConnectionError as e:
+                logger.warning(f"### snapd API unavailable, falling back to the snap CLI: {e}")
+                self._use_fallback = True
+        return getattr(self._fallback, method.__name__)(*args, **kwargs)
+
+    return wrapper
+
+
+class SnapdRestBackend(SnapBackend):
+    """Manage snaps through the snapd REST API."""
+
+    # Service actions snapd can perform itself; other apps have to be run by the CLI.
+    _SERVICE_ACTIONS = ("start", "stop", "restart")
+
+    def __init__(
+        self,
+        client: SnapdClient,
+        fallback: SnapBackend,
+        timeouts: Optional[Dict[str, float]] = None,
+    ):
+        """Initialize the backend.
+
+        Args:
+            client: The snapd REST API client.
+            fallback: Backend used when snapd cannot be reached.
+            timeouts: Timeouts of the snapd changes, by `snap` command verb (optional).
+        """
+        self._client = client
+        self._fallback = fallback
+        self._use_fallback = False
+        self._timeouts = {**SNAP_TIMEOUTS, **(timeouts or {})}
+
+    def _wait(self, operation: str, change_id: str) -> None:
+        """Wait for a change within the timeout of the operation, aborting it past that."""
+        self._client.wait_change(
+            change_id, timeout=self._timeouts.get(operation, self._timeouts["default"])
+        )
+
+    @_cli_fallback
+    def info(self, name: str) -> Optional[SnapInfo]:
+        """Return the installed snap information, or None if the snap is not installed."""
+        snap = self._client.snap(name)
+        if snap is None:
+            return None
+        return SnapInfo(
+            name=name,
+            revision=str(snap.get("revision", "")),
+            channel=snap.get("tracking-channel") or snap.get("channel", ""),
+        )
+
+    @_cli_fallback
+    def refresh_available(self, name: str) -> bool:
+        """Return True if the store has a newer revision of the snap in its tracked channel."""
+        return any(snap.get("name") == name for snap in self._client.find(select="refresh"))
+
+    @_cli_fallback
+    def services(self, name: str) -> Dict[str, str]:
+        """Return the current state (`active`/`inactive`) of each service of the snap."""
+        return {
+            app["name"]: "active" if app.get("active") else "inactive"
+            for app in self._client.apps([name])
+        }
+
+    @_cli_fallback
+    def get_config(self, name: str) -> Dict[str, Any]:
+        """Return the snap configuration."""
+        return self._client.get_conf(name)
+
+    @_cli_fallback
+    def set_config(self, name: str, config: Dict[str, Any]) -> None:
+        """Set all the given snap configuration keys in one change."""
+        # Match `snap set`, which stores values that parse as JSON typed.
+        self._wait(
+            "set", self._client.set_conf(name, {k: self._json_value(v) for k, v in config.items()})
+        )
+
+    @_cli_fallback
+    def install(self, name: str, channel: str, classic: bool = True) -> None:
+        """Install the snap from the given channel."""
+        self._wait(
+            "install", self._client.snap_action(name, "install", channel=channel, classic=classic)
+        )
+
+    @_cli_fallback
+    def refresh(self, name: str, channel: str, classic: bool = True) -> None:
+        """Refresh the snap to the given channel."""
+        self._wait(
+            "refresh", self._client.snap_action(name, "refresh", channel=channel, classic=classic)
+        )
+
+    @_cli_fallback
+    def install_file(
+        self, name: str, snap_file: Path, assertion_file: Optional[Path], classic: bool = True
+    ) -> None:
+        """Install the snap from a local file, acknowledging its assertions first if given."""
+        if assertion_file is not None:
+            self._client.ack(assertion_file.read_bytes())
+        self._wait(
+            "install",
+            self._client.sideload(snap_file, classic=classic, dangerous=assertion_file is None),
+        )
+
+    @_cli_fallback
+    def submit_install(self, name: str, channel: str, classic: bool = True) -> str:
+        """Start installing the snap and return the snapd change ID without waiting."""
+        return self._client.snap_action(name, "install", channel=channel, classic=classic)
+
+    @_cli_fallback
+    def submit_refresh(self, name: str, channel: str, classic: bool = True) -> str:
+        """Start refreshing the snap and return the snapd change ID without waiting."""
+        return self._client.snap_action(name, "refresh", channel=channel, classic=classic)
+
+    @_cli_fallback
+    def change(self, change_id: str) -> SnapChange:
+        """Return the progress of a snapd change."""
+        change = self._client.change(change_id)
+        progress = ""
+        for task in change.get("tasks", []):
+            if task.get("status") == "Doing":
+                progress = task.get("summary", "")
+                task_progress = task.get("progress", {})
+                if task_progress.get("total", 0) > 1:
+                    percent = 100 * task_progress.get("done", 0) // task_progress["total"]
+                    progress += f" ({percent}%)"
+                break
+        return SnapChange(
+            id=change_id,
+            status=change.get("status", ""),
+            ready=bool(change.get("ready")),
+            err=change.get("err", ""),
+            progress=progress,
+        )
+
+    @_cli_fallback
+    def remove(self, name: str) -> None:
+        """Remove the snap."""
+        self._wait("remove", self._client.snap_action(name, "remove"))
+
+    @_cli_fallback
+    def run(self, name: str, app: str) -> None:
+        """Run an app of the snap.
+
+        The agent snaps' `start`/`stop` apps start and enable, or stop and disable, the daemon,
+        which snapd does directly.
+        """
+        if app not in self._SERVICE_ACTIONS:
+            self._fallback.run(name, app)
+            return
+        options = {"start": {"enable": True}, "stop": {"disable": True}}.get(app, {})
+        self._wait("run", self._client.app_action(app, [f"{name}.daemon"], **options))
+
+    @staticmethod
+    def _json_value(value: Any) -> Any:
+        if not isinstance(value, str):
+            return value
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+
+
+class CachedSnapBackend(SnapBackend):
+    """Cache the state queries of another backend for the lifetime of a hook dispatch.
+
+    Queries are only sent to the wrapped backend the first time they are needed. Mutating
+    operations drop the cached entries they may have changed, so the next query is fresh.
+    """
+
+    def __init__(self, backend: SnapBackend):
+        """Initialize the backend.
+
+        Args:
+            backend: Backend performing the actual operations.
+        """
+        self._backend = backend
+        self._info: Dict[str, Optional[SnapInfo]] = {}
+        self._services: Dict[str, Dict[str, str]] = {}
+        self._config: Dict[str, Dict[str, Any]] = {}
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drop the cached state of snap `name`, or of every snap."""
+        for cache in (self._info, self._services, self._config):
+            if name is None:
+                cache.clear()
+            else:
+                cache.pop(name, None)
+
+    def info(self, name: str) -> Optional[SnapInfo]:
+        """Return the installed snap information, or None if the snap is not installed."""
+        if name not in self._info:
+            self._info[name] = self._backend.info(name)
+        return self._info[name]
+
+    def refresh_available(self, name: str) -> bool:
+        """Return True if the store has a newer revision of the snap in its tracked channel."""
+        return self._backend.refresh_available(name)
+
+    def services(self, name: str) -> Dict[str, str]:
+        """Return the current state (`active`/`inactive`) of each service of the snap."""
+        if name not in self._services:
+            self._services[name] = self._backend.services(name)
+        return dict(self._services[name])
+
+    def get_config(self, name: str) -> Dict[str, Any]:
+        """Return the snap configuration."""
+        if name not in self._config:
+            self._config[name] = self._backend.get_config(name)
+        return dict(self._config[name])
+
+    def set_config(self, name: str, config: Dict[str, Any]) -> None:
+        """Set all the given snap configuration keys in one change."""
+        try:
+            self._backend.set_config(name, config)
+        except Exception:
+            self._config.pop(name, None)
+            raise
+        # The configure hook may restart services.
+        self._services.pop(name, None)
+        if name in self._config:
+            self._config[name].update(config)
+
+    def install(self, name: str, channel: str, classic: bool = True) -> None:
+        """Install the snap from the given channel."""
+        try:
+            self._backend.install(name, channel, classic=classic)
+        finally:
+            self.invalidate(name)
+
+    def refresh(self, name: str, channel: str, classic: bool = True) -> None:
+        """Refresh the snap to the given channel."""
+        try:
+            self._backend.refresh(name, channel, classic=classic)
+        finally:
+            self.invalidate(name)
+
+    def install_file(
+        self, name: str, snap_file: Path, assertion_file: Optional[Path], classic: bool = True
+    ) -> None:
+        """Install the snap from a local file, acknowledging its assertions first if given."""
+        try:
+            self._backend.install_file(name, snap_file, assertion_file, classic=classic)
+        finally:
+            self.invalidate(name)
+
+    def submit_install(self, name: str, channel: str, classic: bool = True) -> str:
+        """Start installing the snap and return the snapd change ID without waiting."""
+        try:
+            return self._backend.submit_install(name, channel, classic=classic)
+        finally:
+            self.invalidate(name)
+
+    def submit_refresh(self, name: str, channel: str, classic: bool = True) -> str:
+        """Start refreshing the snap and return the snapd change ID without waiting."""
+        try:
+            return self._backend.submit_refresh(name, channel, classic=classic)
+        finally:
+            self.invalidate(name)
+
+    def change(self, change_id: str) -> SnapChange:
+        """Return the progress of a snapd change."""
+        return self._backend.change(change_id)
+
+    def remove(self, name: str) -> None:
+        """Remove the snap."""
+        try:
+            self._backend.remove(name)
+        finally:
+            self.invalidate(name)
+
+    def run(self, name: str, app: str) -> None:
+        """Run an app of the snap (e.g. its `start`/`stop` apps)."""
+        try:
+            self._backend.run(name, app)
+        finally:
+            self._services.pop(name, None)
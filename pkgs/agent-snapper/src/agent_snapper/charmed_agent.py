@@ -5,33 +5,62 @@ to manage a Snapped Vantage Agent within a Juju charm. By using this library, ch
 charm code and focus on custom logic.
 """
 
+import hashlib
 import json
 import logging
+import os
 import shlex
+import signal
 import subprocess
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional
 
 import ops
 
-logger = logging.getLogger()
-
+from agent_snapper.backend import (
+    SNAP_TIMEOUTS,
+    CachedSnapBackend,
+    SnapBackend,
+    SnapCliBackend,
+    SnapdRestBackend,
+)
+from agent_snapper.errors import AgentSnapperError, SnapperSysCallError, SnapperTimeoutError
+from agent_snapper.journal import JournalSummary, scan_journal
+from agent_snapper.retry import RetryPolicy
+from agent_snapper.snapd import SNAPD_SOCKET, SnapdClient
+from agent_snapper.systemd import SYSTEM_BUS_SOCKET, DaemonHealth, DBusError, SystemdProbe
+from agent_snapper.timing import TimingRecorder, timed_handler
 
-class AgentSnapperError(Exception):
-    """Exception raised by the AgentSnapper."""
+logger = logging.getLogger()
 
-    pass
 
+@dataclass
+class WantedState:
+    """State of the snap wanted by the charm config and the leadership of the unit.
 
-class SnapperSysCallError(Exception):
-    """Raise exception from syscall execution."""
+    Attributes:
+        installed: Whether the snap is installed on this unit.
+        config: Snap config keys and values, taken from the charm config keys prefixed by the
+            snap name.
+        missing_config: Required charm config keys without a value.
+        running: Whether the snap daemon runs on this unit.
+    """
 
-    pass
+    installed: bool
+    config: Dict[str, Any]
+    missing_config: List[str]
+    running: bool
 
 
 class AgentSnapper(ops.Object):
     """Vantage Snapped Agent Charm Operator."""
 
+    _stored = ops.StoredState()
+
+    # Peer relation used by the leader to hand out snap refresh slots.
+    _REFRESH_PEER = "snap-refresh"
+
     _SNAP_REQUIRED_CONFIGS = [
         "base-api-url",
         "oidc-domain",
@@ -44,6 +73,9 @@ class AgentSnapper(ops.Object):
         charm: ops.CharmBase,
         snap_name: str,
         required_snap_config: Optional[List[str]] = None,
+        async_install: bool = False,
+        snap_timeouts: Optional[Dict[str, float]] = None,
+        multi: Optional["MultiAgentSnapper"] = None,
     ):
         """Initialize the AgentSnapper.
 
@@ -51,52 +83,156 @@ class AgentSnapper(ops.Object):
             charm: The parent CharmBase instance.
             snap_name: The name of the snap to manage.
             required_snap_config: Additional required snap config keys (optional).
+            async_install: Submit snap installs and refreshes to snapd without waiting for
+                them, and track their progress in the following hooks (optional).
+            snap_timeouts: Timeouts in seconds of the snap operations by `snap` command verb,
+                e.g. `{"install": 900}`, overriding the defaults; `default` applies to the
+                verbs not listed (optional).
+            multi: The MultiAgentSnapper this snapper is part of (optional).
         """
-        super().__init__(charm, None)
+        # Snappers of a MultiAgentSnapper need their own handle to keep separate stored states.
+        super().__init__(charm, snap_name if multi is not None else None)
         self._charm = charm
         self._snap_path = Path("/usr/bin/snap")
+        self._snapd_socket = SNAPD_SOCKET
+        self._system_bus_socket = SYSTEM_BUS_SOCKET
+        self._daemon_probe: Optional[SystemdProbe] = None
+        self._snap_backend: Optional[CachedSnapBackend] = None
+        self._multi = multi
+        self._status: Optional[ops.StatusBase] = None
         self._snap_name = snap_name
         self._required_snap_config = required_snap_config or []
-
-        # Register event handlers
-        for event, handler in [
-            (self._charm.on.install, self._on_install),
-            (self._charm.on.config_changed, self._on_config_changed),
-            (self._charm.on.update_status, self._on_update_status),
-            (self._charm.on.stop, self._on_stop),
-            (self._charm.on.remove, self._on_remove),
-        ]:
-            self._charm.framework.observe(event, handler)
+        self._async_install = async_install
+        self._snap_timeouts = {**SNAP_TIMEOUTS, **(snap_timeouts or {})}
+        self._retry = RetryPolicy()
+        self._stored.set_default(snap_change_id="", snap_change_error="", snap_resource_digest="")
+        self._stored.set_default(journal_cursor="", journal_summary="", snap_config_digest="")
+        self._timings = self._timing_recorder()
+
+        # Register event handlers. Every lifecycle event converges the snap the same way.
+        lifecycle_events = [
+            self._charm.on.install,
+            self._charm.on.upgrade_charm,
+            self._charm.on.config_changed,
+            self._charm.on.update_status,
+            self._charm.on.leader_elected,
+        ]
+        if self._REFRESH_PEER in self._charm.meta.peers:
+            lifecycle_events += [
+                self._charm.on[self._REFRESH_PEER].relation_changed,
+                self._charm.on[self._REFRESH_PEER].relation_departed,
+            ]
+        for event in lifecycle_events:
+            self._charm.framework.observe(event, self.reconcile)
+        self._charm.framework.observe(self._charm.on.stop, self._on_stop)
+        self._charm.framework.observe(self._charm.on.remove, self._on_remove)
+        if multi is None:
+            self._charm.framework.observe(
+                self._charm.on.collect_unit_status, self._on_collect_unit_status
+            )
+        if "refresh-snap" in self._charm.meta.actions:
+            self._charm.framework.observe(
+                self._charm.on["refresh-snap"].action, self._on_refresh_snap_action
+            )
+        if "show-timings" in self._charm.meta.actions:
+            self._charm.framework.observe(
+                self._charm.on["show-timings"].action, self._on_show_timings_action
+            )
+        if "journal-summary" in self._charm.meta.actions:
+            self._charm.framework.observe(
+                self._charm.on["journal-summary"].action, self._on_journal_summary_action
+            )
+        if self._timings.enabled:
+            self._charm.framework.observe(self._charm.framework.on.commit, self._on_commit)
 
     @property
     def _required_snap_configs(self) -> List[str]:
         """Return the required snap config keys (default + user-specified)."""
         return self._SNAP_REQUIRED_CONFIGS + self._required_snap_config
 
-    ## Event Handlers
-    def _on_install(self, event: ops.InstallEvent) -> None:
-        """Perform install operations for the snap."""
-        logger.debug(f"## Processing install event for {self._snap_name}.")
-        self._charm.unit.status = ops.WaitingStatus(f"Installing snap: {self._snap_name}")
-        try:
-            self.install_snap()
-        except Exception as e:
-            logger.error(f"## Error installing {self._snap_name}: {e}")
-            self._charm.unit.status = ops.BlockedStatus(
-                f"Error installing the snap for {self._snap_name}"
+    @property
+    def _backend(self) -> CachedSnapBackend:
+        """Return the backend used to manage the snap.
+
+        The snapd REST API is used when its socket is present, with the `snap` CLI as fallback.
+        The backend, its snapd connection and its cached snap state are reused for the whole
+        hook dispatch, and shared by all the snappers of a MultiAgentSnapper.
+        """
+        if self._snap_backend is None and self._multi is not None:
+            primary = self._multi.primary
+            if primary is not self:
+                self._snap_backend = primary._backend
+        if self._snap_backend is None:
+            cli = SnapCliBackend(self._exec, self._snap_path)
+            client = SnapdClient(self._snapd_socket, timings=self._timings, retry=self._retry)
+            backend: SnapBackend = (
+                SnapdRestBackend(client, cli, self._snap_timeouts) if client.available else cli
             )
-            event.defer()
+            self._snap_backend = CachedSnapBackend(backend)
+        return self._snap_backend
+
+    def _timing_recorder(self) -> TimingRecorder:
+        """Return the recorder of snap operation and event handler timings.
+
+        Timings are kept next to the charm directory, so they survive charm upgrades, and are
+        exported for the node exporter textfile collector when its directory exists.
+        """
+        textfile_dir = str(self._charm.config.get("timings-textfile-dir", ""))
+        return TimingRecorder(
+            self._charm.charm_dir.parent / f"{self._snap_name}-timings.json",
+            labels={"snap": self._snap_name, "unit": self._charm.unit.name},
+            enabled=bool(self._charm.config.get("timings-enabled", False)),
+            textfile_path=(
+                Path(textfile_dir) / f"{self._snap_name}-charm.prom" if textfile_dir else None
+            ),
+        )
+
+    def _set_status(self, status: ops.StatusBase) -> None:
+        """Set the status of the snap, reported to the unit status when it is collected."""
+        self._status = status
+
+    def _result_key(self, key: str) -> str:
+        """Return the action result key, prefixed by the snap name in a MultiAgentSnapper."""
+        return f"{self._snap_name}-{key}" if self._multi is not None else key
+
+    ## Event Handlers
+    @timed_handler
+    def reconcile(self, event: ops.EventBase) -> None:
+        """Converge the snap to the wanted state, whatever the event.
+
+        The wanted state is computed once from the charm config and the leadership, compared
+        with the installed snap, its config and its daemon, and only the difference is applied.
+        Nothing is deferred: what cannot be done yet is done by a later event, at the latest
+        the next update-status.
+        """
+        logger.debug(f"## Reconciling {self._snap_name} on {event.handle.kind}.")
+        wanted = self._wanted_state()
+        if self.model.unit.is_leader():
+            self._publish_leader()
+        if self._stored.snap_change_id and not self._check_snap_change():
             return
-        logger.debug(f"Snap for {self._snap_name} installed")
 
-    def _on_config_changed(self, event: ops.ConfigChangedEvent) -> None:
-        """Perform config-changed operations for the snap."""
-        logger.debug(f"## Processing config changed event: {self._snap_name}.")
-        if not self._is_snap_installed:
-            logger.debug(f"## Snap: {self._snap_name} not installed, deferring event")
-            event.defer()
+        if not wanted.installed and not self._is_snap_installed:
+            logger.debug(f"## Cold standby, not installing {self._snap_name} until elected.")
+            self._set_status(ops.ActiveStatus(f"{self._snap_name} status: standby"))
+            return
+        if not self._install_wanted_snap(event):
             return
 
+        if wanted.missing_config:
+            self._set_status(
+                ops.BlockedStatus(
+                    f"Cannot start {self._snap_name}. "
+                    f"Missing Config: {', '.join(wanted.missing_config)}"
+                )
+            )
+            return
+        if not self._apply_wanted_config(wanted):
+            return
+        self._set_daemon_status(event)
+
+    def _wanted_state(self) -> WantedState:
+        """Return the state of the snap wanted by the charm config and the leadership."""
         prefix = f"{self._snap_name}-"
         snap_configs = {
             key.removeprefix(prefix): value
@@ -104,168 +240,719 @@ class AgentSnapper(ops.Object):
             if key.startswith(prefix)
         }
         logger.debug(f"Snap configs: {snap_configs}")
+        missing = [f"{prefix}{k}" for k in self._required_snap_configs if not snap_configs.get(k)]
+        is_leader = self.model.unit.is_leader()
+        return WantedState(
+            installed=is_leader or bool(self._charm.config.get("warm-standby", True)),
+            config=snap_configs,
+            missing_config=missing,
+            running=is_leader and not missing,
+        )
+
+    def _install_wanted_snap(self, event: ops.EventBase) -> bool:
+        """Install the snap, or refresh it to the wanted channel or charm resource.
 
-        missing = [k for k in self._required_snap_configs if not snap_configs.get(k)]
-        if not missing:
+        Return True once the snap is installed. While a snapd change is in progress, or if the
+        install failed, the unit status reports it and False is returned. A failed snapd change
+        is not submitted again until the charm config changes, the charm is upgraded or the
+        `refresh-snap` action runs.
+        """
+        if isinstance(event, (ops.ConfigChangedEvent, ops.UpgradeCharmEvent)):
+            self._stored.snap_change_error = ""
+        if self._staggered_refresh:
+            # Channel changes are rolled out in the batches handed out by the leader.
+            self._roll_out_snap_refresh()
+            refresh = False
+        else:
+            refresh = self._snap_channel_changed
+
+        try:
+            if self._stored.snap_change_id:
+                # The staggered refresh just submitted the refresh of this unit to snapd.
+                pass
+            elif self._stored.snap_change_error:
+                logger.debug(f"### Not retrying the failed snapd change for {self._snap_name}.")
+                if not self._is_snap_installed:
+                    self._set_status(
+                        ops.BlockedStatus(f"Error installing the snap for {self._snap_name}")
+                    )
+                    return False
+            elif (
+                not self._is_snap_installed
+                or refresh
+                # Resources are only attached or emptied along with an upgrade-charm event.
+                or isinstance(event, (ops.InstallEvent, ops.UpgradeCharmEvent))
+            ):
+                self.install_snap()
+        except Exception as e:
+            logger.error(f"## Error installing {self._snap_name}: {e}")
+            self._set_status(ops.BlockedStatus(f"Error installing the snap for {self._snap_name}"))
+            return False
+
+        if self._stored.snap_change_id:
+            self._set_status(ops.MaintenanceStatus(f"Installing snap: {self._snap_name}"))
+            return False
+        return True
+
+    def _apply_wanted_config(self, wanted: WantedState) -> bool:
+        """Write the changed snap config keys and start or stop the daemon as wanted.
+
+        The snap config is only read back when the charm config differs from the one applied
+        last, and the daemon only bounced when the snap config changed. Return False if the
+        config could not be applied.
+        """
+        digest = hashlib.sha256(
+            json.dumps(wanted.config, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        changed = {}
+        if digest != self._stored.snap_config_digest:
+            changed = self._snap_config_delta(wanted.config)
+        active = self._is_snap_active
+        if changed:
+            if active:
+                self.run_snap_service("stop")
+                active = False
+            try:
+                self.set_snap_config(changed)
+            except AgentSnapperError as e:
+                logger.error(f"## Error configuring {self._snap_name}: {e}")
+                self._set_status(ops.BlockedStatus(str(e)))
+                return False
+        else:
+            logger.debug(f"## Snap config for {self._snap_name} unchanged.")
+        self._stored.snap_config_digest = digest
+
+        if wanted.running and not active:
+            self.run_snap_service("start")
+        elif not wanted.running and active:
+            logger.debug(f"## Not the leader, standing {self._snap_name} by.")
             self.run_snap_service("stop")
-            for k, v in snap_configs.items():
-                self._sys_exec(self._snap_path, "set", self._snap_name, f"{k}={v}")
+        return True
+
+    def _publish_leader(self) -> None:
+        """Name this unit as the leader in the peer relation.
+
+        The change of the application databag wakes up the other units, so the former leader
+        stops its daemon right away.
+        """
+        relation = self._refresh_relation
+        key = f"{self._snap_name}-leader"
+        if relation is not None and relation.data[self.model.app].get(key) != self.model.unit.name:
+            relation.data[self.model.app][key] = self.model.unit.name
+
+    def _on_collect_unit_status(self, event: ops.CollectStatusEvent) -> None:
+        """Report the status of the snap set during this hook dispatch."""
+        if self._status is not None:
+            event.add_status(self._status)
+
+    @timed_handler
+    def _on_refresh_snap_action(self, event: ops.ActionEvent) -> None:
+        """Refresh the snap even if it looks up to date."""
+        logger.debug(f"## Processing refresh-snap action for {self._snap_name}.")
+        self._stored.snap_change_error = ""
+        try:
+            self.install_snap(force=True)
+        except Exception as e:
+            event.fail(f"Error refreshing {self._snap_name}: {e}")
+            return
 
-            if self.model.unit.is_leader():
-                self.run_snap_service("start")
+        if self._stored.snap_change_id:
+            event.set_results({self._result_key("change-id"): self._stored.snap_change_id})
+            return
+        if self._staggered_refresh:
+            # Let a halted rollout resume once the failed unit has been refreshed by hand.
+            self._roll_out_snap_refresh()
+        info = self._backend.info(self._snap_name)
+        if info is not None:
+            event.set_results(
+                {
+                    self._result_key("revision"): info.revision,
+                    self._result_key("channel"): info.channel,
+                }
+            )
 
-            self._on_update_status(event)
+    def _on_show_timings_action(self, event: ops.ActionEvent) -> None:
+        """Return the recorded snap operation and event handler timings."""
+        if not self._timings.load():
+            event.fail("No timings recorded yet. Set the timings-enabled config to record them.")
             return
+        event.set_results({self._result_key("timings"): self._timings.summary()})
 
-        missing_configs = [f"{prefix}{k}" for k in missing]
-        self._charm.unit.status = ops.BlockedStatus(
-            f"Cannot start {self._snap_name}. Missing Config: {', '.join(missing_configs)}"
+    def _on_journal_summary_action(self, event: ops.ActionEvent) -> None:
+        """Return the summary of the daemon journal at the last and since the last check."""
+        try:
+            summary, _ = scan_journal(self._exec, self._daemon_unit, self._stored.journal_cursor)
+        except SnapperSysCallError as e:
+            event.fail(f"Cannot read the journal of {self._daemon_unit}: {e}")
+            return
+        event.set_results(
+            {
+                self._result_key("journal"): {
+                    "last-check": self._journal_summary.results(),
+                    "since-last-check": summary.results(),
+                }
+            }
         )
 
+    def _on_commit(self, event: ops.CommitEvent) -> None:
+        """Save the timings recorded during this hook dispatch."""
+        self._timings.flush()
+
+    @timed_handler
     def _on_stop(self, event: ops.StopEvent):
         """Perform stop operations."""
         logger.debug(f"## Processing stop event for {self._snap_name}.")
-        self._charm.unit.status = ops.MaintenanceStatus()
+        self._set_status(ops.MaintenanceStatus())
         self.run_snap_service("stop")
 
+    @timed_handler
     def _on_remove(self, event: ops.RemoveEvent):
         """Perform remove operations."""
         logger.debug(f"## Processing remove event for {self._snap_name}.")
         self.remove_snap()
 
-    def _on_update_status(
-        self, event: Union[ops.ConfigChangedEvent, ops.UpdateStatusEvent, ops.InstallEvent]
-    ) -> None:
-        """Update the charm status based on snap state."""
-        if self.model.unit.is_leader():
-            if self._is_snap_active:
-                self._charm.unit.status = ops.ActiveStatus()
-            else:
-                self._charm.unit.status = ops.BlockedStatus("Cannot start snap.")
-        else:
-            self._charm.unit.status = ops.ActiveStatus(f"{self._snap_name} status: standby")
-
     ## Operations
     @property
     def _is_snap_installed(self) -> bool:
         """Return True if the snap is installed, else False."""
         logger.debug(f"### Checking if snap {self._snap_name} is installed")
         try:
-            self._sys_exec(
-                self._snap_path,
-                "list",
-                self._snap_name,
-            )
-            return True
+            return self._backend.info(self._snap_name) is not None
         except SnapperSysCallError:
             return False
 
     @property
     def _is_snap_active(self) -> bool:
         """Return True if the snap service is active, else False."""
+        return self.daemon_health.state == "active"
+
+    @property
+    def _daemon_unit(self) -> str:
+        """Return the systemd unit of the snap daemon."""
+        return f"snap.{self._snap_name}.daemon.service"
+
+    @property
+    def daemon_health(self) -> DaemonHealth:
+        """Return the health of the snap daemon.
+
+        It is read from the `snap.<name>.daemon.service` unit over the systemd D-Bus API, and
+        from `snap services`, which only tells if the daemon is active, when the system bus
+        cannot be reached.
+        """
         logger.debug(f"### Checking active status for {self._snap_name}.daemon")
+        if self._daemon_probe is None:
+            self._daemon_probe = SystemdProbe(self._system_bus_socket)
+        if self._daemon_probe.available:
+            try:
+                return self._daemon_probe.health(self._daemon_unit)
+            except DBusError as e:
+                logger.warning(f"### Cannot probe {self._snap_name}.daemon from systemd: {e}")
+        try:
+            services = self._backend.services(self._snap_name)
+        except SnapperSysCallError:
+            return DaemonHealth(state="inactive")
+        return DaemonHealth(state=services.get("daemon", "inactive"))
+
+    @property
+    def _journal_summary(self) -> JournalSummary:
+        """Return the summary of the daemon journal saved by the last scan."""
+        if not self._stored.journal_summary:
+            return JournalSummary()
+        return JournalSummary.from_dict(json.loads(self._stored.journal_summary))
+
+    def _set_daemon_status(self, event: ops.EventBase) -> None:
+        """Set the status from the health of the daemon on the leader, standby elsewhere."""
+        if not self.model.unit.is_leader():
+            self._set_status(ops.ActiveStatus(f"{self._snap_name} status: standby"))
+        elif halted := self._snap_refresh_rollout.get("halted"):
+            self._set_status(ops.BlockedStatus(halted))
+        elif (health := self.daemon_health).state == "active":
+            if isinstance(event, ops.UpdateStatusEvent):
+                self._scan_journal()
+            summary = self._journal_summary
+            self._set_status(ops.ActiveStatus(summary.message() if summary.entries else ""))
+        elif health.state == "restarting":
+            self._set_status(
+                ops.MaintenanceStatus(
+                    f"{self._snap_name} daemon restarting ({health.restarts} restarts)"
+                )
+            )
+        else:
+            self._set_status(ops.BlockedStatus("Cannot start snap."))
+
+    def _scan_journal(self) -> None:
+        """Sum up the daemon journal entries written since the last scan and save the summary.
+
+        Only the entries after the saved journal cursor are read.
+        """
         try:
-            status_output = self._sys_exec(
-                self._snap_path,
-                "services",
-                f"{self._snap_name}.daemon",
+            summary, cursor = scan_journal(
+                self._exec, self._daemon_unit, self._stored.journal_cursor
             )
+        except SnapperSysCallError as e:
+            logger.warning(f"### Cannot read the journal of {self._daemon_unit}: {e}")
+            if "cursor" in e.stderr:
+                # The entry of the cursor was rotated away, start over from the latest entries.
+                self._stored.journal_cursor = ""
+            return
+        self._stored.journal_cursor = cursor
+        self._stored.journal_summary = json.dumps(summary.to_dict())
+
+    def install_snap(self, force: bool = False) -> None:
+        """Install or refresh the snap.
+
+        The snap attached as the `<snap>-snap` charm resource is installed when there is one,
+        otherwise the snap is installed from the store channel. An installed snap is only
+        refreshed when `snap-channel` changed or the store has a newer revision, unless
+        `force` is set. With `async_install`, the store install is only submitted and its
+        snapd change ID stored, to be followed by `_check_snap_change`.
+        """
+        snap_file = self._fetch_resource(f"{self._snap_name}-snap")
+        if snap_file is not None:
+            self._install_snap_resource(snap_file, force=force)
+            return
+        self._stored.snap_resource_digest = ""
+
+        channel = str(self._charm.config["snap-channel"])
+        installed = self._is_snap_installed
+        if not installed:
+            # A fresh install starts from the default snap config.
+            self._stored.snap_config_digest = ""
+        if installed and not force and not self._snap_refresh_needed():
+            logger.debug(f"### {self._snap_name} is up to date on {channel}, skipping refresh.")
+            return
+
+        if self._async_install:
+            if self._stored.snap_change_id:
+                logger.debug(f"### Snapd change {self._stored.snap_change_id} still in progress.")
+                return
+            if not installed:
+                logger.debug(f"### Submitting install of {self._snap_name}.")
+                change_id = self._backend.submit_install(self._snap_name, channel, classic=True)
+            else:
+                logger.debug(f"### Submitting refresh of {self._snap_name}.")
+                change_id = self._backend.submit_refresh(self._snap_name, channel, classic=True)
+            self._stored.snap_change_id = change_id
+            self._stored.snap_change_error = ""
+            return
+
+        if not installed:
+            logger.debug(f"### Installing {self._snap_name}.")
+            self._backend.install(self._snap_name, channel, classic=True)
+        else:
+            logger.debug(f"### Refreshing {self._snap_name} (already installed).")
+            self._backend.refresh(self._snap_name, channel, classic=True)
+
+    @property
+    def _snap_channel_changed(self) -> bool:
+        """Return True if the installed snap does not track the `snap-channel` config."""
+        if self._stored.snap_resource_digest:
+            # Installed from a charm resource, which does not track any channel.
+            return False
+        try:
+            info = self._backend.info(self._snap_name)
         except SnapperSysCallError:
             return False
+        if info is None:
+            return False
+        channel = str(self._charm.config["snap-channel"])
+        return self._full_channel(info.channel) != self._full_channel(channel)
 
-        # Parse the output for the service status
-        for line in status_output.splitlines():
-            if line.startswith(f"{self._snap_name}.daemon"):
-                parts = line.split()
-                if len(parts) >= 4 and parts[2] == "active":
-                    return True
-        return False
-
-    def install_snap(self) -> None:
-        """Install or refresh the snap."""
-        channel = self._charm.config["snap-channel"]
+    def _snap_refresh_needed(self) -> bool:
+        """Return True if refreshing the installed snap would change its channel or revision."""
+        if self._snap_channel_changed:
+            return True
+        try:
+            return self._backend.refresh_available(self._snap_name)
+        except SnapperSysCallError as e:
+            logger.warning(f"### Cannot check for {self._snap_name} updates: {e}")
+            return False
+
+    @staticmethod
+    def _full_channel(channel: str) -> str:
+        """Expand a channel to its `<track>/<risk>[/<branch>]` form, as tracked by snapd."""
+        parts = channel.split("/")
+        if parts[0] in ("stable", "candidate", "beta", "edge"):
+            parts.insert(0, "latest")
+        if len(parts) == 1:
+            parts.append("stable")
+        return "/".join(parts)
+
+    def _fetch_resource(self, name: str) -> Optional[Path]:
+        """Return the path of an attached charm resource, or None if it is not attached.
+
+        Empty files, as uploaded to Charmhub as placeholders, count as not attached.
+        """
+        try:
+            path = self.model.resources.fetch(name)
+        except (NameError, ops.ModelError):
+            return None
+        return path if path.stat().st_size else None
+
+    def _install_snap_resource(self, snap_file: Path, force: bool = False) -> None:
+        """Install the snap attached as charm resource, unless it is already installed."""
+        assertion_file = self._fetch_resource(f"{self._snap_name}-snap-assertion")
+        digest = hashlib.sha256()
+        for path in filter(None, (snap_file, assertion_file)):
+            with path.open("rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+
+        unchanged = digest.hexdigest() == self._stored.snap_resource_digest
+        if unchanged and not force and self._is_snap_installed:
+            logger.debug(f"### Snap resource for {self._snap_name} unchanged, skipping install.")
+            return
+        logger.debug(f"### Installing {self._snap_name} from resource {snap_file}.")
         if not self._is_snap_installed:
-            logger.debug(f"### Installing {self._snap_name}.")
-            self._sys_exec(
-                self._snap_path,
-                "install",
-                "--channel",
-                channel,
-                "--classic",
-                self._snap_name,
+            self._stored.snap_config_digest = ""
+        self._backend.install_file(self._snap_name, snap_file, assertion_file, classic=True)
+        self._stored.snap_resource_digest = digest.hexdigest()
+
+    def _check_snap_change(self) -> bool:
+        """Follow the snapd change submitted by `install_snap`.
+
+        Return True once the change finished successfully. While it is in progress, or if it
+        failed, the unit status reports it and False is returned.
+        """
+        change_id = self._stored.snap_change_id
+        try:
+            change = self._backend.change(change_id)
+        except SnapperSysCallError as e:
+            # snapd prunes old changes, so a lost change is handled as finished.
+            logger.error(f"### Cannot get snapd change {change_id}: {e}")
+            self._stored.snap_change_id = ""
+            self._backend.invalidate(self._snap_name)
+            return self._is_snap_installed
+
+        if not change.ready:
+            logger.debug(f"### Snapd change {change_id} in progress: {change.progress}")
+            self._set_status(
+                ops.MaintenanceStatus(
+                    f"Installing {self._snap_name}: {change.progress or change.status}"
+                )
             )
-        else:
-            logger.debug(f"### Refreshing {self._snap_name} (already installed).")
-            self._sys_exec(
-                self._snap_path,
-                "refresh",
-                "--channel",
-                channel,
-                "--classic",
-                self._snap_name,
+            return False
+
+        self._stored.snap_change_id = ""
+        self._backend.invalidate(self._snap_name)
+        if change.status != "Done":
+            logger.error(f"### Snapd change {change_id} failed: {change.err}")
+            self._stored.snap_change_error = change.err or change.status
+            self._set_status(ops.BlockedStatus(f"Error installing the snap for {self._snap_name}"))
+            return False
+        logger.debug(f"Snap for {self._snap_name} installed")
+        return True
+
+    ## Staggered refresh
+    @property
+    def _refresh_relation(self) -> Optional[ops.Relation]:
+        """Return the peer relation coordinating snap refreshes, if the charm has one."""
+        if self._REFRESH_PEER not in self._charm.meta.peers:
+            return None
+        return self.model.get_relation(self._REFRESH_PEER)
+
+    @property
+    def _staggered_refresh(self) -> bool:
+        """Return True if snap refreshes are rolled out in batches handed out by the leader."""
+        batch_size = int(self._charm.config.get("snap-refresh-batch-size", 0))
+        return batch_size > 0 and self._refresh_relation is not None
+
+    @property
+    def _snap_refresh_rollout(self) -> Dict[str, Any]:
+        """Return the rollout published by the leader: target channel, granted units, halt."""
+        relation = self._refresh_relation
+        if relation is None:
+            return {}
+        return json.loads(relation.data[self.model.app].get(f"{self._snap_name}-refresh", "{}"))
+
+    def _roll_out_snap_refresh(self) -> None:
+        """Hand out refresh slots on the leader, then refresh this unit if it holds one."""
+        relation = self._refresh_relation
+        if relation is None:
+            return
+        if self.model.unit.is_leader():
+            self._grant_snap_refresh(relation)
+        self._follow_snap_refresh(relation)
+
+    def _grant_snap_refresh(self, relation: ops.Relation) -> None:
+        """Grant the next batch of units the right to refresh, once the previous one is done.
+
+        Units report their result in their own databag. The rollout halts while any unit
+        reports a failure for the current channel.
+        """
+        key = f"{self._snap_name}-refresh"
+        channel = str(self._charm.config["snap-channel"])
+        rollout = self._snap_refresh_rollout
+        if rollout.get("channel") != channel:
+            rollout = {"channel": channel, "granted": [], "halted": ""}
+
+        units = sorted(
+            {self.model.unit, *relation.units}, key=lambda unit: int(unit.name.split("/")[-1])
+        )
+        reports = {}
+        for unit in units:
+            report = json.loads(relation.data[unit].get(key, "{}"))
+            if report.get("channel") == channel:
+                reports[unit.name] = report.get("status")
+        done = {name for name, status in reports.items() if status == "done"}
+        failed = sorted(name for name, status in reports.items() if status == "failed")
+        rollout["halted"] = (
+            f"Snap refresh to {channel} halted, failed on: {', '.join(failed)}" if failed else ""
+        )
+
+        # Units that left the relation give their slot back.
+        in_progress = [
+            name
+            for name in rollout["granted"]
+            if name not in done and name in {unit.name for unit in units}
+        ]
+        if not failed and not in_progress:
+            batch_size = int(self._charm.config.get("snap-refresh-batch-size", 0))
+            rollout["granted"] = [unit.name for unit in units if unit.name not in done][
+                :batch_size
+            ]
+            if rollout["granted"]:
+                logger.debug(f"### Granting {self._snap_name} refresh to {rollout['granted']}")
+
+        relation.data[self.model.app][key] = json.dumps(rollout)
+
+    def _follow_snap_refresh(self, relation: ops.Relation) -> None:
+        """Refresh the snap when this unit was granted a slot, and report the result."""
+        key = f"{self._snap_name}-refresh"
+        rollout = self._snap_refresh_rollout
+        channel = rollout.get("channel")
+        if not channel or channel != str(self._charm.config["snap-channel"]):
+            # The leader did not publish the rollout for the current channel yet.
+            return
+        report = json.loads(relation.data[self.model.unit].get(key, "{}"))
+        reported = report.get("status") if report.get("channel") == channel else None
+        if self._stored.snap_change_id or not self._is_snap_installed:
+            return
+
+        # A "done" report is only trusted while the snap tracks the channel: it is stale once
+        # the snap was refreshed elsewhere by hand.
+        status = ""
+        if not self._snap_channel_changed:
+            status = "done"
+        elif reported == "failed":
+            # The rollout stays halted until this unit is refreshed by hand.
+            return
+        elif self._stored.snap_change_error:
+            status = "failed"
+        elif self.model.unit.name in rollout.get("granted", []):
+            logger.debug(f"### Refreshing {self._snap_name} to {channel} in granted slot.")
+            try:
+                self.install_snap()
+            except Exception as e:
+                logger.error(f"## Error refreshing {self._snap_name}: {e}")
+                status = "failed"
+            else:
+                status = "" if self._stored.snap_change_id else "done"
+        elif reported == "done":
+            # Withdraw the stale report, so that the leader grants this unit a slot again.
+            status = "pending"
+
+        if status and status != reported:
+            relation.data[self.model.unit][key] = json.dumps(
+                {"channel": channel, "status": status}
             )
 
     def get_snap_config(self) -> dict:
         """Get the current snap configuration as a dictionary."""
         logger.debug(f"#### Fetching current config for {self._snap_name}.")
         try:
-            config_output = self._sys_exec(
-                self._snap_path,
-                "get",
-                "-d",
-                self._snap_name,
-            )
+            return self._backend.get_config(self._snap_name)
         except SnapperSysCallError:
             return {}
+
+    def _snap_config_delta(self, snap_config: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the subset of `snap_config` that differs from the config applied to the snap."""
+        current = self.get_snap_config()
+        return {
+            k: v
+            for k, v in snap_config.items()
+            if self._snap_config_value(current.get(k)) != self._snap_config_value(v)
+        }
+
+    @staticmethod
+    def _snap_config_value(value: Any) -> str:
+        """Normalize a config value to the string form given to `snap set`.
+
+        snapd stores JSON-looking values (e.g. `10`, `true`) typed, and treats unset keys the
+        same as empty ones for our agents.
+        """
+        if value is None:
+            return ""
+        if isinstance(value, str):
+            return value
+        return json.dumps(value)
+
+    def set_snap_config(self, snap_config: Dict[str, Any]) -> None:
+        """Apply the snap configuration in a single `snap set` transaction.
+
+        All the keys are written by one snapd change, so the snap configure hook only runs once.
+        Raises AgentSnapperError naming the offending keys if the change fails.
+        """
+        if not snap_config:
+            return
+        logger.debug(f"#### Setting config keys {sorted(snap_config)} for {self._snap_name}.")
         try:
-            snap_config = json.loads(config_output)
-        except json.JSONDecodeError:
-            logger.error("#### Error decoding snap config")
-            return {}
-        return snap_config
+            self._backend.set_config(self._snap_name, snap_config)
+        except SnapperSysCallError as e:
+            # snapd rolls back the whole change, so report the keys named in the error when
+            # there are any, otherwise the whole batch is suspect.
+            failed = [k for k in snap_config if k in e.stderr] or list(snap_config)
+            raise AgentSnapperError(
+                f"Cannot configure {self._snap_name}. Failed config: {', '.join(failed)}"
+            ) from e
 
     def remove_snap(self) -> None:
         """Remove the snap from the system."""
         logger.debug(f"### Removing {self._snap_name}.")
-        self._sys_exec(
-            self._snap_path,
-            "remove",
-            self._snap_name,
-        )
+        self._stored.snap_config_digest = ""
+        self._backend.remove(self._snap_name)
 
     def run_snap_service(self, service: str) -> None:
         """Run a snap service (e.g., start/stop daemon)."""
         logger.debug(f"### Running {self._snap_name}.{service}")
         try:
-            self._sys_exec(
-                self._snap_path,
-                "run",
-                f"{self._snap_name}.{service}",
-            )
+            self._backend.run(self._snap_name, service)
         except SnapperSysCallError as e:
             logger.error(f"Error running {self._snap_name}.{service}: {e}")
 
+    def _exec(self, *cmd: Any) -> str:
+        """Execute a snap command within its timeout, retrying transient failures."""
+        verb = str(cmd[1]) if len(cmd) > 1 else ""
+        timeout = self._snap_timeouts.get(verb, self._snap_timeouts["default"])
+        return self._retry.call(self._timings.wrap_exec(self._sys_exec), *cmd, timeout=timeout)
+
     @staticmethod
-    def _sys_exec(*cmd: Any) -> str:
+    def _sys_exec(*cmd: Any, timeout: Optional[float] = None) -> str:
         """Execute a system command and return its output.
 
-        Raises SnapperSysCallError on failure.
+        The command runs in its own session, so that its whole process tree is killed if it
+        does not finish within `timeout` seconds.
+
+        Raises SnapperTimeoutError on timeout and SnapperSysCallError on failure.
         """
         str_cmd = [str(p) for p in cmd]
         logger.debug(f"-----> Running command in subprocess: {shlex.join(str_cmd)}")
         try:
-            result = subprocess.run(str_cmd, capture_output=True, check=False)
+            proc = subprocess.Popen(
+                str_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True
+            )
         except Exception as exc:
             message = f"{shlex.join(str_cmd)} - {exc}"
             logger.error(f"Invalid system command: {message}")
             raise SnapperSysCallError(f"System command failed: {message}")
 
-        if result.returncode != 0:
-            err = result.stderr.decode("utf-8")
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            AgentSnapper._kill_process_group(proc)
+            message = f"{shlex.join(str_cmd)} - timed out after {timeout}s"
+            logger.error(f"Error executing command: {message}")
+            raise SnapperTimeoutError(f"System command failed: {message}")
+
+        if proc.returncode != 0:
+            err = stderr.decode("utf-8")
             message = f"{shlex.join(str_cmd)} - {err}"
             logger.error(f"Error executing command: {message}")
-            raise SnapperSysCallError(f"System command failed: {message}")
+            raise SnapperSysCallError(f"System command failed: {message}", stderr=err)
 
-        out = result.stdout.decode("utf-8")
+        out = stdout.decode("utf-8")
         logger.debug(f"-----> Command succeeded: {out.strip()}")
         return out
+
+    @staticmethod
+    def _kill_process_group(proc: subprocess.Popen, grace: float = 5.0) -> None:
+        """Terminate the process group of `proc`, killing it if it outlives the grace period."""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                break
+            try:
+                proc.communicate(timeout=grace)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        else:
+            proc.wait()
+
+
+class MultiAgentSnapper(ops.Object):
+    """Manage several Snapped Vantage Agents from a single charm.
+
+    Each snap gets its own `AgentSnapper`, configured from the charm config keys prefixed by its
+    name and checked against its own required keys, but all of them share one snap backend, so
+    the snapd connection and the cached snap state serve the whole hook dispatch. The unit
+    status combines the status of every snap, showing the most severe one.
+    """
+
+    # Unit status names, from the most to the least severe.
+    _STATUS_SEVERITY = ("blocked", "maintenance", "waiting", "active")
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        snaps: Dict[str, List[str]],
+        async_install: bool = False,
+        snap_timeouts: Optional[Dict[str, float]] = None,
+    ):
+        """Initialize the MultiAgentSnapper.
+
+        Args:
+            charm: The parent CharmBase instance.
+            snaps: The names of the snaps to manage, mapped to their additional required snap
+                config keys.
+            async_install: Submit snap installs and refreshes to snapd without waiting for
+                them (optional).
+            snap_timeouts: Timeouts in seconds of the snap operations by `snap` command verb
+                (optional).
+        """
+        super().__init__(charm, None)
+        self._charm = charm
+        self.snappers = {
+            name: AgentSnapper(
+                charm,
+                name,
+                required_snap_config=required,
+                async_install=async_install,
+                snap_timeouts=snap_timeouts,
+                multi=self,
+            )
+            for name, required in snaps.items()
+        }
+        self._charm.framework.observe(
+            self._charm.on.collect_unit_status, self._on_collect_unit_status
+        )
+
+    @property
+    def primary(self) -> AgentSnapper:
+        """Return the snapper owning the snap backend shared by all the snappers."""
+        return next(iter(self.snappers.values()))
+
+    def _on_collect_unit_status(self, event: ops.CollectStatusEvent) -> None:
+        """Report the most severe status of the snaps, with the messages of all of them."""
+        statuses = {
+            name: snapper._status
+            for name, snapper in self.snappers.items()
+            if snapper._status is not None
+        }
+        if not statuses:
+            return
+        worst = min(
+            statuses.values(),
+            key=lambda s: (
+                self._STATUS_SEVERITY.index(s.name)
+                if s.name in self._STATUS_SEVERITY
+                else len(self._STATUS_SEVERITY)
+            ),
+        )
+        messages = [
+            status.message if name in status.message else f"{name}: {status.message}"
+            for name, status in statuses.items()
+            if status.name == worst.name and status.message
+        ]
+        event.add_status(ops.StatusBase.from_name(worst.name, "; ".join(messages)))
@@ -0,0 +1,36 @@
+"""Exceptions raised by the Agent Snapper library."""
+
+
+class AgentSnapperError(Exception):
+    """Exception raised by the AgentSnapper."""
+
+    pass
+
+
+class SnapperSysCallError(Exception):
+    """Raise exception from syscall execution."""
+
+    def __init__(self, message: str, stderr: str = ""):
+        super().__init__(message)
+        self.stderr = stderr
+
+
+class SnapdError(SnapperSysCallError):
+    """Raise exception from a snapd REST API request."""
+
+    def __init__(self, message: str, kind: str = "", status_code: int = 0):
+        super().__init__(message, stderr=message)
+        self.kind = kind
+        self.status_code = status_code
+
+
+class SnapdConnectionError(SnapdError):
+    """Raise exception when the snapd socket cannot be reached."""
+
+    pass
+
+
+class SnapperTimeoutError(SnapperSysCallError):
+    """Raise exception when a system command or snapd change does not finish in time."""
+
+    pass
@@ -0,0 +1,119 @@
+"""Incremental scan of the journal of a snap daemon.
+
+`scan_journal` reads the journal entries of a systemd unit written after a cursor, and sums up
+the errors, tracebacks and scheduled task jobs of the agent found in them. Only the new entries
+are read, so the cost of a scan does not grow with the size of the journal.
+"""
+
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger()
+
+# Number of entries read when there is no cursor yet, e.g. on the first scan.
+INITIAL_ENTRIES = 1000
+
+# Number of error messages kept in the summary.
+LAST_ERRORS = 5
+
+_ERROR = re.compile(r"\b(ERROR|CRITICAL)\b|raised an exception")
+_TRACEBACK = "Traceback (most recent call last)"
+# The agents schedule their tasks with APScheduler, which logs when each job starts and ends.
+# Job names may contain spaces, and are followed by the trigger of the job when it has one.
+_JOB = r'"(?P<job>.+?)(?: \(trigger:[^"]*)?"'
+_JOB_STARTED = re.compile(rf"Running job {_JOB}")
+_JOB_DONE = re.compile(rf"Job {_JOB} (?:executed successfully|raised an exception)")
+
+
+@dataclass
+class JournalSummary:
+    """Summary of the journal entries of an agent daemon."""
+
+    entries: int = 0
+    errors: int = 0
+    tracebacks: int = 0
+    jobs: int = 0
+    job_seconds: float = 0.0
+    job_max_seconds: float = 0.0
+    last_errors: List[str] = field(default_factory=list)
+
+    @property
+    def job_mean_seconds(self) -> float:
+        """Return the mean duration of the task jobs."""
+        return self.job_seconds / self.jobs if self.jobs else 0.0
+
+    def message(self) -> str:
+        """Return a short summary for the unit status."""
+        parts = [f"{self.errors} errors", f"{self.tracebacks} tracebacks", f"{self.jobs} jobs"]
+        if self.jobs:
+            parts[-1] += f" avg {self.job_mean_seconds:.1f}s"
+        return ", ".join(parts)
+
+    def results(self) -> Dict[str, str]:
+        """Return the summary as action results."""
+        return {
+            "entries": str(self.entries),
+            "errors": str(self.errors),
+            "tracebacks": str(self.tracebacks),
+            "jobs": str(self.jobs),
+            "job-mean-seconds": f"{self.job_mean_seconds:.3f}",
+            "job-max-seconds": f"{self.job_max_seconds:.3f}",
+            "last-errors": "\n".join(self.last_errors),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the summary as a JSON serializable dict."""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "JournalSummary":
+        """Return the summary saved by `to_dict`."""
+        return cls(**data)
+
+
+def scan_journal(
+    sys_exec: Callable[..., str], unit: str, cursor: str = ""
+) -> Tuple[JournalSummary, str]:
+    """Sum up the journal entries of `unit` written after `cursor`.
+
+    Without a cursor, the last `INITIAL_ENTRIES` entries are read. Returns the summary and the
+    cursor to resume the next scan from.
+    """
+    cmd = ["journalctl", f"--unit={unit}", "--output=json", "--output-fields=MESSAGE,PRIORITY"]
+    cmd += [f"--after-cursor={cursor}"] if cursor else [f"--lines={INITIAL_ENTRIES}"]
+    output = sys_exec(*cmd, "--no-pager", "--quiet")
+
+    summary = JournalSummary()
+    running: Dict[str, int] = {}
+    for line in output.splitlines():
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        cursor = entry.get("__CURSOR", cursor)
+        summary.entries += 1
+        message = entry.get("MESSAGE") or ""
+        if isinstance(message, list):
+            # Messages that are not valid UTF-8 are exported as byte arrays.
+            message = bytes(message).decode("utf-8", errors="replace")
+
+        if _TRACEBACK in message:
+            summary.tracebacks += 1
+        if _ERROR.search(message) or int(entry.get("PRIORITY", 6)) <= 3:
+            summary.errors += 1
+            summary.last_errors = (summary.last_errors + [message.strip()[:200]])[-LAST_ERRORS:]
+
+        timestamp = int(entry.get("__REALTIME_TIMESTAMP", 0))
+        if started := _JOB_STARTED.search(message):
+            running[started["job"]] = timestamp
+        elif (done := _JOB_DONE.search(message)) and done["job"] in running:
+            seconds = (timestamp - running.pop(done["job"])) / 1e6
+            summary.jobs += 1
+            summary.job_seconds += seconds
+            summary.job_max_seconds = max(summary.job_max_seconds, seconds)
+
+    logger.debug(f"### Scanned {summary.entries} journal entries of {unit}")
+    return summary, cursor
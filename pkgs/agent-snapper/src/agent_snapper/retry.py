@@ -0,0 +1,66 @@
+"""Retries of transient snap failures for the Agent Snapper library."""
+
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Tuple
+
+from agent_snapper.errors import SnapdError, SnapperSysCallError, SnapperTimeoutError
+
+logger = logging.getLogger()
+
+# snapd error kinds and snap CLI messages of failures that go away on their own, typically
+# because another change holds the snap or snapd is restarting.
+TRANSIENT_KINDS = ("snap-change-conflict",)
+TRANSIENT_MESSAGES = (
+    "changes in progress",
+    "change in progress",
+    "too early for operation",
+    "cannot communicate with server",
+)
+
+
+def is_transient(error: Exception) -> bool:
+    """Return True if the failed snap operation is worth retrying."""
+    if isinstance(error, SnapdError) and error.kind in TRANSIENT_KINDS:
+        return True
+    if isinstance(error, SnapperTimeoutError) or not isinstance(error, SnapperSysCallError):
+        return False
+    return any(message in error.stderr for message in TRANSIENT_MESSAGES)
+
+
+@dataclass
+class RetryPolicy:
+    """Retry transient failures with jittered exponential backoff.
+
+    Attributes:
+        attempts: Maximum number of calls, including the first one.
+        base_delay: Upper bound in seconds of the delay before the first retry.
+        max_delay: Upper bound in seconds of the delay before any retry.
+        retry_on: Predicate telling if an error is transient.
+    """
+
+    attempts: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 15.0
+    retry_on: Callable[[Exception], bool] = is_transient
+
+    def delays(self) -> Tuple[float, ...]:
+        """Return the random delays to wait between the attempts ("full jitter")."""
+        return tuple(
+            random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+            for attempt in range(self.attempts - 1)
+        )
+
+    def call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call `func` until it succeeds, fails with a permanent error or runs out of attempts."""
+        for delay in self.delays():
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not self.retry_on(e):
+                    raise
+                logger.warning(f"## Transient error, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+        return func(*args, **kwargs)
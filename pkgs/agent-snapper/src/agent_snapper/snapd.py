@@ -0,0 +1,279 @@
+"""Minimal snapd REST API client.
+
+Talks HTTP/1.1 to snapd over its unix socket and decodes the JSON envelopes documented at
+https://snapcraft.io/docs/snapd-api. A single connection is kept open and reused for every
+request made by the client, so one hook dispatch only pays for one connect.
+"""
+
+import http.client
+import json
+import logging
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from agent_snapper.errors import SnapdConnectionError, SnapdError, SnapperTimeoutError
+from agent_snapper.retry import RetryPolicy
+from agent_snapper.timing import TimingRecorder
+
+logger = logging.getLogger()
+
+SNAPD_SOCKET = Path("/run/snapd.socket")
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix domain socket."""
+
+    def __init__(self, socket_path: Path, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self) -> None:
+        """Connect to the unix socket instead of a TCP host."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(str(self._socket_path))
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class SnapdClient:
+    """Client for the snapd REST API."""
+
+    def __init__(
+        self,
+        socket_path: Path = SNAPD_SOCKET,
+        timeout: float = 30.0,
+        timings: Optional[TimingRecorder] = None,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        """Initialize the client.
+
+        Args:
+            socket_path: Path of the snapd unix socket.
+            timeout: Timeout in seconds for each socket operation.
+            timings: Recorder timing each request by route (optional).
+            retry: Policy retrying requests rejected with a transient error, such as a
+                conflict with another change in progress (optional).
+        """
+        self._socket_path = socket_path
+        self._timeout = timeout
+        self._retry = retry
+        self._timings = timings if timings is not None and timings.enabled else None
+        self._conn: Optional[_UnixHTTPConnection] = None
+
+    @property
+    def available(self) -> bool:
+        """Return True if the snapd socket exists."""
+        return self._socket_path.is_socket()
+
+    def close(self) -> None:
+        """Close the underlying connection."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        query: Optional[Dict[str, str]] = None,
+        body: Optional[Dict[str, Any]] = None,
+        data: Optional[bytes] = None,
+        content_type: str = "application/json",
+    ) -> Any:
+        """Send a request to snapd and return the decoded response.
+
+        `body` is sent as JSON, `data` is sent as is with the given `content_type`.
+        Returns the `result` of sync responses and the change ID of async responses.
+        Raises SnapdError for error responses and SnapdConnectionError when snapd is unreachable.
+        """
+        if self._retry is not None:
+            return self._retry.call(self._request, method, path, query, body, data, content_type)
+        return self._request(method, path, query, body, data, content_type)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        query: Optional[Dict[str, str]],
+        body: Optional[Dict[str, Any]],
+        data: Optional[bytes],
+        content_type: str,
+    ) -> Any:
+        """Send a single request to snapd, see `request`."""
+        url = path + (f"?{urlencode(query)}" if query else "")
+        payload = json.dumps(body).encode("utf-8") if body is not None else data
+        headers = {"Accept": "application/json"}
+        if payload is not None:
+            headers["Content-Type"] = content_type
+
+        logger.debug(f"-----> snapd request: {method} {url}")
+        if self._timings is None:
+            status, raw = self._send(method, url, payload, headers)
+        else:
+            with self._timings.timed("snapd", f"{method} {self._route(path)}") as timing:
+                status, raw = self._send(method, url, payload, headers)
+                timing.size = len(raw)
+
+        try:
+            document = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise SnapdError(
+                f"Invalid response from snapd for {method} {url}", status_code=status
+            ) from e
+
+        if document.get("type") == "error":
+            result = document.get("result") or {}
+            raise SnapdError(
+                result.get("message", f"snapd returned status {status}"),
+                kind=result.get("kind", ""),
+                status_code=status,
+            )
+        if document.get("type") == "async":
+            return document["change"]
+        return document.get("result")
+
+    def wait_change(self, change_id: str, timeout: float = 600.0) -> Dict[str, Any]:
+        """Poll a snapd change until it is ready.
+
+        Raises SnapdError if the change fails. If it does not finish within `timeout` seconds,
+        the change is aborted and SnapperTimeoutError is raised.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while True:
+            change = self.change(change_id)
+            if change.get("ready"):
+                if change.get("status") != "Done":
+                    raise SnapdError(
+                        change.get("err", f"snapd change {change_id} {change.get('status')}"),
+                        kind=change.get("kind", ""),
+                    )
+                return change
+            if time.monotonic() > deadline:
+                try:
+                    self.abort_change(change_id)
+                except SnapdError as e:
+                    logger.warning(f"Cannot abort snapd change {change_id}: {e}")
+                raise SnapperTimeoutError(
+                    f"Timed out after {timeout}s waiting for snapd change {change_id}"
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    @staticmethod
+    def _route(path: str) -> str:
+        """Return the API route of `path`, e.g. `/v2/snaps/{name}/conf`, to group timings."""
+        parts = path.split("/")
+        if len(parts) > 3:
+            parts[3] = "{id}" if parts[2] == "changes" else "{name}"
+        return "/".join(parts)
+
+    def _send(
+        self, method: str, url: str, payload: Optional[bytes], headers: Dict[str, str]
+    ) -> Tuple[int, bytes]:
+        """Send a request on the kept-alive connection and return the status and body."""
+        # snapd may have dropped the idle connection since the previous request, so retry
+        # once on a fresh connection before giving up.
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = _UnixHTTPConnection(self._socket_path, self._timeout)
+            try:
+                self._conn.request(method, url, body=payload, headers=headers)
+                response = self._conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self.close()
+                if attempt or isinstance(e, (FileNotFoundError, ConnectionRefusedError)):
+                    raise SnapdConnectionError(
+                        f"Cannot reach snapd at {self._socket_path}: {e}"
+                    ) from e
+        raise SnapdConnectionError(f"Cannot reach snapd at {self._socket_path}")
+
+    ## Endpoints
+    def change(self, change_id: str) -> Dict[str, Any]:
+        """Return the snapd change with the given ID."""
+        return self.request("GET", f"/v2/changes/{quote(change_id)}")
+
+    def abort_change(self, change_id: str) -> Dict[str, Any]:
+        """Abort a snapd change that is not ready yet."""
+        return self.request("POST", f"/v2/changes/{quote(change_id)}", body={"action": "abort"})
+
+    def snap(self, name: str) -> Optional[Dict[str, Any]]:
+        """Return the details of an installed snap, or None if it is not installed."""
+        try:
+            return self.request("GET", f"/v2/snaps/{quote(name)}")
+        except SnapdError as e:
+            if e.kind == "snap-not-found" or e.status_code == 404:
+                return None
+            raise
+
+    def find(self, **query: str) -> List[Dict[str, Any]]:
+        """Search the store, e.g. `select="refresh"` lists the snaps with an update available."""
+        try:
+            return self.request("GET", "/v2/find", query=query) or []
+        except SnapdError as e:
+            if e.kind == "snap-not-found" or e.status_code == 404:
+                return []
+            raise
+
+    def snap_action(self, name: str, action: str, **options: Any) -> str:
+        """Start an action (install, refresh, remove, ...) on a snap and return the change ID."""
+        return self.request("POST", f"/v2/snaps/{quote(name)}", body={"action": action, **options})
+
+    def apps(self, names: List[str], select: str = "service") -> List[Dict[str, Any]]:
+        """Return the apps of the given snaps, or services only when `select` is `service`."""
+        query = {"names": ",".join(names)}
+        if select:
+            query["select"] = select
+        return self.request("GET", "/v2/apps", query=query) or []
+
+    def app_action(self, action: str, names: List[str], **options: Any) -> str:
+        """Start, stop or restart snap services and return the change ID."""
+        return self.request("POST", "/v2/apps", body={"action": action, "names": names, **options})
+
+    def get_conf(self, name: str, keys: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Return the configuration of a snap, optionally limited to `keys`."""
+        query = {"keys": ",".join(keys)} if keys else None
+        return self.request("GET", f"/v2/snaps/{quote(name)}/conf", query=query) or {}
+
+    def set_conf(self, name: str, conf: Dict[str, Any]) -> str:
+        """Set configuration keys of a snap in one change and return the change ID."""
+        return self.request("PUT", f"/v2/snaps/{quote(name)}/conf", body=conf)
+
+    def ack(self, assertion: bytes) -> None:
+        """Add an assertion (e.g. a snap declaration and revision) to the system database."""
+        self.request(
+            "POST", "/v2/assertions", data=assertion, content_type="application/x.ubuntu.assertion"
+        )
+
+    def sideload(self, snap_file: Path, **options: bool) -> str:
+        """Install a local snap file and return the change ID.
+
+        `options` are snapd install flags such as `classic` or `dangerous`.
+        """
+        boundary = uuid.uuid4().hex
+        form = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'
+            f"{str(value).lower()}\r\n"
+            for key, value in {"action": "install", **options}.items()
+        )
+        form += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="snap"; '
+            f'filename="{snap_file.name}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        )
+        data = form.encode("utf-8") + snap_file.read_bytes() + f"\r\n--{boundary}--\r\n".encode()
+        return self.request(
+            "POST",
+            "/v2/snaps",
+            data=data,
+            content_type=f"multipart/form-data; boundary={boundary}",
+        )
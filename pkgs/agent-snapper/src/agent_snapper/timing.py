@@ -0,0 +1,204 @@
+"""Timing instrumentation for the Agent Snapper library.
+
+`TimingRecorder` measures snap CLI commands, snapd API requests and charm event handlers during
+a hook dispatch, then merges them into a rolling on-disk store and, optionally, a Prometheus
+textfile-collector file. A disabled recorder is never consulted on the hot path.
+"""
+
+import functools
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger()
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Number of individual samples kept in the store to compute percentiles.
+RECENT_SAMPLES = 500
+
+
+class Timing:
+    """Measurement of a single timed operation."""
+
+    def __init__(self, kind: str, name: str):
+        self.kind = kind
+        self.name = name
+        self.ok = True
+        self.size = 0
+        self.seconds = 0.0
+
+
+class TimingRecorder:
+    """Collect operation timings and persist them at the end of the hook dispatch."""
+
+    def __init__(
+        self,
+        store_path: Path,
+        labels: Dict[str, str],
+        enabled: bool = False,
+        textfile_path: Optional[Path] = None,
+    ):
+        """Initialize the recorder.
+
+        Args:
+            store_path: JSON file holding the aggregated timings across dispatches.
+            labels: Labels added to every exported metric (e.g. the snap name).
+            enabled: Whether timings are recorded at all.
+            textfile_path: Prometheus textfile-collector file to write (optional).
+        """
+        self.enabled = enabled
+        self._store_path = store_path
+        self._labels = labels
+        self._textfile_path = textfile_path
+        self._timings: List[Timing] = []
+
+    @contextmanager
+    def timed(self, kind: str, name: str) -> Iterator[Timing]:
+        """Time the body of the `with` block as operation `name` of the given `kind`."""
+        timing = Timing(kind, name)
+        start = time.perf_counter()
+        try:
+            yield timing
+        except BaseException:
+            timing.ok = False
+            raise
+        finally:
+            timing.seconds = time.perf_counter() - start
+            self._timings.append(timing)
+
+    def wrap_exec(self, sys_exec: Callable[..., str]) -> Callable[..., str]:
+        """Return `sys_exec` timing each command by its verb (e.g. `snap set` as `set`)."""
+        if not self.enabled:
+            return sys_exec
+
+        @functools.wraps(sys_exec)
+        def timed_exec(program: Any, *args: Any, **kwargs: Any) -> str:
+            kind = Path(str(program)).name
+            with self.timed(kind, str(args[0]) if args else kind) as timing:
+                output = sys_exec(program, *args, **kwargs)
+                timing.size = len(output)
+            return output
+
+        return timed_exec
+
+    def flush(self) -> None:
+        """Merge the timings of this dispatch into the store and export them."""
+        if not self.enabled or not self._timings:
+            return
+        store = self.load()
+        metrics = store.setdefault("metrics", {})
+        recent = store.setdefault("recent", [])
+        now = time.time()
+        for timing in self._timings:
+            metric = metrics.setdefault(
+                f"{timing.kind}:{timing.name}",
+                {
+                    "kind": timing.kind,
+                    "name": timing.name,
+                    "count": 0,
+                    "errors": 0,
+                    "sum": 0.0,
+                    "bytes": 0,
+                    "buckets": [0] * (len(BUCKETS) + 1),
+                },
+            )
+            metric["count"] += 1
+            metric["errors"] += 0 if timing.ok else 1
+            metric["sum"] += timing.seconds
+            metric["bytes"] += timing.size
+            metric["buckets"][self._bucket(timing.seconds)] += 1
+            recent.append([now, timing.kind, timing.name, timing.seconds, timing.ok])
+        del recent[:-RECENT_SAMPLES]
+        self._timings.clear()
+
+        try:
+            self._write(self._store_path, json.dumps(store))
+            if self._textfile_path is not None and self._textfile_path.parent.is_dir():
+                self._write(self._textfile_path, self.prometheus(store))
+        except OSError as e:
+            logger.warning(f"Cannot save timings: {e}")
+
+    def load(self) -> Dict[str, Any]:
+        """Return the timings store, empty if it does not exist yet."""
+        try:
+            return json.loads(self._store_path.read_text())
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def summary(self) -> str:
+        """Return a human readable table of the stored timings."""
+        store = self.load()
+        samples: Dict[str, List[float]] = {}
+        for _, kind, name, seconds, _ in store.get("recent", []):
+            samples.setdefault(f"{kind}:{name}", []).append(seconds)
+
+        lines = [f"{'operation':<40} {'count':>7} {'errors':>6} {'mean':>9} {'p95':>9} {'max':>9}"]
+        for key, metric in sorted(store.get("metrics", {}).items()):
+            recent = sorted(samples.get(key, [0.0]))
+            p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+            lines.append(
+                f"{metric['kind'] + ' ' + metric['name']:<40} {metric['count']:>7} "
+                f"{metric['errors']:>6} {metric['sum'] / metric['count'] * 1000:>7.1f}ms "
+                f"{p95 * 1000:>7.1f}ms {recent[-1] * 1000:>7.1f}ms"
+            )
+        return "\n".join(lines)
+
+    def prometheus(self, store: Dict[str, Any]) -> str:
+        """Return the stored timings in the Prometheus text exposition format."""
+        lines = [
+            "# HELP agent_snapper_duration_seconds Duration of agent snapper operations.",
+            "# TYPE agent_snapper_duration_seconds histogram",
+        ]
+        errors = [
+            "# HELP agent_snapper_errors_total Failed agent snapper operations.",
+            "# TYPE agent_snapper_errors_total counter",
+        ]
+        for metric in store.get("metrics", {}).values():
+            labels = self._format_labels(kind=metric["kind"], name=metric["name"])
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), metric["buckets"]):
+                cumulative += count
+                lines.append(
+                    f'agent_snapper_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"agent_snapper_duration_seconds_sum{{{labels}}} {metric['sum']}")
+            lines.append(f"agent_snapper_duration_seconds_count{{{labels}}} {metric['count']}")
+            errors.append(f"agent_snapper_errors_total{{{labels}}} {metric['errors']}")
+        return "\n".join(lines + errors) + "\n"
+
+    def _format_labels(self, **labels: str) -> str:
+        def escape(value: str) -> str:
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        return ",".join(f'{k}="{escape(v)}"' for k, v in {**self._labels, **labels}.items())
+
+    @staticmethod
+    def _bucket(seconds: float) -> int:
+        return next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+
+    @staticmethod
+    def _write(path: Path, content: str) -> None:
+        """Write the file atomically, so collectors never read a partial file."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(content)
+        os.replace(tmp, path)
+
+
+def timed_handler(handler: Callable) -> Callable:
+    """Time an event handler of an object holding a `_timings` TimingRecorder."""
+
+    @functools.wraps(handler)
+    def wrapper(self: Any, event: Any) -> Any:
+        if not self._timings.enabled:
+            return handler(self, event)
+        with self._timings.timed("handler", handler.__name__):
+            return handler(self, event)
+
+    return wrapper
@@ -0,0 +1,144 @@
+"""Fixtures of the Agent Snapper library tests."""
+
+from pathlib import Path
+from typing import Any, Iterator, List
+
+import ops
+import pytest
+from agent_snapper import AgentSnapper, charmed_agent
+from agent_snapper import snapd as snapd_module
+from agent_snapper.backend import SnapCliBackend, SnapdRestBackend
+from agent_snapper.snapd import SnapdClient
+from fakes import FakeSnapCli, FakeSnapd
+from ops import testing
+
+SNAP = "vantage-agent"
+META = {
+    "name": SNAP,
+    "subordinate": True,
+    "peers": {"snap-refresh": {"interface": "agent-snap-refresh"}},
+}
+CONFIG = {
+    "options": {
+        "snap-channel": {"type": "string", "default": "stable"},
+        "snap-refresh-batch-size": {"type": "int", "default": 10},
+        "warm-standby": {"type": "boolean", "default": True},
+        "timings-enabled": {"type": "boolean", "default": False},
+        "timings-textfile-dir": {"type": "string", "default": ""},
+        f"{SNAP}-base-api-url": {"type": "string", "default": "https://apis.example.com"},
+        f"{SNAP}-oidc-domain": {"type": "string", "default": "auth.example.com"},
+        f"{SNAP}-oidc-client-id": {"type": "string", "default": ""},
+        f"{SNAP}-oidc-client-secret": {"type": "string", "default": ""},
+        f"{SNAP}-cluster-name": {"type": "string", "default": ""},
+    }
+}
+RESOURCES = {
+    f"{SNAP}-snap": {"type": "file", "filename": f"{SNAP}.snap"},
+    f"{SNAP}-snap-assertion": {"type": "file", "filename": f"{SNAP}.assert"},
+}
+ACTIONS = {"refresh-snap": {}, "show-timings": {}, "journal-summary": {}}
+# Charm config the agent needs to run its daemon.
+AGENT_CONFIG = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+    f"{SNAP}-cluster-name": "test",
+}
+
+
+class AgentCharm(ops.CharmBase):
+    """Charm managing the agent snap like the agent charms do."""
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.snapper = AgentSnapper(self, SNAP, ["cluster-name"])
+
+
+class AsyncAgentCharm(ops.CharmBase):
+    """Agent charm submitting the snap installs to snapd without waiting for them."""
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.snapper = AgentSnapper(self, SNAP, ["cluster-name"], async_install=True)
+
+
+@pytest.fixture
+def snapd(tmp_path: Path) -> Iterator[FakeSnapd]:
+    """Fake snapd serving on a socket of the test directory."""
+    with FakeSnapd(tmp_path / "snapd.socket") as snapd:
+        yield snapd
+
+
+@pytest.fixture
+def snap_cli(snapd: FakeSnapd) -> FakeSnapCli:
+    """Fake `snap` command line tool acting on the state of the fake snapd."""
+    return FakeSnapCli(snapd)
+
+
+@pytest.fixture
+def snap_host(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, snapd: FakeSnapd, snap_cli: FakeSnapCli
+) -> None:
+    """Make the snappers manage the snaps of the fake snapd."""
+    monkeypatch.setattr(AgentSnapper, "_sys_exec", staticmethod(snap_cli))
+    monkeypatch.setattr(charmed_agent, "SNAPD_SOCKET", snapd.socket_path)
+    # Probe the daemon through the fakes, never through the host systemd.
+    monkeypatch.setattr(charmed_agent, "SYSTEM_BUS_SOCKET", tmp_path / "missing-bus.socket")
+
+
+@pytest.fixture
+def ctx(snap_host: None, tmp_path: Path) -> testing.Context:
+    """Context dispatching events to the agent charm, managing the snap of the fake snapd.
+
+    The charm directory is in the test directory, so the timings are saved next to it.
+    """
+    (tmp_path / "charm").mkdir()
+    return testing.Context(
+        AgentCharm, meta=META, config=CONFIG, actions=ACTIONS, charm_root=tmp_path / "charm"
+    )
+
+
+@pytest.fixture
+def resource_ctx(snap_host: None) -> testing.Context:
+    """Context dispatching events to the agent charm, with the snap as optional resource."""
+    meta = {**META, "resources": RESOURCES}
+    return testing.Context(AgentCharm, meta=meta, config=CONFIG, actions=ACTIONS)
+
+
+@pytest.fixture
+def async_ctx(snap_host: None) -> testing.Context:
+    """Context dispatching events to the agent charm installing the snap asynchronously."""
+    return testing.Context(AsyncAgentCharm, meta=META, config=CONFIG, actions=ACTIONS)
+
+
+@pytest.fixture
+def client(snapd: FakeSnapd) -> Iterator[SnapdClient]:
+    """Client of the REST API connected to the fake snapd."""
+    client = SnapdClient(snapd.socket_path, timeout=5.0)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def cli_backend(snap_cli: FakeSnapCli) -> SnapCliBackend:
+    """Backend running the fake `snap` command line tool."""
+    return SnapCliBackend(snap_cli)
+
+
+@pytest.fixture
+def rest_backend(client: SnapdClient, cli_backend: SnapCliBackend) -> SnapdRestBackend:
+    """Backend talking to the fake snapd, falling back to the fake `snap` command line tool."""
+    return SnapdRestBackend(client, cli_backend)
+
+
+@pytest.fixture
+def connects(monkeypatch: pytest.MonkeyPatch) -> List[Any]:
+    """Record every connection made to a snapd socket."""
+    connects = []
+    connect = snapd_module._UnixHTTPConnection.connect
+
+    def counted(self: snapd_module._UnixHTTPConnection) -> None:
+        connects.append(self)
+        connect(self)
+
+    monkeypatch.setattr(snapd_module._UnixHTTPConnection, "connect", counted)
+    return connects
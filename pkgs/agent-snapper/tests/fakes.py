@@ -0,0 +1,620 @@
+"""Fakes of snapd and of the snap CLI for the tests of the Agent Snapper library and its charms.
+
+`FakeSnapd` serves a small in-memory imitation of the snapd REST API over a unix socket, so the
+`SnapdRestBackend` can be exercised without a real snapd:
+
+    with FakeSnapd(tmp_path / "snapd.socket") as snapd:
+        snapd.add_snap("vantage-agent", config={"base-api-url": "https://..."})
+        snapper._snapd_socket = snapd.socket_path
+
+`FakeSnapCli` imitates the `snap` command line tool on top of the same state, for the
+`SnapCliBackend`:
+
+    monkeypatch.setattr(AgentSnapper, "_sys_exec", staticmethod(FakeSnapCli(snapd)))
+
+Both accept a `latency` in seconds added to every request or command.
+"""
+
+import itertools
+import json
+import shlex
+import socketserver
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NoReturn, Optional, Tuple, cast
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from agent_snapper.errors import SnapperSysCallError
+
+Response = Tuple[int, Dict[str, Any]]
+
+
+class _FakeSnapdHandler(BaseHTTPRequestHandler):
+    """Route HTTP requests to the FakeSnapd owning the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _dispatch(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        body = json.loads(data) if data and content_type == "application/json" else None
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        fake = cast(_FakeSnapdServer, self.server).fake
+        status, document = fake.handle(
+            self.command, unquote(url.path), query, body, data=data, content_type=content_type
+        )
+        payload = json.dumps(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Handle a GET request."""
+        self._dispatch()
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Handle a POST request."""
+        self._dispatch()
+
+    def do_PUT(self) -> None:  # noqa: N802
+        """Handle a PUT request."""
+        self._dispatch()
+
+    def address_string(self) -> str:
+        """Return a printable client address; unix socket clients have none."""
+        return "snapd-client"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Silence the default stderr request logging."""
+        pass
+
+
+class _FakeSnapdServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    fake: "FakeSnapd"
+
+
+class FakeSnapd:
+    """In-memory fake of the snapd REST API listening on a unix socket.
+
+    Changes complete as soon as they are submitted. With `auto_complete` turned off they stay
+    in progress until `complete_change` is called.
+    """
+
+    def __init__(self, socket_path: Path, latency: float = 0.0):
+        """Initialize the fake.
+
+        Args:
+            socket_path: Path where the unix socket is created.
+            latency: Seconds added to every request (optional).
+        """
+        self.socket_path = socket_path
+        self.latency = latency
+        self.snaps: Dict[str, Dict[str, Any]] = {}
+        self.changes: Dict[str, Dict[str, Any]] = {}
+        self.requests: List[Tuple[str, str]] = []
+        self.assertions: List[bytes] = []
+        self.sideloads: List[Dict[str, str]] = []
+        self.store: Dict[str, str] = {}
+        self.auto_complete = True
+        self._failures: Dict[Tuple[str, str], Tuple[int, str, str]] = {}
+        self._pending: Dict[str, Callable[[], None]] = {}
+        self._change_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server: Optional[_FakeSnapdServer] = None
+
+    def __enter__(self) -> "FakeSnapd":
+        """Start the fake snapd."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        """Stop the fake snapd."""
+        self.stop()
+
+    def start(self) -> None:
+        """Start serving requests in a background thread."""
+        self.socket_path.unlink(missing_ok=True)
+        self._server = _FakeSnapdServer(str(self.socket_path), _FakeSnapdHandler)
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop serving requests and remove the socket."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.socket_path.unlink(missing_ok=True)
+
+    def publish(self, name: str, revision: str) -> None:
+        """Make `revision` the latest revision of the snap available in the store."""
+        self.store[name] = revision
+
+    def add_snap(
+        self,
+        name: str,
+        revision: str = "1",
+        channel: str = "latest/stable",
+        config: Optional[Dict[str, Any]] = None,
+        services: Optional[Dict[str, bool]] = None,
+    ) -> None:
+        """Register an installed snap.
+
+        Args:
+            name: Name of the snap.
+            revision: Installed revision.
+            channel: Tracked channel.
+            config: Initial snap configuration.
+            services: Active state of each service, defaults to an inactive `daemon`. Active
+                services are enabled, inactive ones disabled.
+        """
+        services = dict(services if services is not None else {"daemon": False})
+        self.snaps[name] = {
+            "revision": revision,
+            "channel": channel,
+            "config": dict(config or {}),
+            "services": services,
+            "enabled": dict(services),
+        }
+
+    def fail(self, method: str, path: str, message: str, kind: str = "", status: int = 400):
+        """Answer every `method` request on `path` with a snapd error."""
+        self._failures[(method, path)] = (status, kind, message)
+
+    def complete_change(self, change_id: str, err: str = "") -> None:
+        """Finish a change held because `auto_complete` is off, failing it if `err` is set."""
+        with self._lock:
+            apply = self._pending.pop(change_id)
+            change = self.changes[change_id]
+            change["ready"] = True
+            if err:
+                change.update(status="Error", err=err)
+                change["tasks"][-1]["status"] = "Error"
+                return
+            apply()
+            change["status"] = "Done"
+            change["tasks"][-1].update(
+                status="Done", progress={"label": "", "done": 1, "total": 1}
+            )
+
+    def set_progress(self, change_id: str, done: int, total: int) -> None:
+        """Update the progress reported by the running task of a held change."""
+        with self._lock:
+            self.changes[change_id]["tasks"][-1]["progress"] = {
+                "label": "",
+                "done": done,
+                "total": total,
+            }
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        query: Dict[str, str],
+        body: Optional[Dict[str, Any]],
+        data: bytes = b"",
+        content_type: str = "",
+    ) -> Response:
+        """Return the status and JSON document snapd would answer to the request.
+
+        `body` is the decoded JSON request body, `data` the raw body of other requests.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests.append((method, path))
+            if (method, path) in self._failures:
+                status, kind, message = self._failures[(method, path)]
+                return self._error(message, kind=kind, status=status)
+
+            parts = path.strip("/").split("/")
+            if parts == ["v2", "find"] and query.get("select") == "refresh":
+                return self._sync(
+                    [
+                        {"name": name, "revision": self.store[name]}
+                        for name, snap in self.snaps.items()
+                        if self.store.get(name, snap["revision"]) != snap["revision"]
+                    ]
+                )
+            if parts[:2] == ["v2", "apps"]:
+                return self._apps(method, query, body or {})
+            if parts[:2] == ["v2", "changes"] and len(parts) == 3:
+                if parts[2] not in self.changes:
+                    return self._error("change not found", status=404)
+                if method == "POST" and (body or {}).get("action") == "abort":
+                    return self._abort(parts[2])
+                return self._sync(self.changes[parts[2]])
+            if parts == ["v2", "assertions"] and method == "POST":
+                self.assertions.append(data)
+                return self._sync({})
+            if parts == ["v2", "snaps"] and method == "POST":
+                return self._sideload(data, content_type)
+            if parts[:2] == ["v2", "snaps"] and len(parts) == 3:
+                return self._snap(method, parts[2], body or {})
+            if parts[:2] == ["v2", "snaps"] and len(parts) == 4 and parts[3] == "conf":
+                return self._conf(method, parts[2], query, body or {})
+            return self._error(f"unknown endpoint {method} {path}", status=404)
+
+    ## Endpoints
+    def _abort(self, change_id: str) -> Response:
+        change = self.changes[change_id]
+        if change["ready"]:
+            return self._error(f"cannot abort change {change_id} with nothing pending")
+        self._pending.pop(change_id, None)
+        change["tasks"][-1]["status"] = "Hold"
+        change.update(ready=True, status="Hold", err="change aborted")
+        return self._sync(change)
+
+    def _snap(self, method: str, name: str, body: Dict[str, Any]) -> Response:
+        snap = self.snaps.get(name)
+        if method == "GET":
+            if snap is None:
+                return self._not_found(name)
+            return self._sync(
+                {
+                    "name": name,
+                    "revision": snap["revision"],
+                    "channel": snap["channel"].rsplit("/", 1)[-1],
+                    "tracking-channel": snap["channel"],
+                    "confinement": "classic",
+                    "status": "active",
+                }
+            )
+
+        action = body.get("action")
+        channel = body.get("channel", snap["channel"] if snap else "latest/stable")
+        if action == "install":
+            if snap is not None:
+                return self._error(f'snap "{name}" is already installed', "snap-already-installed")
+            return self._async(
+                f"{action}-snap",
+                f'Download snap "{name}" from channel "{channel}"',
+                lambda: self.add_snap(name, revision=self.store.get(name, "1"), channel=channel),
+            )
+        if snap is None:
+            return self._not_found(name)
+        if action == "refresh":
+            return self._async(
+                f"{action}-snap",
+                f'Download snap "{name}" from channel "{channel}"',
+                lambda: snap.update(
+                    channel=channel, revision=self.store.get(name, snap["revision"])
+                ),
+            )
+        if action == "remove":
+            return self._async(
+                f"{action}-snap", f'Remove data for snap "{name}"', lambda: self.snaps.pop(name)
+            )
+        return self._error(f"unknown action {action}")
+
+    def _sideload(self, data: bytes, content_type: str) -> Response:
+        form = BytesParser(policy=default).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + data
+        )
+        fields: Dict[str, str] = {}
+        filename = None
+        for part in form.iter_parts():
+            name = str(part.get_param("name", header="content-disposition"))
+            if part.get_filename():
+                filename = fields[name] = str(part.get_filename())
+            else:
+                fields[name] = str(part.get_content()).strip()
+        if filename is None:
+            return self._error("cannot find snap file in the request")
+        self.sideloads.append(fields)
+        return self._install_file(filename)
+
+    def _install_file(self, filename: str) -> Response:
+        # Snap files are named <name>_<revision>.snap by `snap download`.
+        name = Path(filename).stem.split("_")[0]
+        revision = f"x{sum(1 for c in self.changes.values() if c['kind'] == 'sideload') + 1}"
+
+        def apply() -> None:
+            if name in self.snaps:
+                self.snaps[name].update(revision=revision, channel="")
+            else:
+                self.add_snap(name, revision=revision, channel="")
+
+        return self._async("sideload", f'Prepare snap "{filename}"', apply)
+
+    def _apps(self, method: str, query: Dict[str, str], body: Dict[str, Any]) -> Response:
+        names = query.get("names", "").split(",") if method == "GET" else body.get("names", [])
+        targets = []
+        for name in filter(None, names):
+            snap_name, _, app = name.partition(".")
+            if snap_name not in self.snaps:
+                return self._not_found(snap_name)
+            services = self.snaps[snap_name]["services"]
+            targets.extend((snap_name, a) for a in services if not app or a == app)
+
+        if method == "GET":
+            return self._sync(
+                [
+                    {
+                        "snap": snap_name,
+                        "name": app,
+                        "daemon": "simple",
+                        "enabled": self.snaps[snap_name]["enabled"][app],
+                        "active": self.snaps[snap_name]["services"][app],
+                    }
+                    for snap_name, app in targets
+                ]
+            )
+
+        action = body.get("action")
+        if action not in ("start", "stop", "restart"):
+            return self._error(f"unknown action {action}")
+
+        def apply() -> None:
+            for snap_name, app in targets:
+                self.snaps[snap_name]["services"][app] = action != "stop"
+                if body.get("enable") or body.get("disable"):
+                    self.snaps[snap_name]["enabled"][app] = bool(body.get("enable"))
+
+        return self._async("service-control", f"Run service command {action!r}", apply)
+
+    def _conf(
+        self, method: str, name: str, query: Dict[str, str], body: Dict[str, Any]
+    ) -> Response:
+        if name not in self.snaps:
+            return self._not_found(name)
+        config = self.snaps[name]["config"]
+        if method == "GET":
+            keys = [k for k in query.get("keys", "").split(",") if k]
+            missing = [k for k in keys if k not in config]
+            if missing:
+                return self._error(
+                    f'snap "{name}" has no "{missing[0]}" configuration option',
+                    "option-not-found",
+                )
+            return self._sync({k: config[k] for k in keys} if keys else dict(config))
+
+        def apply() -> None:
+            for key, value in body.items():
+                if value is None:
+                    config.pop(key, None)
+                else:
+                    config[key] = value
+
+        return self._async("configure-snap", f'Run configure hook of "{name}" snap', apply)
+
+    ## Responses
+    def _async(self, kind: str, task: str, apply: Callable[[], Any]) -> Response:
+        """Register a change running a single `task`, applying its effect on completion."""
+        change_id = str(next(self._change_ids))
+        status = "Done" if self.auto_complete else "Doing"
+        self.changes[change_id] = {
+            "id": change_id,
+            "kind": kind,
+            "summary": kind,
+            "status": status,
+            "ready": self.auto_complete,
+            "tasks": [
+                {
+                    "kind": kind,
+                    "summary": task,
+                    "status": status,
+                    "progress": {"label": "", "done": int(self.auto_complete), "total": 1},
+                }
+            ],
+        }
+        if self.auto_complete:
+            apply()
+        else:
+            self._pending[change_id] = apply
+        return 202, {
+            "type": "async",
+            "status-code": 202,
+            "status": "Accepted",
+            "change": change_id,
+        }
+
+    @staticmethod
+    def _sync(result: Any) -> Response:
+        return 200, {"type": "sync", "status-code": 200, "status": "OK", "result": result}
+
+    @staticmethod
+    def _error(message: str, kind: str = "", status: int = 400) -> Response:
+        result = {"message": message}
+        if kind:
+            result["kind"] = kind
+        return status, {"type": "error", "status-code": status, "result": result}
+
+    def _not_found(self, name: str) -> Response:
+        return self._error(f'snap "{name}" not found', "snap-not-found", status=404)
+
+
+class FakeSnapCli:
+    """Fake of the `snap` command line tool acting on the state of a FakeSnapd.
+
+    Instances are called like `AgentSnapper._sys_exec` and record every command in `calls`.
+    Changes are waited for unless `--no-wait` is given, so held changes are reported as done
+    only once `FakeSnapd.complete_change` was called. `journalctl` reads the daemon messages
+    given to `log`.
+    """
+
+    def __init__(self, snapd: FakeSnapd, latency: float = 0.0):
+        """Initialize the fake.
+
+        Args:
+            snapd: The fake snapd holding the snaps state.
+            latency: Seconds added to every command, e.g. to imitate the process startup
+                (optional).
+        """
+        self.snapd = snapd
+        self.latency = latency
+        self.calls: List[Tuple[str, ...]] = []
+        self.journal: List[Dict[str, str]] = []
+        self._failures: Dict[str, str] = {}
+
+    def fail(self, verb: str, stderr: str) -> None:
+        """Make every `snap <verb>` command fail with the given error output."""
+        self._failures[verb] = stderr
+
+    def log(self, message: str, priority: int = 6, timestamp: Optional[float] = None) -> None:
+        """Append a message to the journal of the snap daemon."""
+        self.journal.append(
+            {
+                "__CURSOR": f"s=fake;i={len(self.journal) + 1:x}",
+                "__REALTIME_TIMESTAMP": str(int((timestamp or time.time()) * 1e6)),
+                "MESSAGE": message,
+                "PRIORITY": str(priority),
+            }
+        )
+
+    def __call__(self, *cmd: Any, timeout: Optional[float] = None) -> str:
+        """Run a `snap` command and return its output, raising SnapperSysCallError on failure."""
+        args = [str(arg) for arg in cmd[1:]]
+        self.calls.append(tuple(args))
+        if self.latency:
+            time.sleep(self.latency)
+        if Path(str(cmd[0])).name == "journalctl":
+            return self._journalctl(cmd, args)
+        verb, args = args[0], args[1:]
+        if verb in self._failures:
+            self._raise(cmd, self._failures[verb])
+        handler = getattr(self, f"_{verb}", None)
+        if handler is None:
+            self._raise(cmd, f'error: unknown command "{verb}"')
+        return handler(cmd, [a for a in args if not a.startswith("-")], args)
+
+    def _list(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        snap = self._request(cmd, "GET", f"/v2/snaps/{names[0]}")
+        return (
+            "Name  Version  Rev  Tracking  Publisher  Notes\n"
+            f"{names[0]}  1.0  {snap['revision']}  {snap['tracking-channel'] or '-'}  "
+            "vantage  classic\n"
+        )
+
+    def _refresh(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        if "--list" in args:
+            snaps = self._request(cmd, "GET", "/v2/find", query={"select": "refresh"})
+            if not snaps:
+                return "All snaps up to date.\n"
+            return "Name  Version  Rev  Size  Publisher  Notes\n" + "".join(
+                f"{snap['name']}  1.0  {snap['revision']}  1MB  vantage  -\n" for snap in snaps
+            )
+        body = {"action": "refresh", **self._channel(args)}
+        return self._change(cmd, args, "POST", f"/v2/snaps/{names[-1]}", body)
+
+    def _install(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        if names[-1].endswith(".snap"):
+            with self.snapd._lock:
+                status, document = self.snapd._install_file(Path(names[-1]).name)
+            return self._wait(cmd, args, self._result(cmd, status, document))
+        body = {"action": "install", **self._channel(args)}
+        return self._change(cmd, args, "POST", f"/v2/snaps/{names[-1]}", body)
+
+    def _remove(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        return self._change(cmd, args, "POST", f"/v2/snaps/{names[0]}", {"action": "remove"})
+
+    def _ack(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        self.snapd.assertions.append(Path(names[0]).read_bytes())
+        return ""
+
+    def _services(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        apps = self._request(cmd, "GET", "/v2/apps", query={"names": names[0]})
+        return "Service  Startup  Current  Notes\n" + "".join(
+            f"{app['snap']}.{app['name']}  {'enabled' if app['enabled'] else 'disabled'}  "
+            f"{'active' if app['active'] else 'inactive'}  -\n"
+            for app in apps
+        )
+
+    def _get(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        return json.dumps(self._request(cmd, "GET", f"/v2/snaps/{names[0]}/conf"), indent=2)
+
+    def _set(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        conf: Dict[str, Any] = {}
+        for arg in names[1:]:
+            key, _, value = arg.partition("=")
+            try:
+                conf[key] = json.loads(value)
+            except json.JSONDecodeError:
+                conf[key] = value
+        return self._change(cmd, args, "PUT", f"/v2/snaps/{names[0]}/conf", conf)
+
+    def _run(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        # The agent snaps' start/stop apps start and enable, or stop and disable, their daemon.
+        snap, _, app = names[0].partition(".")
+        if app not in ("start", "stop", "restart"):
+            return ""
+        body: Dict[str, Any] = {"action": app, "names": [f"{snap}.daemon"]}
+        if app != "restart":
+            body["enable" if app == "start" else "disable"] = True
+        return self._change(cmd, args, "POST", "/v2/apps", body)
+
+    def _tasks(self, cmd: Tuple[Any, ...], names: List[str], args: List[str]) -> str:
+        change = self._request(cmd, "GET", f"/v2/changes/{names[0]}")
+        output = "Status  Spawn  Ready  Summary\n" + "".join(
+            f"{task['status']}  today  today  {task['summary']}\n" for task in change["tasks"]
+        )
+        if change.get("err"):
+            output += f"\n......\n{change['err']}\n"
+        return output
+
+    def _change(
+        self,
+        cmd: Tuple[Any, ...],
+        args: List[str],
+        method: str,
+        path: str,
+        body: Dict[str, Any],
+    ) -> str:
+        return self._wait(cmd, args, self._request(cmd, method, path, body=body))
+
+    def _wait(self, cmd: Tuple[Any, ...], args: List[str], change_id: str) -> str:
+        if "--no-wait" in args:
+            return f"{change_id}\n"
+        change = self.snapd.changes[change_id]
+        if change["ready"] and change["status"] != "Done":
+            self._raise(cmd, f"error: cannot perform the following tasks:\n- {change['err']}")
+        return ""
+
+    def _journalctl(self, cmd: Tuple[Any, ...], args: List[str]) -> str:
+        options = dict(arg.split("=", 1) for arg in args if "=" in arg)
+        entries = self.journal
+        if "--after-cursor" in options:
+            cursors = [entry["__CURSOR"] for entry in entries]
+            if options["--after-cursor"] not in cursors:
+                self._raise(cmd, "Failed to seek to cursor: Invalid argument")
+            entries = entries[cursors.index(options["--after-cursor"]) + 1 :]
+        elif "--lines" in options:
+            entries = entries[len(entries) - int(options["--lines"]) :]
+        return "".join(json.dumps(entry) + "\n" for entry in entries)
+
+    def _request(
+        self,
+        cmd: Tuple[Any, ...],
+        method: str,
+        path: str,
+        query: Optional[Dict[str, str]] = None,
+        body: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        return self._result(cmd, *self.snapd.handle(method, path, query or {}, body))
+
+    def _result(self, cmd: Tuple[Any, ...], status: int, document: Dict[str, Any]) -> Any:
+        if document["type"] == "error":
+            self._raise(cmd, f"error: {document['result']['message']}")
+        if document["type"] == "async":
+            return document["change"]
+        return document["result"]
+
+    @staticmethod
+    def _channel(args: List[str]) -> Dict[str, str]:
+        if "--channel" not in args:
+            return {}
+        return {"channel": args[args.index("--channel") + 1]}
+
+    @staticmethod
+    def _raise(cmd: Tuple[Any, ...], stderr: str) -> NoReturn:
+        command = shlex.join(str(arg) for arg in cmd)
+        raise SnapperSysCallError(f"System command failed: {command} - {stderr}", stderr=stderr)
@@ -0,0 +1,73 @@
+"""Tests of the snap backends against the fake snapd."""
+
+from pathlib import Path
+
+import pytest
+from agent_snapper.backend import SnapBackend, SnapCliBackend, SnapdRestBackend
+from agent_snapper.errors import SnapdError
+from agent_snapper.snapd import SnapdClient
+from fakes import FakeSnapCli, FakeSnapd
+
+SNAP = "vantage-agent"
+
+
+def test_rest_backend_talks_to_snapd(
+    snapd: FakeSnapd, snap_cli: FakeSnapCli, rest_backend: SnapdRestBackend
+):
+    rest_backend.install(SNAP, "latest/stable")
+    rest_backend.set_config(SNAP, {"cluster-name": "test", "task-jobs-interval-seconds": "10"})
+
+    info = rest_backend.info(SNAP)
+    assert info is not None and info.channel == "latest/stable"
+    assert rest_backend.get_config(SNAP) == {
+        "cluster-name": "test",
+        "task-jobs-interval-seconds": 10,
+    }
+    assert snap_cli.calls == []
+
+
+def test_rest_backend_falls_back_to_the_cli(
+    tmp_path: Path, snapd: FakeSnapd, snap_cli: FakeSnapCli, cli_backend: SnapCliBackend
+):
+    snapd.add_snap(SNAP)
+    client = SnapdClient(tmp_path / "missing.socket")
+    backend = SnapdRestBackend(client, cli_backend)
+
+    info = backend.info(SNAP)
+    backend.refresh(SNAP, "latest/edge")
+
+    assert info is not None and info.revision == "1"
+    assert backend._use_fallback
+    assert [call[0] for call in snap_cli.calls] == ["list", "refresh"]
+    assert snapd.snaps[SNAP]["channel"] == "latest/edge"
+
+
+def test_rest_backend_raises_snapd_errors(
+    snapd: FakeSnapd, snap_cli: FakeSnapCli, rest_backend: SnapdRestBackend
+):
+    snapd.add_snap(SNAP)
+    snapd.fail("GET", f"/v2/snaps/{SNAP}/conf", "internal error", status=500)
+
+    with pytest.raises(SnapdError):
+        rest_backend.get_config(SNAP)
+    assert not rest_backend._use_fallback
+    assert snap_cli.calls == []
+
+
+@pytest.mark.parametrize("backend", ["cli_backend", "rest_backend"])
+def test_start_and_stop_enable_and_disable_the_daemon(
+    request: pytest.FixtureRequest, snapd: FakeSnapd, backend: str
+):
+    snap_backend: SnapBackend = request.getfixturevalue(backend)
+    snapd.add_snap(SNAP)
+
+    snap_backend.run(SNAP, "start")
+    assert snap_backend.services(SNAP) == {"daemon": "active"}
+    assert snapd.snaps[SNAP]["enabled"] == {"daemon": True}
+
+    snap_backend.run(SNAP, "restart")
+    assert snapd.snaps[SNAP]["enabled"] == {"daemon": True}
+
+    snap_backend.run(SNAP, "stop")
+    assert snap_backend.services(SNAP) == {"daemon": "inactive"}
+    assert snapd.snaps[SNAP]["enabled"] == {"daemon": False}
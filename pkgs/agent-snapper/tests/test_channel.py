@@ -0,0 +1,87 @@
+"""Tests of the snap refreshes to the `snap-channel` config and to newer store revisions."""
+
+from typing import Any, Dict
+
+import pytest
+from agent_snapper import AgentSnapper
+from fakes import FakeSnapd
+from ops import testing
+
+SNAP = "vantage-agent"
+CONFIG: Dict[str, Any] = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+    f"{SNAP}-cluster-name": "test",
+}
+REFRESH = ("POST", f"/v2/snaps/{SNAP}")
+
+
+@pytest.mark.parametrize(
+    "channel, full_channel",
+    [
+        ("stable", "latest/stable"),
+        ("edge", "latest/edge"),
+        ("latest", "latest/stable"),
+        ("latest/beta", "latest/beta"),
+        ("2.x", "2.x/stable"),
+        ("2.x/candidate", "2.x/candidate"),
+        ("beta/hotfix", "latest/beta/hotfix"),
+        ("2.x/stable/hotfix", "2.x/stable/hotfix"),
+    ],
+)
+def test_full_channel(channel: str, full_channel: str):
+    assert AgentSnapper._full_channel(channel) == full_channel
+
+
+@pytest.mark.parametrize("channel", ["stable", "latest/stable", "latest"])
+def test_snap_tracking_the_channel_is_not_refreshed(
+    ctx: testing.Context, snapd: FakeSnapd, channel: str
+):
+    snapd.add_snap(SNAP)
+    state = testing.State(leader=True, config={**CONFIG, "snap-channel": channel})
+
+    ctx.run(ctx.on.config_changed(), state)
+    ctx.run(ctx.on.upgrade_charm(), state)
+
+    assert REFRESH not in snapd.requests
+
+
+def test_snap_is_refreshed_to_another_channel(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP)
+    state = testing.State(leader=True, config={**CONFIG, "snap-channel": "2.x/edge"})
+
+    ctx.run(ctx.on.config_changed(), state)
+
+    assert snapd.snaps[SNAP]["channel"] == "2.x/edge"
+
+
+def test_snap_is_refreshed_to_a_newer_revision(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP)
+    state = testing.State(leader=True, config=CONFIG)
+    ctx.run(ctx.on.upgrade_charm(), state)
+    assert REFRESH not in snapd.requests
+
+    snapd.publish(SNAP, "2")
+    ctx.run(ctx.on.upgrade_charm(), state)
+
+    assert snapd.snaps[SNAP]["revision"] == "2"
+
+
+def test_refresh_action_refreshes_an_up_to_date_snap(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP, channel="latest/edge")
+    state = testing.State(leader=True, config={**CONFIG, "snap-channel": "edge"})
+
+    ctx.run(ctx.on.action("refresh-snap"), state)
+
+    assert REFRESH in snapd.requests
+    # Refreshed to the channel as given.
+    assert ctx.action_results == {"revision": "1", "channel": "edge"}
+
+
+def test_refresh_action_reports_failures(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP)
+    snapd.fail(*REFRESH, "cannot refresh: store unreachable")
+    state = testing.State(leader=True, config=CONFIG)
+
+    with pytest.raises(testing.ActionFailed, match="store unreachable"):
+        ctx.run(ctx.on.action("refresh-snap"), state)
@@ -0,0 +1,171 @@
+"""Tests of the snap installs from charm resources, or submitted to snapd without waiting."""
+
+import dataclasses
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+import ops
+import pytest
+from fakes import FakeSnapd
+from ops import testing
+
+SNAP = "vantage-agent"
+CONFIG: Dict[str, Any] = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+    f"{SNAP}-cluster-name": "test",
+}
+INSTALLING = ops.MaintenanceStatus(f"Installing snap: {SNAP}")
+FAILED = ops.BlockedStatus(f"Error installing the snap for {SNAP}")
+
+
+def submitted(ctx: testing.Context, snapd: FakeSnapd) -> testing.State:
+    """Return the state after the install hook submitted the install of the snap."""
+    snapd.auto_complete = False
+    out = ctx.run(ctx.on.install(), testing.State(leader=True, config=CONFIG))
+    assert out.unit_status == INSTALLING
+    assert [change["kind"] for change in snapd.changes.values()] == ["install-snap"]
+    return out
+
+
+def test_install_is_submitted_without_waiting(async_ctx: testing.Context, snapd: FakeSnapd):
+    submitted(async_ctx, snapd)
+
+    assert SNAP not in snapd.snaps
+    assert ("GET", "/v2/changes/1") not in snapd.requests
+
+
+def test_install_progress_is_reported(async_ctx: testing.Context, snapd: FakeSnapd):
+    state = submitted(async_ctx, snapd)
+    snapd.set_progress("1", 3, 4)
+
+    out = async_ctx.run(async_ctx.on.update_status(), state)
+
+    assert out.unit_status == ops.MaintenanceStatus(
+        f'Installing {SNAP}: Download snap "{SNAP}" from channel "stable" (75%)'
+    )
+    assert len(snapd.changes) == 1
+
+
+def test_installed_snap_is_configured_and_started(async_ctx: testing.Context, snapd: FakeSnapd):
+    state = submitted(async_ctx, snapd)
+    snapd.complete_change("1")
+    snapd.auto_complete = True
+
+    out = async_ctx.run(async_ctx.on.update_status(), state)
+
+    assert out.unit_status == ops.ActiveStatus()
+    assert snapd.snaps[SNAP]["config"]["cluster-name"] == "test"
+    assert snapd.snaps[SNAP]["services"] == {"daemon": True}
+
+
+def test_failed_install_is_not_submitted_again(async_ctx: testing.Context, snapd: FakeSnapd):
+    state = submitted(async_ctx, snapd)
+    snapd.complete_change("1", err="cannot install: store unreachable")
+
+    out = async_ctx.run(async_ctx.on.update_status(), state)
+    out = async_ctx.run(async_ctx.on.update_status(), out)
+
+    assert out.unit_status == FAILED
+    assert len(snapd.changes) == 1
+
+
+def test_failed_install_is_submitted_again_on_config_change(
+    async_ctx: testing.Context, snapd: FakeSnapd
+):
+    state = submitted(async_ctx, snapd)
+    snapd.complete_change("1", err="cannot install: store unreachable")
+    out = async_ctx.run(async_ctx.on.update_status(), state)
+
+    out = async_ctx.run(async_ctx.on.config_changed(), out)
+
+    assert out.unit_status == INSTALLING
+    assert len(snapd.changes) == 2
+
+
+def test_failed_install_is_submitted_again_by_the_action(
+    async_ctx: testing.Context, snapd: FakeSnapd
+):
+    state = submitted(async_ctx, snapd)
+    snapd.complete_change("1", err="cannot install: store unreachable")
+    out = async_ctx.run(async_ctx.on.update_status(), state)
+
+    async_ctx.run(async_ctx.on.action("refresh-snap"), out)
+
+    assert async_ctx.action_results == {"change-id": "2"}
+    assert len(snapd.changes) == 2
+
+
+def resources(snap: Optional[Path] = None) -> Set[testing.Resource]:
+    """Return the snap resources, empty placeholders unless `snap` is attached."""
+    return {
+        testing.Resource(name=f"{SNAP}-snap", path=snap or Path(os.devnull)),
+        testing.Resource(name=f"{SNAP}-snap-assertion", path=Path(os.devnull)),
+    }
+
+
+@pytest.fixture
+def snap_file(tmp_path: Path) -> Path:
+    """Snap file attached as charm resource."""
+    path = tmp_path / f"{SNAP}_12.snap"
+    path.write_bytes(b"hsqs\x00\x01binary")
+    return path
+
+
+def test_resource_is_installed(resource_ctx: testing.Context, snapd: FakeSnapd, snap_file: Path):
+    state = testing.State(leader=True, config=CONFIG, resources=resources(snap_file))
+
+    out = resource_ctx.run(resource_ctx.on.install(), state)
+
+    assert out.unit_status == ops.ActiveStatus()
+    assert [sideload["snap"] for sideload in snapd.sideloads] == [snap_file.name]
+    assert (snapd.snaps[SNAP]["revision"], snapd.snaps[SNAP]["channel"]) == ("x1", "")
+
+
+def test_unchanged_resource_is_not_installed_again(
+    resource_ctx: testing.Context, snapd: FakeSnapd, snap_file: Path
+):
+    state = testing.State(leader=True, config=CONFIG, resources=resources(snap_file))
+    out = resource_ctx.run(resource_ctx.on.install(), state)
+
+    out = resource_ctx.run(resource_ctx.on.upgrade_charm(), out)
+    resource_ctx.run(resource_ctx.on.config_changed(), out)
+
+    assert len(snapd.sideloads) == 1
+    assert snapd.snaps[SNAP]["revision"] == "x1"
+
+
+def test_changed_resource_is_installed(
+    resource_ctx: testing.Context, snapd: FakeSnapd, snap_file: Path
+):
+    state = testing.State(leader=True, config=CONFIG, resources=resources(snap_file))
+    out = resource_ctx.run(resource_ctx.on.install(), state)
+    snap_file.write_bytes(b"hsqs\x00\x02binary")
+
+    resource_ctx.run(resource_ctx.on.upgrade_charm(), out)
+
+    assert len(snapd.sideloads) == 2
+    assert snapd.snaps[SNAP]["revision"] == "x2"
+
+
+def test_emptied_resource_falls_back_to_the_store(
+    resource_ctx: testing.Context, snapd: FakeSnapd, snap_file: Path
+):
+    state = testing.State(leader=True, config=CONFIG, resources=resources(snap_file))
+    out = resource_ctx.run(resource_ctx.on.install(), state)
+    snapd.publish(SNAP, "20")
+
+    out = resource_ctx.run(
+        resource_ctx.on.upgrade_charm(),
+        dataclasses.replace(out, resources=resources(), config={**CONFIG, "snap-channel": "edge"}),
+    )
+
+    assert (snapd.snaps[SNAP]["revision"], snapd.snaps[SNAP]["channel"]) == ("20", "edge")
+    assert out.unit_status == ops.ActiveStatus()
+    # The snap tracks the store channel again.
+    resource_ctx.run(
+        resource_ctx.on.config_changed(),
+        dataclasses.replace(out, config={**CONFIG, "snap-channel": "beta"}),
+    )
+    assert snapd.snaps[SNAP]["channel"] == "beta"
@@ -0,0 +1,195 @@
+"""Tests of the incremental scans of the journal of the agent daemon."""
+
+import json
+from typing import Any, Dict, Optional
+
+import ops
+import pytest
+from agent_snapper.errors import SnapperSysCallError
+from agent_snapper.journal import _JOB_DONE, _JOB_STARTED, INITIAL_ENTRIES, scan_journal
+from fakes import FakeSnapCli, FakeSnapd
+from ops import testing
+
+SNAP = "vantage-agent"
+UNIT = f"snap.{SNAP}.daemon.service"
+CONFIG: Dict[str, Any] = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+    f"{SNAP}-cluster-name": "test",
+}
+# Job lines logged by APScheduler for a job named after its function and a job with a name.
+TRIGGER = "trigger: interval[0:01:00], next run at: 2024-05-02 10:01:00 UTC"
+STARTED = (
+    f'Running job "report_cluster_status ({TRIGGER})" (scheduled at 2024-05-02 10:00:00+00:00)'
+)
+DONE = f'Job "report_cluster_status ({TRIGGER})" executed successfully'
+CRON = "trigger: cron[minute='*/5'], next run at: 2024-05-02 10:05:00 UTC"
+NAMED_STARTED = (
+    f'Running job "Sync the cluster jobs ({CRON})" (scheduled at 2024-05-02 10:00:00+00:00)'
+)
+NAMED_FAILED = f'Job "Sync the cluster jobs ({CRON})" raised an exception'
+
+
+@pytest.mark.parametrize(
+    "message, job",
+    [
+        (STARTED, "report_cluster_status"),
+        (NAMED_STARTED, "Sync the cluster jobs"),
+        (
+            'Running job "report_cluster_status" (scheduled at 2024-05-02 10:00:00+00:00)',
+            "report_cluster_status",
+        ),
+        ("INFO Running job report_cluster_status", None),
+    ],
+)
+def test_started_jobs(message: str, job: Optional[str]):
+    started = _JOB_STARTED.search(message)
+
+    assert (started and started["job"]) == job
+
+
+@pytest.mark.parametrize(
+    "message, job",
+    [
+        (DONE, "report_cluster_status"),
+        (NAMED_FAILED, "Sync the cluster jobs"),
+        ('Job "report_cluster_status" executed successfully', "report_cluster_status"),
+        (f'Job "report_cluster_status ({TRIGGER})" missed by 0:00:02', None),
+    ],
+)
+def test_done_jobs(message: str, job: Optional[str]):
+    done = _JOB_DONE.search(message)
+
+    assert (done and done["job"]) == job
+
+
+def test_scan_sums_up_the_entries(snap_cli: FakeSnapCli):
+    snap_cli.log("Agent started", timestamp=1000.0)
+    snap_cli.log(STARTED, timestamp=1000.0)
+    snap_cli.log(NAMED_STARTED, timestamp=1001.0)
+    snap_cli.log(DONE, timestamp=1002.5)
+    snap_cli.log("Traceback (most recent call last):\n  ValueError: bad", priority=3)
+    snap_cli.log(NAMED_FAILED, timestamp=1007.0)
+    snap_cli.log("ERROR Cannot reach the API")
+
+    summary, cursor = scan_journal(snap_cli, UNIT)
+
+    assert summary.entries == 7
+    assert (summary.errors, summary.tracebacks) == (3, 1)
+    assert (summary.jobs, summary.job_seconds, summary.job_max_seconds) == (2, 8.5, 6.0)
+    assert summary.last_errors[-1] == "ERROR Cannot reach the API"
+    assert summary.message() == "3 errors, 1 tracebacks, 2 jobs avg 4.2s"
+    assert cursor == "s=fake;i=7"
+    assert snap_cli.calls[-1][:2] == (f"--unit={UNIT}", "--output=json")
+    assert f"--lines={INITIAL_ENTRIES}" in snap_cli.calls[-1]
+
+
+def test_scan_resumes_after_the_cursor(snap_cli: FakeSnapCli):
+    snap_cli.log("ERROR first")
+    _, cursor = scan_journal(snap_cli, UNIT)
+    snap_cli.log("second")
+
+    summary, next_cursor = scan_journal(snap_cli, UNIT, cursor)
+
+    assert f"--after-cursor={cursor}" in snap_cli.calls[-1]
+    assert (summary.entries, summary.errors) == (1, 0)
+    assert next_cursor == "s=fake;i=2"
+    # Without new entries, the scan resumes from the same cursor.
+    summary, last_cursor = scan_journal(snap_cli, UNIT, next_cursor)
+    assert (summary.entries, last_cursor) == (0, next_cursor)
+
+
+def test_binary_messages_are_decoded(snap_cli: FakeSnapCli):
+    snap_cli.log("")
+    snap_cli.journal[-1]["MESSAGE"] = list(b"ERROR caf\xc3\xa9 \xff")  # type: ignore[assignment]
+
+    summary, _ = scan_journal(snap_cli, UNIT)
+
+    assert summary.last_errors == ["ERROR café �"]
+
+
+def stored_journal(state: testing.State) -> Dict[str, Any]:
+    """Return the journal cursor and summary saved by the snapper."""
+    stored = state.get_stored_state("_stored", owner_path="AgentCharm/AgentSnapper")
+    return {
+        "cursor": stored.content["journal_cursor"],
+        "summary": json.loads(stored.content["journal_summary"] or "{}"),
+    }
+
+
+@pytest.fixture
+def running(ctx: testing.Context, snapd: FakeSnapd) -> testing.State:
+    """Return the state of a leader running the agent daemon."""
+    return ctx.run(ctx.on.install(), testing.State(leader=True, config=CONFIG))
+
+
+def test_update_status_scans_the_new_entries(
+    ctx: testing.Context, snap_cli: FakeSnapCli, running: testing.State
+):
+    snap_cli.log(STARTED, timestamp=1000.0)
+    snap_cli.log(DONE, timestamp=1002.0)
+
+    out = ctx.run(ctx.on.update_status(), running)
+
+    assert out.unit_status == ops.ActiveStatus("0 errors, 0 tracebacks, 1 jobs avg 2.0s")
+    assert stored_journal(out)["cursor"] == "s=fake;i=2"
+    snap_cli.log("ERROR Cannot reach the API")
+
+    out = ctx.run(ctx.on.update_status(), out)
+
+    # The summary is of the entries written since the last scan only.
+    assert out.unit_status == ops.ActiveStatus("1 errors, 0 tracebacks, 0 jobs")
+    assert stored_journal(out)["cursor"] == "s=fake;i=3"
+    assert stored_journal(out)["summary"]["entries"] == 1
+
+
+def test_rotated_cursor_is_reset(
+    ctx: testing.Context, snap_cli: FakeSnapCli, running: testing.State
+):
+    snap_cli.log("ERROR Cannot reach the API")
+    out = ctx.run(ctx.on.update_status(), running)
+    # The journal was rotated, its entries and so the saved cursor are gone.
+    snap_cli.journal.clear()
+
+    out = ctx.run(ctx.on.update_status(), out)
+
+    assert stored_journal(out)["cursor"] == ""
+    # The last summary is kept until the next scan succeeds.
+    assert out.unit_status == ops.ActiveStatus("1 errors, 0 tracebacks, 0 jobs")
+    snap_cli.log("Agent started")
+
+    out = ctx.run(ctx.on.update_status(), out)
+
+    assert stored_journal(out)["cursor"] == "s=fake;i=1"
+    assert out.unit_status == ops.ActiveStatus("0 errors, 0 tracebacks, 0 jobs")
+
+
+def test_journal_summary_action(
+    ctx: testing.Context, snap_cli: FakeSnapCli, running: testing.State
+):
+    snap_cli.log("ERROR Cannot reach the API")
+    out = ctx.run(ctx.on.update_status(), running)
+    snap_cli.log(STARTED, timestamp=1000.0)
+    snap_cli.log(DONE, timestamp=1003.0)
+
+    ctx.run(ctx.on.action("journal-summary"), out)
+
+    results = ctx.action_results["journal"]  # type: ignore[index]
+    assert results["last-check"]["errors"] == "1"
+    assert results["since-last-check"]["entries"] == "2"
+    assert results["since-last-check"]["job-mean-seconds"] == "3.000"
+
+
+def test_journal_summary_action_failure(
+    ctx: testing.Context,
+    snap_cli: FakeSnapCli,
+    running: testing.State,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    def fail(*args: Any, **kwargs: Any) -> str:
+        raise SnapperSysCallError("System command failed", stderr="No journal files were found.")
+
+    monkeypatch.setattr(snap_cli, "_journalctl", fail)
+
+    with pytest.raises(testing.ActionFailed, match=f"Cannot read the journal of {UNIT}"):
+        ctx.run(ctx.on.action("journal-summary"), running)
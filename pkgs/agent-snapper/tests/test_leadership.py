@@ -0,0 +1,66 @@
+"""Tests of the agent daemon following the leadership: run on the leader, standby elsewhere."""
+
+import dataclasses
+from typing import Any, Dict
+
+import ops
+from fakes import FakeSnapd
+from ops import testing
+
+SNAP = "vantage-agent"
+CONFIG: Dict[str, Any] = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+    f"{SNAP}-cluster-name": "test",
+}
+STANDBY = ops.ActiveStatus(f"{SNAP} status: standby")
+
+
+def test_warm_standby_is_installed_and_configured_but_stopped(
+    ctx: testing.Context, snapd: FakeSnapd
+):
+    out = ctx.run(ctx.on.install(), testing.State(leader=False, config=CONFIG))
+
+    assert out.unit_status == STANDBY
+    assert snapd.snaps[SNAP]["config"]["cluster-name"] == "test"
+    assert snapd.snaps[SNAP]["services"] == {"daemon": False}
+
+
+def test_new_leader_starts_the_daemon(ctx: testing.Context, snapd: FakeSnapd):
+    out = ctx.run(ctx.on.install(), testing.State(leader=False, config=CONFIG))
+
+    out = ctx.run(ctx.on.leader_elected(), dataclasses.replace(out, leader=True))
+
+    assert out.unit_status == ops.ActiveStatus()
+    assert snapd.snaps[SNAP]["services"] == {"daemon": True}
+
+
+def test_demoted_leader_stops_the_daemon(ctx: testing.Context, snapd: FakeSnapd):
+    out = ctx.run(ctx.on.install(), testing.State(leader=True, config=CONFIG))
+    assert snapd.snaps[SNAP]["services"] == {"daemon": True}
+
+    out = ctx.run(ctx.on.update_status(), dataclasses.replace(out, leader=False))
+
+    assert out.unit_status == STANDBY
+    assert snapd.snaps[SNAP]["services"] == {"daemon": False}
+
+
+def test_cold_standby_is_not_installed(ctx: testing.Context, snapd: FakeSnapd):
+    config = {**CONFIG, "warm-standby": False}
+
+    out = ctx.run(ctx.on.install(), testing.State(leader=False, config=config))
+    out = ctx.run(ctx.on.config_changed(), out)
+
+    assert out.unit_status == STANDBY
+    assert SNAP not in snapd.snaps
+
+
+def test_new_leader_installs_a_cold_standby(ctx: testing.Context, snapd: FakeSnapd):
+    config = {**CONFIG, "warm-standby": False}
+    out = ctx.run(ctx.on.install(), testing.State(leader=False, config=config))
+
+    out = ctx.run(ctx.on.leader_elected(), dataclasses.replace(out, leader=True))
+
+    assert out.unit_status == ops.ActiveStatus()
+    assert snapd.snaps[SNAP]["config"]["cluster-name"] == "test"
+    assert snapd.snaps[SNAP]["services"] == {"daemon": True}
@@ -0,0 +1,122 @@
+"""Tests of several agent snaps managed by a MultiAgentSnapper from one charm."""
+
+import dataclasses
+from typing import Any, Dict, List
+
+import ops
+import pytest
+from agent_snapper.charmed_agent import MultiAgentSnapper
+from fakes import FakeSnapd
+from ops import testing
+
+SNAPS = {"vantage-agent": ["cluster-name"], "jobbergate-agent": []}
+META = {"name": "agents", "subordinate": True}
+CONFIG = {
+    "options": {
+        "snap-channel": {"type": "string", "default": "stable"},
+        **{
+            f"{snap}-{key}": {"type": "string", "default": default}
+            for snap in SNAPS
+            for key, default in [
+                ("base-api-url", "https://apis.example.com"),
+                ("oidc-domain", "auth.example.com"),
+                ("oidc-client-id", ""),
+                ("oidc-client-secret", ""),
+                ("cluster-name", ""),
+            ]
+        },
+    }
+}
+AGENTS_CONFIG: Dict[str, Any] = {
+    f"{snap}-{key}": key
+    for snap in SNAPS
+    for key in ["oidc-client-id", "oidc-client-secret", "cluster-name"]
+}
+
+
+class AgentsCharm(ops.CharmBase):
+    """Charm managing the agent snaps of two agents."""
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.agents = MultiAgentSnapper(self, SNAPS)
+
+
+@pytest.fixture
+def ctx(snap_host: None) -> testing.Context:
+    """Context dispatching events to the charm of the two agents."""
+    return testing.Context(AgentsCharm, meta=META, config=CONFIG)
+
+
+def test_every_snap_is_installed_configured_and_started(ctx: testing.Context, snapd: FakeSnapd):
+    out = ctx.run(ctx.on.install(), testing.State(leader=True, config=AGENTS_CONFIG))
+
+    assert out.unit_status == ops.ActiveStatus()
+    for snap in SNAPS:
+        assert snapd.snaps[snap]["config"]["oidc-client-id"] == "oidc-client-id"
+        assert snapd.snaps[snap]["services"] == {"daemon": True}
+
+
+def test_most_severe_status_is_reported(ctx: testing.Context, snapd: FakeSnapd):
+    config = {**AGENTS_CONFIG, "vantage-agent-cluster-name": ""}
+
+    out = ctx.run(ctx.on.install(), testing.State(leader=True, config=config))
+
+    assert out.unit_status == ops.BlockedStatus(
+        "Cannot start vantage-agent. Missing Config: vantage-agent-cluster-name"
+    )
+    assert snapd.snaps["jobbergate-agent"]["services"] == {"daemon": True}
+    assert snapd.snaps["vantage-agent"]["services"] == {"daemon": False}
+
+
+def test_statuses_of_the_same_severity_are_merged(ctx: testing.Context, snapd: FakeSnapd):
+    config = {
+        **AGENTS_CONFIG,
+        "vantage-agent-cluster-name": "",
+        "jobbergate-agent-oidc-domain": "",
+    }
+
+    out = ctx.run(ctx.on.install(), testing.State(leader=True, config=config))
+
+    assert out.unit_status == ops.BlockedStatus(
+        "Cannot start vantage-agent. Missing Config: vantage-agent-cluster-name; "
+        "Cannot start jobbergate-agent. Missing Config: jobbergate-agent-oidc-domain"
+    )
+
+
+def test_standby_statuses_name_each_snap(ctx: testing.Context, snapd: FakeSnapd):
+    out = ctx.run(ctx.on.install(), testing.State(leader=False, config=AGENTS_CONFIG))
+
+    assert out.unit_status == ops.ActiveStatus(
+        "vantage-agent status: standby; jobbergate-agent status: standby"
+    )
+
+
+def test_each_snapper_keeps_its_own_stored_state(ctx: testing.Context, snapd: FakeSnapd):
+    out = ctx.run(ctx.on.install(), testing.State(leader=True, config=AGENTS_CONFIG))
+    assert {state.owner_path for state in out.stored_states} >= {
+        f"AgentsCharm/AgentSnapper[{snap}]" for snap in SNAPS
+    }
+    snapd.requests.clear()
+
+    config = {**AGENTS_CONFIG, "jobbergate-agent-oidc-domain": "auth.example.org"}
+    ctx.run(ctx.on.config_changed(), dataclasses.replace(out, config=config))
+
+    # Only the config of the snap whose config changed is read and written.
+    assert ("PUT", "/v2/snaps/jobbergate-agent/conf") in snapd.requests
+    assert ("GET", "/v2/snaps/vantage-agent/conf") not in snapd.requests
+    assert snapd.snaps["jobbergate-agent"]["config"]["oidc-domain"] == "auth.example.org"
+
+
+def test_snappers_share_one_backend_and_connection(
+    ctx: testing.Context, snapd: FakeSnapd, connects: List[Any]
+):
+    with ctx(ctx.on.install(), testing.State(leader=True, config=AGENTS_CONFIG)) as manager:
+        manager.run()
+        snappers = manager.charm.agents.snappers  # type: ignore[attr-defined]
+
+        backends = {id(snapper._backend) for snapper in snappers.values()}
+
+    assert len(backends) == 1
+    assert len(connects) == 1
+    assert len(snapd.requests) > len(SNAPS)
@@ -0,0 +1,211 @@
+"""Tests of the snap refresh rolled out in batches over the snap-refresh peer relation.
+
+The local unit is unit 0. It is the leader in the leader tests, and unit 1 in the others.
+"""
+
+import dataclasses
+import json
+from typing import Any, Dict, Optional
+
+import ops
+from fakes import FakeSnapd
+from ops import testing
+
+SNAP = "vantage-agent"
+KEY = f"{SNAP}-refresh"
+CONFIG = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+    f"{SNAP}-cluster-name": "test",
+    "snap-channel": "edge",
+    "snap-refresh-batch-size": 1,
+}
+
+
+def peers(
+    rollout: Optional[Dict[str, Any]] = None,
+    local: Optional[Dict[str, Any]] = None,
+    remote: Optional[Dict[int, Optional[Dict[str, Any]]]] = None,
+) -> testing.PeerRelation:
+    """Return the peer relation with the rollout of the leader and the reports of the units."""
+    return testing.PeerRelation(
+        "snap-refresh",
+        local_app_data={KEY: json.dumps(rollout)} if rollout else {},
+        local_unit_data={KEY: json.dumps(local)} if local else {},
+        peers_data={unit: {KEY: json.dumps(r)} if r else {} for unit, r in (remote or {}).items()},
+    )
+
+
+def rollout_of(state: testing.State, relation: testing.RelationBase) -> Dict[str, Any]:
+    return json.loads(state.get_relation(relation.id).local_app_data[KEY])
+
+
+def report_of(state: testing.State, relation: testing.RelationBase) -> Dict[str, Any]:
+    return json.loads(state.get_relation(relation.id).local_unit_data.get(KEY, "{}"))
+
+
+def test_leader_grants_the_first_batch(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP, services={"daemon": True})
+    relation = peers(remote={1: None, 2: None})
+    state = testing.State(leader=True, config=CONFIG, relations=[relation])
+
+    out = ctx.run(ctx.on.config_changed(), state)
+
+    assert rollout_of(out, relation) == {
+        "channel": "edge",
+        "granted": [f"{SNAP}/0"],
+        "halted": "",
+    }
+    assert report_of(out, relation) == {"channel": "edge", "status": "done"}
+    assert snapd.snaps[SNAP]["channel"] == "edge"
+
+
+def test_leader_grants_the_next_batch_once_the_previous_one_is_done(
+    ctx: testing.Context, snapd: FakeSnapd
+):
+    snapd.add_snap(SNAP, channel="latest/edge", services={"daemon": True})
+    relation = peers(
+        rollout={"channel": "edge", "granted": [f"{SNAP}/0"], "halted": ""},
+        local={"channel": "edge", "status": "done"},
+        remote={1: None, 2: None},
+    )
+    state = testing.State(leader=True, config=CONFIG, relations=[relation])
+
+    out = ctx.run(ctx.on.relation_changed(relation, remote_unit=1), state)
+
+    assert rollout_of(out, relation)["granted"] == [f"{SNAP}/1"]
+
+
+def test_granted_unit_refreshes_and_reports(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP)
+    relation = peers(
+        rollout={"channel": "edge", "granted": [f"{SNAP}/0"], "halted": ""}, remote={1: None}
+    )
+    state = testing.State(leader=False, config=CONFIG, relations=[relation])
+
+    out = ctx.run(ctx.on.relation_changed(relation, remote_unit=1), state)
+
+    assert snapd.snaps[SNAP]["channel"] == "edge"
+    assert report_of(out, relation) == {"channel": "edge", "status": "done"}
+
+
+def test_unit_waits_for_its_slot(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP)
+    relation = peers(
+        rollout={"channel": "edge", "granted": [f"{SNAP}/2"], "halted": ""}, remote={1: None}
+    )
+    state = testing.State(leader=False, config=CONFIG, relations=[relation])
+
+    out = ctx.run(ctx.on.relation_changed(relation, remote_unit=1), state)
+
+    assert snapd.snaps[SNAP]["channel"] == "latest/stable"
+    assert report_of(out, relation) == {}
+
+
+def test_failed_refresh_is_reported(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP)
+    snapd.fail("POST", f"/v2/snaps/{SNAP}", "cannot refresh: store unreachable")
+    relation = peers(
+        rollout={"channel": "edge", "granted": [f"{SNAP}/0"], "halted": ""}, remote={1: None}
+    )
+    state = testing.State(leader=False, config=CONFIG, relations=[relation])
+
+    out = ctx.run(ctx.on.relation_changed(relation, remote_unit=1), state)
+
+    assert report_of(out, relation) == {"channel": "edge", "status": "failed"}
+
+
+def test_leader_halts_the_rollout_on_failure(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP, channel="latest/edge", services={"daemon": True})
+    relation = peers(
+        rollout={"channel": "edge", "granted": [f"{SNAP}/1"], "halted": ""},
+        local={"channel": "edge", "status": "done"},
+        remote={1: {"channel": "edge", "status": "failed"}, 2: None},
+    )
+    state = testing.State(leader=True, config=CONFIG, relations=[relation])
+
+    out = ctx.run(ctx.on.relation_changed(relation, remote_unit=1), state)
+
+    halted = f"Snap refresh to edge halted, failed on: {SNAP}/1"
+    assert rollout_of(out, relation) == {
+        "channel": "edge",
+        "granted": [f"{SNAP}/1"],
+        "halted": halted,
+    }
+    assert out.unit_status == ops.BlockedStatus(halted)
+
+
+def test_stale_done_report_is_withdrawn(ctx: testing.Context, snapd: FakeSnapd):
+    # The snap was refreshed back to stable by hand after the unit reported the rollout done.
+    snapd.add_snap(SNAP)
+    relation = peers(
+        rollout={"channel": "edge", "granted": [f"{SNAP}/2"], "halted": ""},
+        local={"channel": "edge", "status": "done"},
+        remote={1: None},
+    )
+    state = testing.State(leader=False, config=CONFIG, relations=[relation])
+
+    out = ctx.run(ctx.on.relation_changed(relation, remote_unit=1), state)
+
+    assert report_of(out, relation) == {"channel": "edge", "status": "pending"}
+    assert snapd.snaps[SNAP]["channel"] == "latest/stable"
+
+
+def test_stale_done_report_does_not_skip_the_granted_refresh(
+    ctx: testing.Context, snapd: FakeSnapd
+):
+    snapd.add_snap(SNAP)
+    relation = peers(
+        rollout={"channel": "edge", "granted": [f"{SNAP}/0"], "halted": ""},
+        local={"channel": "edge", "status": "done"},
+        remote={1: None},
+    )
+    state = testing.State(leader=False, config=CONFIG, relations=[relation])
+
+    ctx.run(ctx.on.relation_changed(relation, remote_unit=1), state)
+
+    assert snapd.snaps[SNAP]["channel"] == "edge"
+
+
+def test_two_units_refresh_one_batch_after_the_other(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP, services={"daemon": True})
+    relation = peers(remote={1: None})
+    state = testing.State(leader=True, config=CONFIG, relations=[relation])
+
+    state = ctx.run(ctx.on.config_changed(), state)
+    assert rollout_of(state, relation)["granted"] == [f"{SNAP}/0"]
+    assert report_of(state, relation) == {"channel": "edge", "status": "done"}
+
+    # Unit 1 waits for its slot, then refreshes and reports.
+    state = ctx.run(ctx.on.update_status(), state)
+    assert rollout_of(state, relation)["granted"] == [f"{SNAP}/1"]
+    relation = dataclasses.replace(
+        state.get_relation(relation.id),
+        peers_data={1: {KEY: json.dumps({"channel": "edge", "status": "done"})}},
+    )
+    state = dataclasses.replace(state, relations=[relation])
+    state = ctx.run(ctx.on.relation_changed(relation, remote_unit=1), state)
+    assert rollout_of(state, relation)["granted"] == []
+
+
+def test_batches_hold_several_units(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP, services={"daemon": True})
+    relation = peers(remote={1: None, 2: None, 3: None})
+    config = {**CONFIG, "snap-refresh-batch-size": 3}
+    state = testing.State(leader=True, config=config, relations=[relation])
+
+    out = ctx.run(ctx.on.config_changed(), state)
+
+    assert rollout_of(out, relation)["granted"] == [f"{SNAP}/0", f"{SNAP}/1", f"{SNAP}/2"]
+
+
+def test_units_refresh_at_once_without_batches(ctx: testing.Context, snapd: FakeSnapd):
+    snapd.add_snap(SNAP)
+    relation = peers(remote={1: None})
+    config = {**CONFIG, "snap-refresh-batch-size": 0}
+    state = testing.State(leader=False, config=config, relations=[relation])
+
+    out = ctx.run(ctx.on.config_changed(), state)
+
+    assert snapd.snaps[SNAP]["channel"] == "edge"
+    assert report_of(out, relation) == {}
@@ -0,0 +1,153 @@
+"""Tests of the timeouts and retries of the snap operations."""
+
+import subprocess
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+from agent_snapper import AgentSnapper
+from agent_snapper.errors import SnapdError, SnapperSysCallError, SnapperTimeoutError
+from agent_snapper.retry import RetryPolicy, is_transient
+
+CONFLICT = SnapdError("changes in progress", kind="snap-change-conflict")
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (SnapdError("changes in progress", kind="snap-change-conflict"), True),
+        (SnapdError('snap "vantage-agent" not found', kind="snap-not-found"), False),
+        (
+            SnapperSysCallError(
+                "failed", stderr='error: snap "x" has "refresh" change in progress'
+            ),
+            True,
+        ),
+        (SnapperSysCallError("failed", stderr="error: cannot communicate with server"), True),
+        (SnapperSysCallError("failed", stderr="error: too early for operation"), True),
+        (SnapperSysCallError("failed", stderr='error: snap "x" not found'), False),
+        (SnapperTimeoutError("timed out", stderr="changes in progress"), False),
+        (ValueError("changes in progress"), False),
+    ],
+)
+def test_transient_errors(error: Exception, transient: bool):
+    assert is_transient(error) is transient
+
+
+@pytest.fixture
+def sleeps(monkeypatch: pytest.MonkeyPatch) -> List[float]:
+    """Record the delays slept for instead of sleeping, with the longest jitter."""
+    sleeps: List[float] = []
+    monkeypatch.setattr("agent_snapper.retry.time.sleep", sleeps.append)
+    monkeypatch.setattr("agent_snapper.retry.random.uniform", lambda low, high: high)
+    return sleeps
+
+
+def failing(errors: List[Exception]):
+    """Return a function raising the errors one after the other, then returning "ok"."""
+    calls = iter(errors)
+
+    def func(*args: str) -> str:
+        error = next(calls, None)
+        if error is not None:
+            raise error
+        return "ok"
+
+    return func
+
+
+def test_delays_grow_exponentially_up_to_the_max(sleeps: List[float]):
+    assert RetryPolicy().delays() == (1.0, 2.0, 4.0)
+    assert RetryPolicy(attempts=6, base_delay=2.0, max_delay=10.0).delays() == (
+        2.0,
+        4.0,
+        8.0,
+        10.0,
+        10.0,
+    )
+
+
+def test_delays_are_jittered():
+    delays = {RetryPolicy(attempts=2).delays() for _ in range(20)}
+
+    assert len(delays) > 1
+    assert all(0 <= delay <= 1.0 for (delay,) in delays)
+
+
+def test_transient_errors_are_retried(sleeps: List[float]):
+    assert RetryPolicy().call(failing([CONFLICT, CONFLICT]), "snap") == "ok"
+    assert sleeps == [1.0, 2.0]
+
+
+def test_permanent_errors_are_not_retried(sleeps: List[float]):
+    error = SnapdError("not found", kind="snap-not-found")
+
+    with pytest.raises(SnapdError) as raised:
+        RetryPolicy().call(failing([error]))
+    assert raised.value is error
+    assert sleeps == []
+
+
+def test_retries_are_bounded(sleeps: List[float]):
+    with pytest.raises(SnapdError):
+        RetryPolicy(attempts=3).call(failing([CONFLICT] * 3))
+    assert sleeps == [1.0, 2.0]
+
+
+def test_command_output():
+    assert AgentSnapper._sys_exec("sh", "-c", "echo out; echo err >&2") == "out\n"
+
+
+def test_failed_command():
+    with pytest.raises(SnapperSysCallError) as error:
+        AgentSnapper._sys_exec("sh", "-c", "echo 'error: no network' >&2; exit 1")
+    assert error.value.stderr == "error: no network\n"
+
+
+def test_missing_command(tmp_path: Path):
+    with pytest.raises(SnapperSysCallError, match="System command failed"):
+        AgentSnapper._sys_exec(tmp_path / "missing")
+
+
+def alive(pid: int) -> bool:
+    """Return True if the process runs, neither gone nor a zombie waiting to be reaped."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except FileNotFoundError:
+        return False
+    return stat.rsplit(")", 1)[1].split()[0] not in ("Z", "X")
+
+
+def wait_gone(pids: List[int], timeout: float = 5.0) -> List[int]:
+    """Return the processes still alive after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while any(alive(pid) for pid in pids) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return [pid for pid in pids if alive(pid)]
+
+
+def test_timeout_kills_the_process_group(tmp_path: Path):
+    pids = tmp_path / "pids"
+    script = f"sleep 60 & echo $! >> {pids}; echo $$ >> {pids}; sleep 60"
+
+    start = time.monotonic()
+    with pytest.raises(SnapperTimeoutError, match="timed out after 0.5s"):
+        AgentSnapper._sys_exec("sh", "-c", script, timeout=0.5)
+
+    assert time.monotonic() - start < 5
+    assert len(pids.read_text().split()) == 2
+    assert wait_gone([int(pid) for pid in pids.read_text().split()]) == []
+
+
+def test_processes_ignoring_sigterm_are_killed(tmp_path: Path):
+    pids = tmp_path / "pids"
+    script = f"trap '' TERM; sleep 60 & echo $! >> {pids}; echo $$ >> {pids}; sleep 60"
+    proc = subprocess.Popen(["sh", "-c", script], start_new_session=True)
+    while len(pids.read_text().split() if pids.exists() else []) < 2:
+        time.sleep(0.01)
+
+    AgentSnapper._kill_process_group(proc, grace=0.2)
+
+    assert proc.returncode is not None
+    assert wait_gone([int(pid) for pid in pids.read_text().split()]) == []
@@ -0,0 +1,99 @@
+"""Tests of the snapd REST API client against the fake snapd."""
+
+import threading
+from pathlib import Path
+
+import pytest
+from agent_snapper.errors import SnapdConnectionError, SnapdError, SnapperTimeoutError
+from agent_snapper.snapd import SnapdClient
+from fakes import FakeSnapd
+
+SNAP = "vantage-agent"
+
+
+def test_requests_reuse_the_connection(snapd: FakeSnapd, client: SnapdClient, connects: list):
+    snapd.add_snap(SNAP, config={"cluster-name": "test"})
+
+    assert client.snap(SNAP) is not None
+    assert client.get_conf(SNAP) == {"cluster-name": "test"}
+    client.wait_change(client.set_conf(SNAP, {"cluster-name": "other"}))
+
+    assert len(connects) == 1
+    assert len(snapd.requests) == 4
+    assert snapd.snaps[SNAP]["config"] == {"cluster-name": "other"}
+
+
+def test_dropped_connection_is_reopened_once(
+    snapd: FakeSnapd, client: SnapdClient, connects: list
+):
+    snapd.add_snap(SNAP)
+    client.snap(SNAP)
+    assert client._conn is not None and client._conn.sock is not None
+    client._conn.sock.close()
+
+    assert client.snap(SNAP) is not None
+    assert len(connects) == 2
+
+
+def test_unreachable_snapd(tmp_path: Path):
+    client = SnapdClient(tmp_path / "missing.socket")
+
+    assert not client.available
+    with pytest.raises(SnapdConnectionError):
+        client.snap(SNAP)
+
+
+def test_error_responses(snapd: FakeSnapd, client: SnapdClient):
+    assert client.snap(SNAP) is None
+
+    snapd.add_snap(SNAP)
+    snapd.fail("POST", f"/v2/snaps/{SNAP}", "changes in progress", kind="snap-change-conflict")
+    with pytest.raises(SnapdError) as error:
+        client.snap_action(SNAP, "refresh", channel="latest/edge")
+    assert error.value.kind == "snap-change-conflict"
+    assert error.value.status_code == 400
+
+
+def test_wait_change_until_done(snapd: FakeSnapd, client: SnapdClient):
+    snapd.add_snap(SNAP)
+    snapd.auto_complete = False
+    change_id = client.snap_action(SNAP, "refresh", channel="latest/edge")
+    threading.Timer(0.2, snapd.complete_change, [change_id]).start()
+
+    assert client.wait_change(change_id, timeout=5.0)["status"] == "Done"
+    assert snapd.snaps[SNAP]["channel"] == "latest/edge"
+
+
+def test_wait_change_raises_failures(snapd: FakeSnapd, client: SnapdClient):
+    snapd.add_snap(SNAP)
+    snapd.auto_complete = False
+    change_id = client.snap_action(SNAP, "refresh", channel="latest/edge")
+    snapd.complete_change(change_id, err="cannot refresh: no space left")
+
+    with pytest.raises(SnapdError, match="no space left"):
+        client.wait_change(change_id, timeout=5.0)
+    assert snapd.snaps[SNAP]["channel"] == "latest/stable"
+
+
+def test_wait_change_aborts_past_the_timeout(snapd: FakeSnapd, client: SnapdClient):
+    snapd.add_snap(SNAP)
+    snapd.auto_complete = False
+    change_id = client.snap_action(SNAP, "refresh", channel="latest/edge")
+
+    with pytest.raises(SnapperTimeoutError):
+        client.wait_change(change_id, timeout=0.1)
+    assert ("POST", f"/v2/changes/{change_id}") in snapd.requests
+    assert snapd.changes[change_id]["status"] == "Hold"
+    assert snapd.snaps[SNAP]["channel"] == "latest/stable"
+
+
+def test_sideload_sends_a_multipart_form(snapd: FakeSnapd, client: SnapdClient, tmp_path: Path):
+    snap_file = tmp_path / f"{SNAP}_12.snap"
+    snap_file.write_bytes(b"hsqs\x00\x01binary")
+
+    client.wait_change(client.sideload(snap_file, classic=True, dangerous=True))
+
+    assert snapd.sideloads == [
+        {"action": "install", "classic": "true", "dangerous": "true", "snap": snap_file.name}
+    ]
+    assert snapd.snaps[SNAP]["revision"] == "x1"
@@ -0,0 +1,289 @@
+"""Tests of the systemd health probe speaking D-Bus."""
+
+import io
+import socket
+import socketserver
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, cast
+
+import pytest
+from agent_snapper import charmed_agent
+from agent_snapper.systemd import (
+    _ERROR,
+    _ERROR_NAME,
+    _INTERFACE,
+    _MEMBER,
+    _METHOD_CALL,
+    _METHOD_RETURN,
+    _PATH,
+    _REPLY_SERIAL,
+    _SIGNATURE,
+    DBusError,
+    SystemdProbe,
+    _Reader,
+    _unit_path,
+    _Writer,
+)
+from fakes import FakeSnapd
+from ops import testing
+
+SNAP = "vantage-agent"
+UNIT = f"snap.{SNAP}.daemon.service"
+_SIGNAL = 4
+
+
+def encode(kind: int, serial: int, fields: List[Tuple[int, str, Any]], body: _Writer) -> bytes:
+    """Return a little endian D-Bus message."""
+    array = _Writer()
+    for code, signature, value in fields:
+        array.align(8)
+        array.fixed("y", code)
+        array.variant(signature, value)
+    header = _Writer()
+    header.data += struct.pack("<cBBBII", b"l", kind, 0, 1, len(body.data), serial)
+    header.fixed("u", len(array.data))
+    header.data += array.data
+    header.align(8)
+    return bytes(header.data + body.data)
+
+
+def decode(stream: io.BufferedIOBase) -> Optional[Tuple[int, int, Dict[int, Any], List[Any]]]:
+    """Read a D-Bus message and return its type, serial, header fields and body, if any."""
+    fixed = stream.read(16)
+    if not fixed:
+        return None
+    body_length, serial, fields_length = struct.unpack_from("<III", fixed, 4)
+    header_length = 16 + fields_length + (-(16 + fields_length) % 8)
+    message = fixed + stream.read(header_length - 16 + body_length)
+    reader = _Reader(message, "<", 16)
+    fields = {}
+    while reader.offset < 16 + fields_length:
+        reader.align(8)
+        code = reader.fixed("y")
+        fields[code] = reader.value("v")
+    reader.offset = header_length
+    return fixed[1], serial, fields, [reader.value(code) for code in fields.get(_SIGNATURE, "")]
+
+
+class FakeSystemBus(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """System bus answering the unit property reads of systemd from `properties`."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path):
+        super().__init__(str(socket_path), _FakeBusHandler)
+        self.socket_path = socket_path
+        self.properties: Dict[str, Tuple[str, Any]] = {}
+        self.authenticated = True
+        self.calls: List[str] = []
+
+    def set_unit(self, unit: str, active: str, sub: str, restarts: int = 0, uptime: float = 0):
+        """Set the state of a service unit."""
+        self.properties = {
+            f"{_unit_path(unit)}:ActiveState": ("s", active),
+            f"{_unit_path(unit)}:SubState": ("s", sub),
+            f"{_unit_path(unit)}:NRestarts": ("u", restarts),
+            f"{_unit_path(unit)}:ActiveEnterTimestampMonotonic": (
+                "t",
+                int((time.monotonic() - uptime) * 1e6),
+            ),
+        }
+
+
+class _FakeBusHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        bus = cast(FakeSystemBus, self.server)
+        if not self.rfile.readline().startswith(b"\0AUTH EXTERNAL "):
+            return
+        if not bus.authenticated:
+            self.wfile.write(b"REJECTED EXTERNAL\r\n")
+            return
+        self.wfile.write(b"OK 0123456789abcdef0123456789abcdef\r\n")
+        if self.rfile.readline() != b"BEGIN\r\n":
+            return
+        serial = 0
+        while (message := decode(self.rfile)) is not None:
+            kind, call_serial, fields, args = message
+            assert kind == _METHOD_CALL
+            bus.calls.append(fields[_MEMBER])
+            serial += 1
+            body = _Writer()
+            if fields[_MEMBER] == "Hello":
+                signal = encode(_SIGNAL, serial, [(_MEMBER, "s", "NameAcquired")], _Writer())
+                serial += 1
+                body.string(":1.42")
+                reply = [(_REPLY_SERIAL, "u", call_serial), (_SIGNATURE, "g", "s")]
+                self.wfile.write(signal + encode(_METHOD_RETURN, serial, reply, body))
+                continue
+            key = f"{fields[_PATH]}:{args[1]}"
+            if key not in bus.properties:
+                body.string(f"Unknown property {args[1]}")
+                reply = [
+                    (_ERROR_NAME, "s", "org.freedesktop.DBus.Error.UnknownProperty"),
+                    (_REPLY_SERIAL, "u", call_serial),
+                    (_SIGNATURE, "g", "s"),
+                ]
+                self.wfile.write(encode(_ERROR, serial, reply, body))
+                continue
+            body.variant(*bus.properties[key])
+            reply = [(_REPLY_SERIAL, "u", call_serial), (_SIGNATURE, "g", "v")]
+            self.wfile.write(encode(_METHOD_RETURN, serial, reply, body))
+
+
+@pytest.fixture
+def bus(tmp_path: Path) -> Iterator[FakeSystemBus]:
+    """Fake system bus serving on a socket of the test directory."""
+    bus = FakeSystemBus(tmp_path / "bus.socket")
+    threading.Thread(target=bus.serve_forever, args=(0.05,), daemon=True).start()
+    yield bus
+    bus.shutdown()
+    bus.server_close()
+
+
+def test_marshalling_aligns_values():
+    writer = _Writer()
+    writer.fixed("y", 7)
+    writer.string("ab")
+    writer.variant("t", 1)
+
+    assert bytes(writer.data) == (
+        b"\x07\0\0\0" + b"\x02\0\0\0ab\0" + b"\x01t\0" + b"\0" * 2 + struct.pack("<Q", 1)
+    )
+
+
+@pytest.mark.parametrize(
+    "code, value",
+    [("y", 255), ("b", True), ("n", -2), ("q", 2), ("i", -3), ("u", 3), ("x", -4), ("t", 4)]
+    + [("d", 0.5), ("s", "snap.é"), ("o", "/org/freedesktop/systemd1"), ("g", "sv")],
+)
+def test_variants_round_trip(code: str, value: Any):
+    writer = _Writer()
+    writer.fixed("y", 1)
+    writer.variant(code, value)
+
+    reader = _Reader(bytes(writer.data), "<", 1)
+    assert reader.value("v") == value
+    assert reader.offset == len(writer.data)
+
+
+def test_big_endian_values_are_decoded():
+    data = struct.pack(">I", 3) + b"abc\0" + struct.pack(">Q", 2**40)
+
+    reader = _Reader(data, ">")
+    assert (reader.value("s"), reader.value("t")) == ("abc", 2**40)
+
+
+def test_unsupported_types_are_refused():
+    with pytest.raises(DBusError, match="Unsupported"):
+        _Reader(b"\x02as\0", "<").value("v")
+
+
+def test_unit_paths_are_escaped():
+    assert _unit_path(UNIT) == (
+        "/org/freedesktop/systemd1/unit/snap_2evantage_2dagent_2edaemon_2eservice"
+    )
+
+
+def test_method_calls_round_trip():
+    sender, receiver = SystemdProbe(), SystemdProbe()
+    sender._sock, receiver._sock = socket.socketpair()
+    try:
+        serial = sender._send(
+            "org.freedesktop.systemd1",
+            _unit_path(UNIT),
+            "org.freedesktop.DBus.Properties",
+            "Get",
+            [("s", "org.freedesktop.systemd1.Unit"), ("s", "ActiveState")],
+        )
+        kind, fields, body = receiver._receive()
+    finally:
+        sender.close()
+        receiver.close()
+
+    assert (serial, kind) == (1, _METHOD_CALL)
+    assert fields[_PATH] == _unit_path(UNIT)
+    assert (fields[_INTERFACE], fields[_MEMBER]) == ("org.freedesktop.DBus.Properties", "Get")
+    assert body == ["org.freedesktop.systemd1.Unit", "ActiveState"]
+
+
+def test_health_of_an_active_unit(bus: FakeSystemBus):
+    bus.set_unit(UNIT, "active", "running", restarts=2, uptime=30)
+    probe = SystemdProbe(bus.socket_path)
+
+    health = probe.health(UNIT)
+    probe.close()
+
+    assert (health.state, health.restarts) == ("active", 2)
+    assert 30 <= health.uptime < 40
+    assert bus.calls[0] == "Hello"
+
+
+@pytest.mark.parametrize(
+    "active, sub, state",
+    [
+        ("activating", "auto-restart", "restarting"),
+        ("failed", "failed", "failed"),
+        ("inactive", "dead", "inactive"),
+    ],
+)
+def test_health_of_a_stopped_unit(bus: FakeSystemBus, active: str, sub: str, state: str):
+    bus.set_unit(UNIT, active, sub, restarts=5)
+    probe = SystemdProbe(bus.socket_path)
+
+    health = probe.health(UNIT)
+    probe.close()
+
+    assert (health.state, health.restarts, health.uptime) == (state, 5, 0.0)
+
+
+def test_error_replies_are_raised(bus: FakeSystemBus):
+    probe = SystemdProbe(bus.socket_path)
+
+    with pytest.raises(DBusError, match="UnknownProperty"):
+        probe.health(UNIT)
+    probe.close()
+
+
+def test_rejected_authentication(bus: FakeSystemBus):
+    bus.authenticated = False
+    probe = SystemdProbe(bus.socket_path)
+
+    with pytest.raises(DBusError, match="authentication failed"):
+        probe.health(UNIT)
+
+
+def test_unreachable_bus(tmp_path: Path):
+    probe = SystemdProbe(tmp_path / "missing.socket")
+
+    assert not probe.available
+    with pytest.raises(DBusError, match="Cannot reach"):
+        probe.health(UNIT)
+
+
+@pytest.mark.parametrize("bus_state", ["missing", "broken", "up"])
+def test_daemon_health_falls_back_to_snap_services(
+    monkeypatch: pytest.MonkeyPatch,
+    ctx: testing.Context,
+    snapd: FakeSnapd,
+    bus: FakeSystemBus,
+    bus_state: str,
+):
+    snapd.add_snap(SNAP, services={"daemon": True})
+    if bus_state != "missing":
+        # The broken bus knows no unit, so every property read is answered with an error.
+        monkeypatch.setattr(charmed_agent, "SYSTEM_BUS_SOCKET", bus.socket_path)
+    if bus_state == "up":
+        bus.set_unit(UNIT, "activating", "auto-restart", restarts=3)
+
+    with ctx(ctx.on.update_status(), testing.State()) as manager:
+        health = manager.charm.snapper.daemon_health  # type: ignore[attr-defined]
+
+    if bus_state == "up":
+        assert (health.state, health.restarts) == ("restarting", 3)
+        assert ("GET", "/v2/apps") not in snapd.requests
+    else:
+        assert health.state == "active"
+        assert ("GET", "/v2/apps") in snapd.requests
@@ -0,0 +1,184 @@
+"""Tests of the timings of the snap operations and event handlers."""
+
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+from agent_snapper.errors import SnapperSysCallError
+from agent_snapper.timing import RECENT_SAMPLES, Timing, TimingRecorder
+from fakes import FakeSnapd
+from ops import testing
+
+SNAP = "vantage-agent"
+LABELS = {"snap": SNAP, "unit": f"{SNAP}/0"}
+CONFIG: Dict[str, Any] = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+    f"{SNAP}-cluster-name": "test",
+    "timings-enabled": True,
+}
+
+
+def recorder(tmp_path: Path, enabled: bool = True) -> TimingRecorder:
+    """Return a recorder storing its timings and textfile in the test directory."""
+    return TimingRecorder(
+        tmp_path / "timings.json",
+        labels=LABELS,
+        enabled=enabled,
+        textfile_path=tmp_path / "textfile" / f"{SNAP}-charm.prom",
+    )
+
+
+def record(timings: TimingRecorder, kind: str, name: str, seconds: float, ok: bool = True):
+    """Record a timing of the given duration."""
+    timing = Timing(kind, name)
+    timing.seconds, timing.ok = seconds, ok
+    timings._timings.append(timing)
+
+
+def test_flush_merges_the_timings_into_the_store(tmp_path: Path):
+    for seconds in (0.015625, 0.375):
+        timings = recorder(tmp_path)
+        record(timings, "snap", "set", seconds, ok=seconds < 0.1)
+        timings.flush()
+
+    store = json.loads((tmp_path / "timings.json").read_text())
+    assert store["metrics"] == {
+        "snap:set": {
+            "kind": "snap",
+            "name": "set",
+            "count": 2,
+            "errors": 1,
+            "sum": 0.390625,
+            "bytes": 0,
+            "buckets": [0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0],
+        }
+    }
+    assert [sample[1:] for sample in store["recent"]] == [
+        ["snap", "set", 0.015625, True],
+        ["snap", "set", 0.375, False],
+    ]
+
+
+def test_recent_samples_are_bounded(tmp_path: Path):
+    timings = recorder(tmp_path)
+    for _ in range(RECENT_SAMPLES + 10):
+        record(timings, "snapd", "GET /v2/snaps", 0.001)
+    timings.flush()
+
+    store = timings.load()
+    assert store["metrics"]["snapd:GET /v2/snaps"]["count"] == RECENT_SAMPLES + 10
+    assert len(store["recent"]) == RECENT_SAMPLES
+
+
+def test_prometheus_textfile(tmp_path: Path):
+    (tmp_path / "textfile").mkdir()
+    timings = recorder(tmp_path)
+    record(timings, "snap", "set", 0.015625)
+    record(timings, "snap", "set", 0.375, ok=False)
+    timings.flush()
+
+    labels = f'snap="{SNAP}",unit="{SNAP}/0",kind="snap",name="set"'
+    buckets = zip(
+        ["0.005", "0.01", "0.025", "0.05", "0.1", "0.25", "0.5", "1.0", "2.5", "5.0", "10.0"]
+        + ["30.0", "60.0", "+Inf"],
+        [0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2],
+    )
+    assert (tmp_path / "textfile" / f"{SNAP}-charm.prom").read_text() == "\n".join(
+        [
+            "# HELP agent_snapper_duration_seconds Duration of agent snapper operations.",
+            "# TYPE agent_snapper_duration_seconds histogram",
+            *(
+                f'agent_snapper_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                for bound, count in buckets
+            ),
+            f"agent_snapper_duration_seconds_sum{{{labels}}} 0.390625",
+            f"agent_snapper_duration_seconds_count{{{labels}}} 2",
+            "# HELP agent_snapper_errors_total Failed agent snapper operations.",
+            "# TYPE agent_snapper_errors_total counter",
+            f"agent_snapper_errors_total{{{labels}}} 1",
+            "",
+        ]
+    )
+
+
+def test_prometheus_labels_are_escaped(tmp_path: Path):
+    timings = recorder(tmp_path)
+
+    assert timings._format_labels(name='say "hi"\\\n') == (
+        f'snap="{SNAP}",unit="{SNAP}/0",name="say \\"hi\\"\\\\\\n"'
+    )
+
+
+def test_textfile_is_only_written_in_an_existing_directory(tmp_path: Path):
+    timings = recorder(tmp_path)
+    record(timings, "snap", "set", 0.01)
+    timings.flush()
+
+    assert (tmp_path / "timings.json").exists()
+    assert not (tmp_path / "textfile").exists()
+
+
+def test_disabled_recorder_records_nothing(tmp_path: Path):
+    timings = recorder(tmp_path, enabled=False)
+
+    def sys_exec(*cmd: Any, timeout: float = 0) -> str:
+        return ""
+
+    assert timings.wrap_exec(sys_exec) is sys_exec
+    timings.flush()
+    assert not (tmp_path / "timings.json").exists()
+
+
+def test_commands_are_timed_by_verb(tmp_path: Path):
+    timings = recorder(tmp_path)
+
+    def sys_exec(*cmd: Any, timeout: float = 0) -> str:
+        if cmd[1] == "refresh":
+            raise SnapperSysCallError("System command failed", stderr="error: no network")
+        return "output"
+
+    timed_exec = timings.wrap_exec(sys_exec)
+    assert timed_exec("/usr/bin/snap", "get", SNAP, timeout=10) == "output"
+    with pytest.raises(SnapperSysCallError):
+        timed_exec("/usr/bin/snap", "refresh", SNAP)
+    timings.flush()
+
+    metrics = timings.load()["metrics"]
+    assert sorted(metrics) == ["snap:get", "snap:refresh"]
+    assert (metrics["snap:get"]["bytes"], metrics["snap:get"]["errors"]) == (6, 0)
+    assert metrics["snap:refresh"]["errors"] == 1
+
+
+def test_summary_table(tmp_path: Path):
+    timings = recorder(tmp_path)
+    for seconds in (0.01, 0.02, 0.03):
+        record(timings, "snap", "set", seconds)
+    timings.flush()
+
+    header, row = timings.summary().splitlines()
+    assert header.split() == ["operation", "count", "errors", "mean", "p95", "max"]
+    assert row.split() == ["snap", "set", "3", "0", "20.0ms", "30.0ms", "30.0ms"]
+
+
+def test_show_timings_action(ctx: testing.Context, snapd: FakeSnapd, tmp_path: Path):
+    snapd.add_snap(SNAP)
+    (tmp_path / "textfile").mkdir()
+    config = {**CONFIG, "timings-textfile-dir": str(tmp_path / "textfile")}
+    state = testing.State(leader=True, config=config)
+
+    ctx.run(ctx.on.config_changed(), state)
+    ctx.run(ctx.on.action("show-timings"), state)
+
+    timings = ctx.action_results["timings"].splitlines()  # type: ignore[index]
+    operations = {line[:40].strip() for line in timings[1:]}
+    assert {"handler reconcile", "snapd PUT /v2/snaps/{name}/conf"} <= operations
+    assert (tmp_path / f"{SNAP}-timings.json").exists()
+    prom = (tmp_path / "textfile" / f"{SNAP}-charm.prom").read_text()
+    assert 'kind="handler",name="reconcile"' in prom
+
+
+def test_show_timings_action_without_timings(ctx: testing.Context, snapd: FakeSnapd):
+    with pytest.raises(testing.ActionFailed, match="No timings recorded yet"):
+        ctx.run(ctx.on.action("show-timings"), testing.State(config={**CONFIG}))
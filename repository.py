@@ -6,20 +6,26 @@
 
 import argparse
 import glob
+import hashlib
 import logging
 import os
+import pickle
 import shutil
+import signal
+import statistics
 import subprocess
-import tomllib
+import time
 import sys
 import itertools
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+from functools import partial
 from pathlib import Path
-from threading import Thread
-from dataclasses import dataclass
-from collections.abc import Iterable, Mapping, MutableSequence
+from threading import Lock, Thread, local
+from dataclasses import dataclass, field
+from collections.abc import Callable, Iterable, Iterator, Mapping, MutableSequence
 from typing import Any
 
-import yaml
 
 ROOT_DIR = Path(__file__).parent.resolve()
 BUILD_PATH = ROOT_DIR / "_build"
@@ -29,11 +35,83 @@ PYPROJECT_FILE = "pyproject.toml"
 CHARMCRAFT_FILE = "charmcraft.yaml"
 LOCK_FILE = "uv.lock"
 LIBS_CHARM_PATH = BUILD_PATH / "libs"
+BENCHMARKS_PATH = ROOT_DIR / "tests" / "benchmarks"
+CHARM_CACHE_PATH = BUILD_PATH / "cache"
+SDIST_CACHE_PATH = BUILD_PATH / "sdist-cache"
+REQUIREMENTS_CACHE_PATH = BUILD_PATH / "requirements-cache"
+REPOSITORY_CACHE_FILE = BUILD_PATH / "repository.pickle"
+# Files the repository information is loaded from, as patterns relative to the root directory.
+REPOSITORY_INPUTS = [
+    Path(__file__).name,
+    PYPROJECT_FILE,
+    LOCK_FILE,
+    f"charms/*/{PYPROJECT_FILE}",
+    f"charms/*/{CHARMCRAFT_FILE}",
+    "charms/*/lib/charms/**/*.py",
+    f"pkgs/*/{PYPROJECT_FILE}",
+    f"projects/*/{PYPROJECT_FILE}",
+]
+# Cache entries unused for longer are evicted, then the least recently used ones over the size
+# limit of the cache.
+CACHE_MAX_AGE = 30 * 24 * 3600
+CHARM_CACHE_MAX_SIZE = 2 * 1024**3
+SDIST_CACHE_MAX_SIZE = 256 * 1024**2
+# Files and directories of the charms never staged, as `fnmatch` patterns matched against their
+# names. Extended by the `stage-ignore` list of the `[tool.repository]` table.
+STAGE_IGNORE = [
+    ".venv",
+    "venv",
+    ".tox",
+    "__pycache__",
+    "*.py[cod]",
+    ".pytest_cache",
+    ".mypy_cache",
+    ".ruff_cache",
+    ".coverage*",
+    "*.egg-info",
+    "*.charm",
+]
+STARTUP_RUNS = 5
+
+# Appended to the build of the charm part, so the packed charm ships the bytecode of its source,
+# libs and venv instead of compiling every imported module on the first hook dispatches.
+# The build base Python is the one the charm runs with on the same base.
+COMPILE_BYTECODE_STEP = (
+    'python3 -m compileall -q -j 0 --invalidation-mode checked-hash "$CRAFT_PART_INSTALL"'
+)
 
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Name of the build job run by the current thread, prefixing its output.
+_job = local()
+# Commands started by the build tools and still running, terminated when a job fails.
+_running_commands: set[subprocess.Popen] = set()
+_running_commands_lock = Lock()
+_print_lock = Lock()
+
+
+class _JobLogFilter(logging.Filter):
+    """Prefix the log messages of a build job with its name."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if name := getattr(_job, "name", None):
+            record.msg = f"[{name}] {record.msg}"
+        return True
+
+
+logger.addFilter(_JobLogFilter())
+
+
+def _terminate_running_commands() -> None:
+    with _running_commands_lock:
+        for process in _running_commands:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
 
 class RepositoryError(Exception):
     """Raise if the tool could not execute correctly."""
@@ -55,22 +133,42 @@ class BuildTool:
         self.path = tool_path
 
     def run_command(self, args: MutableSequence[str], *popenargs, **kwargs):
+        prefix = f"[{name}] " if (name := getattr(_job, "name", None)) else ""
+        # Lines of output collected instead of printed.
+        output: list[str] | None = kwargs.pop("output", None)
+
         def reader(pipe):
             with pipe:
                 for line in pipe:
                     line.replace(str(BUILD_PATH), str(CHARMS_PATH))
-                    print(line, end="")
+                    if output is not None:
+                        output.append(line)
+                    else:
+                        print(f"{prefix}{line}", end="")
 
         kwargs["text"] = True
+        if prefix:
+            # Own process group, so that the whole command is terminated if another job fails.
+            kwargs.setdefault("process_group", 0)
         args.insert(0, self.path)
         env = kwargs.pop("env", os.environ)
         env["COLOR"] = "1"
         with subprocess.Popen(
             args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs
         ) as process:
-            Thread(target=reader, args=[process.stdout]).start()
-            Thread(target=reader, args=[process.stderr]).start()
+            with _running_commands_lock:
+                _running_commands.add(process)
+            readers = [
+                Thread(target=reader, args=[process.stdout]),
+                Thread(target=reader, args=[process.stderr]),
+            ]
+            for thread in readers:
+                thread.start()
             return_code = process.wait()
+            for thread in readers:
+                thread.join()
+            with _running_commands_lock:
+                _running_commands.discard(process)
 
         if return_code != 0:
             raise subprocess.CalledProcessError(returncode=return_code, cmd=args)
@@ -124,6 +222,11 @@ class Package:
     version: str
     path: Path
 
+    @property
+    def sdist_name(self) -> str:
+        """Get the file name of the source distribution of this package."""
+        return f"{self.name.replace('-', '_')}-{self.version}.tar.gz"
+
 
 @dataclass
 class Charm:
@@ -150,6 +253,89 @@ class Charm:
         return BUILD_PATH / f"{self.path.name}.charm"
 
 
+class LockGraph:
+    """Dependency graph of the packages locked in `uv.lock`.
+
+    Packages are indexed by name, and the transitive closure of each package is computed once,
+    the first time it is needed, then shared by every charm depending on it.
+    """
+
+    def __init__(self, uv_lock: Mapping[str, Any]) -> None:
+        """Index the packages of the parsed lock file."""
+        self._packages: dict[str, list[Mapping[str, Any]]] = {}
+        for package in uv_lock["package"]:
+            self._packages.setdefault(package["name"], []).append(package)
+        self._closures: dict[str, frozenset[str]] = {}
+
+    def __contains__(self, name: str) -> bool:
+        """Check whether the package is in the lock."""
+        return name in self._packages
+
+    def version(self, name: str) -> str:
+        """Get the locked version of a package."""
+        try:
+            return self._packages[name][0]["version"]
+        except KeyError:
+            raise RepositoryError(f"Could not find package `{name}` in the lock file")
+
+    def dependencies(self, name: str) -> set[str]:
+        """Get the names of the direct dependencies of a package, for every locked version."""
+        try:
+            entries = self._packages[name]
+        except KeyError:
+            raise RepositoryError(f"Could not find package `{name}` in the lock file")
+        return {dep["name"] for entry in entries for dep in entry.get("dependencies", [])}
+
+    def closure(self, name: str) -> frozenset[str]:
+        """Get the names of a package and of all its transitive dependencies."""
+        if name not in self._closures:
+            self._resolve(name)
+        return self._closures[name]
+
+    def _resolve(self, root: str) -> None:
+        """Compute the closures of the packages reachable from `root` that are not known yet.
+
+        Tarjan's algorithm finds the groups of packages depending on each other, which share
+        one closure, in an order where the dependencies of a group are always resolved first.
+        """
+        index: dict[str, int] = {}
+        lowlink: dict[str, int] = {}
+        stack: list[str] = []
+        work: list[tuple[str, Iterator[str]]] = []
+
+        def visit(name: str) -> None:
+            index[name] = lowlink[name] = len(index)
+            stack.append(name)
+            work.append((name, iter(self.dependencies(name))))
+
+        visit(root)
+        while work:
+            name, deps = work[-1]
+            for dep in deps:
+                if dep in self._closures:
+                    continue
+                if dep not in index:
+                    visit(dep)
+                    break
+                # Not resolved yet, so still on the stack: part of the group of `name`.
+                lowlink[name] = min(lowlink[name], index[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[name])
+                if lowlink[name] == index[name]:
+                    group = set(stack[stack.index(name) :])
+                    del stack[stack.index(name) :]
+                    closure = set(group)
+                    for member in group:
+                        for dep in self.dependencies(member) - group:
+                            closure |= self._closures[dep]
+                    shared = frozenset(closure)
+                    for member in group:
+                        self._closures[member] = shared
+
+
 @dataclass(init=False)
 class Repository:
     """Information about the monorepo."""
@@ -158,9 +344,16 @@ class Repository:
     internal_packages: Iterable[Package]
     external_libraries: Iterable[CharmLibrary]
     internal_libraries: Iterable[CharmLibrary]
+    lock: LockGraph
+    lock_digest: str
+    startup_budget: float
+    stage_ignore: list[str]
 
     def __init__(self) -> None:
         """Load the monorepo information."""
+        # Imported when needed, not to slow down the sub-commands not working on the repository.
+        import tomllib
+
         UV.run_command(["lock", "--quiet"])
         try:
             with (ROOT_DIR / PYPROJECT_FILE).open(mode="rb") as f:
@@ -169,10 +362,21 @@ class Repository:
             raise RepositoryError(f"Failed to read file `{ROOT_DIR / PYPROJECT_FILE}`")
 
         try:
-            with (ROOT_DIR / LOCK_FILE).open(mode="rb") as f:
-                uv_lock = tomllib.load(f)
+            lock_data = (ROOT_DIR / LOCK_FILE).read_bytes()
         except OSError:
             raise RepositoryError("Failed to read uv.lock file")
+        lock = LockGraph(tomllib.loads(lock_data.decode()))
+        lock_digest = hashlib.sha256(lock_data).hexdigest()
+
+        try:
+            startup_budget = float(project["tool"]["repository"]["startup-budget-ms"])
+        except KeyError:
+            startup_budget = 0.0
+
+        try:
+            stage_ignore = STAGE_IGNORE + project["tool"]["repository"]["stage-ignore"]
+        except KeyError:
+            stage_ignore = STAGE_IGNORE
 
         try:
             external_libraries = [
@@ -186,17 +390,10 @@ class Repository:
             binary_packages = project["tool"]["repository"]["binary-packages"]
 
             resolved_binary_packages = {
-                bin_pkg: package["version"]
-                for bin_pkg in binary_packages
-                for package in uv_lock["package"]
-                if package["name"] == bin_pkg
+                bin_pkg: lock.version(bin_pkg) for bin_pkg in binary_packages if bin_pkg in lock
             }
         except KeyError:
             resolved_binary_packages = {}
-        except StopIteration:
-            raise RepositoryError("Could not find package in the lock file")
-        except OSError:
-            raise RepositoryError(f"Failed to read file `{ROOT_DIR / LOCK_FILE}`")
 
         internal_libraries = []
         for charm in CHARMS_PATH.iterdir():
@@ -230,7 +427,7 @@ class Repository:
                     internal_libraries,
                     internal_packages,
                     resolved_binary_packages,
-                    uv_lock,
+                    lock,
                 )
             )
             is not None
@@ -240,6 +437,69 @@ class Repository:
         self.external_libraries = external_libraries
         self.internal_libraries = internal_libraries
         self.internal_packages = internal_packages
+        self.lock = lock
+        self.lock_digest = lock_digest
+        self.startup_budget = startup_budget
+        self.stage_ignore = stage_ignore
+
+
+def _repository_inputs() -> dict[Path, Path]:
+    return {
+        path.relative_to(ROOT_DIR): path
+        for pattern in REPOSITORY_INPUTS
+        for path in sorted(ROOT_DIR.glob(pattern))
+    }
+
+
+def _stats(files: Mapping[Path, Path]) -> dict[Path, tuple[int, int]]:
+    return {
+        relpath: (stat.st_mtime_ns, stat.st_size)
+        for relpath, path in files.items()
+        for stat in [path.stat()]
+    }
+
+
+def load_repository() -> Repository:
+    """Load the monorepo information, reusing the one cached if its files did not change.
+
+    Files with other modification times are compared by digest. Since the lock is refreshed when
+    the information is loaded, unchanged files also mean that `uv lock` has nothing to do.
+    """
+    inputs = _repository_inputs()
+    stats = _stats(inputs)
+    try:
+        with REPOSITORY_CACHE_FILE.open("rb") as f:
+            cached = pickle.load(f)
+    except Exception:
+        # Missing, or written by another version of this script: loaded again below.
+        cached = {}
+
+    if cached.get("module") == __name__:
+        if cached["stats"] == stats:
+            return cached["repository"]
+        if cached["digest"] == files_digest(inputs):
+            logger.debug("repository files touched but unchanged")
+            _save_repository(cached["repository"], inputs)
+            return cached["repository"]
+
+    repository = Repository()
+    # The lock may have been updated.
+    _save_repository(repository, _repository_inputs())
+    return repository
+
+
+def _save_repository(repository: Repository, inputs: Mapping[Path, Path]):
+    cached = {
+        "module": __name__,
+        "stats": _stats(inputs),
+        "digest": files_digest(inputs),
+        "repository": repository,
+    }
+    BUILD_PATH.mkdir(exist_ok=True)
+    partial_path = REPOSITORY_CACHE_FILE.with_name(f".{REPOSITORY_CACHE_FILE.name}.partial")
+    with partial_path.open("wb") as f:
+        pickle.dump(cached, f)
+    partial_path.replace(REPOSITORY_CACHE_FILE)
 
 
 def load_charm(
@@ -248,8 +508,12 @@ def load_charm(
     internal_libraries: Iterable[CharmLibrary],
     internal_packages: Iterable[Package],
     binary_packages: Mapping[str, str],
-    uv_lock: Mapping[str, Any],
+    lock: LockGraph,
 ) -> Charm | None:
+    import tomllib
+
+    import yaml
+
     try:
         with (charm / PYPROJECT_FILE).open(mode="rb") as f:
             project = tomllib.load(f)
@@ -266,23 +530,16 @@ def load_charm(
         raise RepositoryError(f"Failed to read file `{charm / CHARMCRAFT_FILE}`")
 
     # Since the `lock` file only lists direct dependencies for a specific package,
-    # we need to recursively collect all the dependencies in order to see which
-    # dependencies need to be specified as binary packages.
-    deps = set()
-    pending = [charm.name]
-    while pending:
-        package = pending.pop()
-        deps.add(package)
-        for pkg_dep in next(
-            (pkg.get("dependencies", []) for pkg in uv_lock["package"] if pkg["name"] == package)
-        ):
-            if pkg_dep["name"] not in deps:
-                deps.add(pkg_dep["name"])
-                pending.append(pkg_dep["name"])
+    # we need all the transitive dependencies in order to see which dependencies need
+    # to be specified as binary packages.
+    deps = lock.closure(charm.name)
 
     metadata["parts"]["charm"]["charm-binary-python-packages"] = [
         f"{package}=={version}" for package, version in binary_packages.items() if package in deps
     ]
+    metadata["parts"]["charm"].setdefault(
+        "override-build", f"craftctl default\n{COMPILE_BYTECODE_STEP}\n"
+    )
 
     libraries = []
     try:
@@ -309,6 +566,8 @@ def load_charm(
 
 
 def load_package(package: Path) -> Package | None:
+    import tomllib
+
     try:
         with (package / PYPROJECT_FILE).open(mode="rb") as f:
             metadata = tomllib.load(f)
@@ -332,6 +591,179 @@ def copy(src: Path, dest: Path):
     shutil.copy(src, dest)
 
 
+def sync_file(src: Path, dest: Path) -> bool:
+    """Make dest a copy of the src file, unless it already is one.
+
+    Files with the same size and modification time are the same. Files with the same size only
+    are compared by content, so that touched files are not copied again. The copy is a hard link
+    when possible, so the staged files must be replaced and never edited in place.
+
+    Returns True if dest was updated.
+    """
+    src_stat = src.stat()
+    try:
+        dest_stat = dest.stat()
+    except FileNotFoundError:
+        pass
+    else:
+        if src_stat.st_size == dest_stat.st_size:
+            if src_stat.st_mtime_ns == dest_stat.st_mtime_ns:
+                return False
+            with src.open("rb") as f, dest.open("rb") as g:
+                same = hashlib.file_digest(f, "sha256").digest() == (
+                    hashlib.file_digest(g, "sha256").digest()
+                )
+            if same:
+                # Spare the comparison to the next syncs.
+                os.utime(dest, ns=(dest_stat.st_atime_ns, src_stat.st_mtime_ns))
+                return False
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    partial_dest = dest.with_name(f".{dest.name}.partial")
+    partial_dest.unlink(missing_ok=True)
+    try:
+        os.link(src, partial_dest)
+    except OSError:
+        # Another filesystem, or one without hard links.
+        shutil.copy2(src, partial_dest)
+    partial_dest.replace(dest)
+    return True
+
+
+def write_file(path: Path, content: str) -> bool:
+    """Write the content to the file, unless it already has it.
+
+    The file is replaced rather than rewritten, not to edit a hard linked source.
+
+    Returns True if the file was written.
+    """
+    try:
+        if path.read_text() == content:
+            return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    partial_path = path.with_name(f".{path.name}.partial")
+    partial_path.write_text(content)
+    partial_path.replace(path)
+    return True
+
+
+def is_ignored(name: str, ignore: Iterable[str]) -> bool:
+    """Check if the file name matches one of the ignore patterns."""
+    return any(fnmatch(name, pattern) for pattern in ignore)
+
+
+def source_files(root: Path, ignore: Iterable[str]) -> dict[Path, Path]:
+    """Get the files of the root directory not ignored, by path relative to the root."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not is_ignored(name, ignore)]
+        for name in filenames:
+            if not is_ignored(name, ignore):
+                path = Path(dirpath) / name
+                files[path.relative_to(root)] = path
+    return files
+
+
+def sync_files(
+    files: Mapping[Path, Path],
+    dest: Path,
+    ignore: Iterable[str] = (),
+    keep: Iterable[Path] = (),
+) -> tuple[int, int]:
+    """Sync the dest directory with the files, given by destination path relative to it.
+
+    The files in dest that are not in `files` are removed, except the ignored ones and the ones
+    to `keep`.
+
+    Returns the number of files updated and removed.
+    """
+    keep = set(keep)
+    dirs = {parent for relpath in files for parent in relpath.parents}
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(dest):
+        reldir = Path(dirpath).relative_to(dest)
+        for name in list(dirnames):
+            if is_ignored(name, ignore):
+                dirnames.remove(name)
+            elif reldir / name not in dirs:
+                logger.debug("Removing stale directory %s", Path(dirpath) / name)
+                shutil.rmtree(Path(dirpath) / name)
+                dirnames.remove(name)
+                removed += 1
+        for name in filenames:
+            relpath = reldir / name
+            if relpath not in files and relpath not in keep and not is_ignored(name, ignore):
+                logger.debug("Removing stale file %s", Path(dirpath) / name)
+                (Path(dirpath) / name).unlink()
+                removed += 1
+
+    updated = sum(sync_file(src, dest / relpath) for relpath, src in files.items())
+    return updated, removed
+
+
+def files_digest(files: Mapping[Path, Path]) -> str:
+    """Get the digest of the files, given by path relative to the tree they are part of."""
+    digest = hashlib.sha256()
+    for relpath, path in sorted(files.items()):
+        digest.update(f"{relpath}\0{path.stat().st_size}\0".encode())
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_file(cache: Path, digest: str, name: str) -> Path | None:
+    """Get the file cached under the digest, if any, marking it as recently used."""
+    entry = cache / digest
+    if not (entry / name).is_file():
+        return None
+    os.utime(entry)
+    return entry / name
+
+
+def cache_file(cache: Path, digest: str, path: Path):
+    """Store a copy of the file in the cache under the digest."""
+    # Fill the entry aside and rename it, so that an interrupted build leaves no partial entry.
+    partial_entry = cache / f".{digest}.partial"
+    remove_dir_if_exists(partial_entry)
+    copy(path, partial_entry / path.name)
+    remove_dir_if_exists(cache / digest)
+    partial_entry.rename(cache / digest)
+
+
+def evict_cache(cache: Path, max_size: int, max_age: float = CACHE_MAX_AGE):
+    """Evict the cache entries unused for too long or over the size of the cache.
+
+    Entries unused for `max_age` seconds are removed, then the least recently used ones until the
+    cache fits in `max_size` bytes. Entries being filled are left alone unless they are too old.
+    """
+    if not cache.is_dir():
+        return
+    # Another build sharing the cache may remove or rename entries meanwhile, skip those.
+    entries = []
+    for entry in cache.iterdir():
+        try:
+            if entry.is_dir():
+                entries.append((entry.stat().st_mtime, entry))
+        except FileNotFoundError:
+            continue
+    entries.sort(key=lambda item: item[0], reverse=True)
+    now = time.time()
+    size = 0
+    for mtime, entry in entries:
+        too_old = now - mtime > max_age
+        if entry.name.startswith(".") and not too_old:
+            continue
+        try:
+            size += sum(path.stat().st_size for path in entry.iterdir())
+        except FileNotFoundError:
+            continue
+        if too_old or size > max_size:
+            logger.info("evicting cache entry %s", entry)
+            shutil.rmtree(entry, ignore_errors=True)
+
+
 def remove_dir_if_exists(dir: Path):
     """Removes the directory `dir` if it exists and it's a directory."""
     try:
@@ -341,71 +773,204 @@ def remove_dir_if_exists(dir: Path):
         pass
 
 
+@dataclass
+class Job:
+    """A step of the build pipeline, started once all the jobs it needs succeeded."""
+
+    name: str
+    run: Callable[[], None]
+    needs: list[str] = field(default_factory=list)
+    # Run alone, e.g. to measure timings without the other jobs competing for the CPU.
+    exclusive: bool = False
+
+
+def _run_job(job: Job) -> None:
+    _job.name = job.name
+    start = time.perf_counter()
+    try:
+        job.run()
+    finally:
+        logger.info("finished in %.1fs", time.perf_counter() - start)
+        _job.name = None
+
+
+def _check_jobs(jobs: list[Job]) -> None:
+    """Raise RepositoryError if a job needs an unknown job, or jobs need each other."""
+    remaining = {job.name: set(job.needs) for job in jobs}
+    for job in jobs:
+        if unknown := [need for need in job.needs if need not in remaining]:
+            raise RepositoryError(f"Job `{job.name}` needs unknown job `{unknown[0]}`")
+    # Peel off the jobs needing nothing left, then the ones no job left needs: what remains
+    # are the cycles.
+    while ready := [name for name, needs in remaining.items() if not needs]:
+        for name in ready:
+            del remaining[name]
+        for needs in remaining.values():
+            needs.difference_update(ready)
+    while unneeded := remaining.keys() - set().union(*remaining.values()):
+        for name in unneeded:
+            del remaining[name]
+    if remaining:
+        raise RepositoryError(f"Jobs needing each other: {', '.join(sorted(remaining))}")
+
+
+def _skip_jobs_needing(failures: dict[str, BaseException], pending: dict[str, Job]) -> None:
+    """Fail the pending jobs needing a failed job, directly or not."""
+    while skipped := [job for job in pending.values() if any(n in failures for n in job.needs)]:
+        for job in skipped:
+            logger.info("skipping job %s, a job it needs failed", job.name)
+            failures[job.name] = RepositoryError("skipped, a job it needs failed")
+            del pending[job.name]
+
+
+def _raise_job_failures(failures: list[tuple[str, BaseException]]) -> None:
+    if len(failures) == 1:
+        name, error = failures[0]
+        raise RepositoryError(f"Job `{name}` failed: {error}") from error
+    raise RepositoryError(
+        "Jobs failed:\n" + "\n".join(f"  {name}: {error}" for name, error in failures)
+    )
+
+
+def run_jobs(jobs: Iterable[Job], workers: int = 1, keep_going: bool = False) -> None:
+    """Run the jobs on up to `workers` threads, each one as soon as the jobs it needs are done.
+
+    The output of each job is prefixed with its name. Jobs needing unknown jobs or each other
+    are reported before any job runs. On the first failure no other job is started, the
+    commands still running are terminated and RepositoryError is raised. With `keep_going`, the
+    jobs not needing a failed one still run, and all the failures are reported in the order of
+    the jobs.
+    """
+    jobs = list(jobs)
+    _check_jobs(jobs)
+    pending = {job.name: job for job in jobs}
+
+    workers = max(1, workers)
+    done: set[str] = set()
+    running: dict[Future, Job] = {}
+    failures: dict[str, BaseException] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while True:
+                if keep_going:
+                    _skip_jobs_needing(failures, pending)
+                for job in list(pending.values()):
+                    if (
+                        (failures and not keep_going)
+                        or len(running) >= workers
+                        or any(j.exclusive for j in running.values())
+                    ):
+                        break
+                    if (job.exclusive and running) or not all(n in done for n in job.needs):
+                        continue
+                    del pending[job.name]
+                    running[pool.submit(_run_job, job)] = job
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = running.pop(future)
+                    if (error := future.exception()) is None:
+                        done.add(job.name)
+                        continue
+                    # Without `keep_going`, the jobs failing after the first one were
+                    # terminated because of it.
+                    if keep_going or not failures:
+                        failures[job.name] = error
+                    if not keep_going:
+                        _terminate_running_commands()
+        except KeyboardInterrupt:
+            _terminate_running_commands()
+            raise
+
+    if failures:
+        # In the order of the jobs, whatever the order they failed in.
+        ordered = [(job.name, failures[job.name]) for job in jobs if job.name in failures]
+        _raise_job_failures(ordered)
+
+
 def stage_charm(
     charm: Charm,
     repository: Repository,
     dry_run: bool = False,
 ):
-    """Copy the necessary files.
+    """Sync the staged charm with its files.
 
-    Will copy internal and external libraries.
+    Will copy internal and external libraries. Only the files that changed since the last
+    staging are copied, and the ones that are gone are removed.
     """
-    logger.info("staging charm %s...", charm.path.name)
-    if not dry_run:
-        remove_dir_if_exists(charm.build_path)
-        shutil.copytree(charm.path, charm.build_path, dirs_exist_ok=True)
+    import yaml
 
-        # Overrides the charmcraft.yaml instead of editing it. This avoids having
-        # to load two times the same charm metadata to inject the correct value for
-        # charm-binary-python-packages
-        try:
-            with open(charm.build_path / CHARMCRAFT_FILE, "wt") as f:
-                yaml.safe_dump(charm.metadata, f, sort_keys=False)
-        except OSError:
-            raise RepositoryError(f"Failed to write file `{charm.build_path / CHARMCRAFT_FILE}`")
+    logger.info("staging charm %s...", charm.path.name)
+    files = source_files(charm.path, repository.stage_ignore)
+    # Generated below.
+    files.pop(Path(CHARMCRAFT_FILE), None)
+    files.pop(Path("requirements.txt"), None)
 
     for lib in charm.libraries:
-        src = LIBS_CHARM_PATH / "lib" / "charms" / lib.path
-        dest = charm.build_path / "lib" / "charms" / lib.path
-        logger.debug("Copying %s to %s", lib, dest)
-        if not dry_run:
-            copy(src, dest)
+        files[Path("lib", "charms", lib.path)] = LIBS_CHARM_PATH / "lib" / "charms" / lib.path
+    sdists = [pkg.sdist_name for pkg in charm.packages]
+    for filename in sdists:
+        files[Path("dist", filename)] = BUILD_PATH / "dist" / filename
+
+    if dry_run:
+        logger.info("would stage %d files of charm %s", len(files), charm.name)
+        return
+
+    updated, removed = sync_files(
+        files,
+        charm.build_path,
+        ignore=repository.stage_ignore,
+        keep=[Path(CHARMCRAFT_FILE), Path("requirements.txt")],
+    )
+    logger.info("synced charm %s: %d files updated, %d removed", charm.name, updated, removed)
 
-    if not dry_run:
-        UV.run_command(
-            [
-                "--quiet",
-                "export",
-                "--package",
-                charm.name,
-                "--frozen",
-                "--no-hashes",
-                "--no-emit-workspace",
-                "--format=requirements-txt",
-                "-o",
-                str(charm.build_path / "requirements.txt"),
-            ]
+    # Overrides the charmcraft.yaml instead of editing it. This avoids having
+    # to load two times the same charm metadata to inject the correct value for
+    # charm-binary-python-packages
+    try:
+        write_file(
+            charm.build_path / CHARMCRAFT_FILE, yaml.safe_dump(charm.metadata, sort_keys=False)
         )
+    except OSError:
+        raise RepositoryError(f"Failed to write file `{charm.build_path / CHARMCRAFT_FILE}`")
 
-    if not dry_run:
-        with open(charm.build_path / "requirements.txt", "+a") as f:
-            print("# ===== Local packages =====", file=f)
-            for pkg in charm.packages:
-                filename = f"{pkg.name.replace('-', '_')}-{pkg.version}.tar.gz"
-                src = BUILD_PATH / "dist" / filename
-                dest = charm.build_path / "dist" / filename
-                logger.debug("Copying %s to %s", src, dest)
-                if not dry_run:
-                    copy(src, dest)
-                print(f"./dist/{filename}", file=f)
+    requirements = export_requirements(charm.name, repository.lock_digest)
+    requirements += "# ===== Local packages =====\n"
+    requirements += "".join(f"./dist/{filename}\n" for filename in sdists)
+    write_file(charm.build_path / "requirements.txt", requirements)
 
     logger.info("staged charm %s at %s", charm.path.name, charm.build_path)
 
 
-def stage_charms(
-    charms: Iterable[Charm], repository: Repository, clean: bool = False, dry_run: bool = False
-):
-    """Stage the list of provided charms."""
+def export_requirements(package: str, lock_digest: str) -> str:
+    """Get the requirements of a package exported from the lock.
+
+    The export only depends on the lock and the package, so it is stored under the digest of the
+    lock and only exported again when the lock changes.
+    """
+    args = ["--frozen", "--no-hashes", "--no-emit-workspace", "--format=requirements-txt"]
+    key = hashlib.sha256("\0".join([lock_digest, package, *args]).encode()).hexdigest()
+    cache = REQUIREMENTS_CACHE_PATH / package
+    try:
+        return (cache / f"{key}.txt").read_text()
+    except FileNotFoundError:
+        pass
+
+    logger.info("exporting the requirements of %s", package)
+    remove_dir_if_exists(cache)
+    cache.mkdir(parents=True)
+    partial_path = cache / f".{key}.partial"
+    UV.run_command(["--quiet", "export", "--package", package, *args, "-o", str(partial_path)])
+    partial_path.replace(cache / f"{key}.txt")
+    return (cache / f"{key}.txt").read_text()
+
+
+def stage_libs(repository: Repository, clean: bool = False, dry_run: bool = False):
+    """Fetch the external libraries and gather the internal ones in the libs charm."""
+    import yaml
+
     LIBS_CHARM = {
         "name": "libs",
         "type": "charm",
@@ -438,23 +1003,88 @@ def stage_charms(
         dest = LIBS_CHARM_PATH / "lib" / "charms" / lib.path
         logger.debug(f"Copying internal lib {src} to {dest}.")
         if not dry_run:
-            copy(src, dest)
+            sync_file(src, dest)
 
-    for pkg in repository.internal_packages:
-        if not dry_run:
-            UV.run_command(
-                ["build", "--package", pkg.name, "--sdist", "--out-dir", str(BUILD_PATH / "dist")]
-            )
 
-    for charm in charms:
-        logger.info("preparing charm %s", charm.path.name)
-        if clean:
-            clean_charm(charm, dry_run=dry_run)
-        stage_charm(
-            charm,
-            repository,
-            dry_run=dry_run,
+def build_sdist(package: Package, repository: Repository, dry_run: bool = False):
+    """Build the source distribution of an internal package.
+
+    The sdist is stored in the cache under the digest of the package files, and reused from
+    there instead of building it again when the package did not change.
+    """
+    if dry_run:
+        return
+    sdist = BUILD_PATH / "dist" / package.sdist_name
+    digest = files_digest(source_files(package.path, repository.stage_ignore))
+    if cached := cached_file(SDIST_CACHE_PATH, digest, sdist.name):
+        logger.info("cache hit for sdist %s (%s)", package.name, digest[:12])
+        sync_file(cached, sdist)
+        return
+
+    logger.info("cache miss for sdist %s (%s), building it", package.name, digest[:12])
+    # The sdist may be hard linked to a cache entry, that the build must not overwrite.
+    sdist.unlink(missing_ok=True)
+    UV.run_command(
+        ["build", "--package", package.name, "--sdist", "--out-dir", str(BUILD_PATH / "dist")]
+    )
+    cache_file(SDIST_CACHE_PATH, digest, sdist)
+
+
+def prepare_charm(
+    charm: Charm, repository: Repository, clean: bool = False, dry_run: bool = False
+):
+    """Stage a charm, cleaning it first if requested."""
+    logger.info("preparing charm %s", charm.path.name)
+    if clean:
+        clean_charm(charm, dry_run=dry_run)
+    stage_charm(charm, repository, dry_run=dry_run)
+
+
+def stage_jobs(
+    charms: Iterable[Charm], repository: Repository, clean: bool = False, dry_run: bool = False
+) -> list[Job]:
+    """Get the jobs staging the charms, named `stage:<charm>`.
+
+    A charm is staged once the libraries are fetched and the sdists of its internal packages
+    are built. The sdist cache is evicted once, after every sdist is built, as the sdist jobs
+    run in parallel.
+    """
+    packages = {pkg.name for charm in charms for pkg in charm.packages}
+    jobs = [Job("libs", partial(stage_libs, repository, clean, dry_run))]
+    sdists = [
+        Job(f"sdist:{pkg.name}", partial(build_sdist, pkg, repository, dry_run))
+        for pkg in repository.internal_packages
+        if pkg.name in packages
+    ]
+    jobs += sdists
+    if sdists and not dry_run:
+        jobs.append(
+            Job(
+                "evict:sdist",
+                partial(evict_cache, SDIST_CACHE_PATH, SDIST_CACHE_MAX_SIZE),
+                needs=[job.name for job in sdists],
+            )
+        )
+    jobs += [
+        Job(
+            f"stage:{charm.name}",
+            partial(prepare_charm, charm, repository, clean, dry_run),
+            needs=["libs"] + [f"sdist:{pkg.name}" for pkg in charm.packages],
         )
+        for charm in charms
+    ]
+    return jobs
+
+
+def stage_charms(
+    charms: Iterable[Charm],
+    repository: Repository,
+    clean: bool = False,
+    dry_run: bool = False,
+    jobs: int = 1,
+):
+    """Stage the list of provided charms, running up to `jobs` steps at once."""
+    run_jobs(stage_jobs(charms, repository, clean, dry_run), jobs)
 
 
 def validate_charm(charm: str, repository: Repository) -> Charm:
@@ -496,6 +1126,74 @@ def uv_run(args: list[str], *popenargs, **kwargs) -> None:
     UV.run_command(args, *popenargs, **kwargs)
 
 
+def profile_startup(charm: Charm, budget: float = 0.0):
+    """Profile the Python startup of a hook dispatch of the staged charm.
+
+    Writes the `-X importtime` report aggregated per top-level module next to the built charm,
+    and fails if the median startup time is over `budget` milliseconds (0 to disable the check).
+    """
+    python = subprocess.run(
+        [UV.path, "run", "--frozen", "--extra", "dev"]
+        + ["python", "-c", "import sys; print(sys.executable)"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    env = {**os.environ, "PYTHONPATH": f"{charm.build_path}/src:{charm.build_path}/lib"}
+    sources = [
+        str(path) for path in (charm.build_path / "src", charm.build_path / "lib") if path.is_dir()
+    ]
+    # Measure the startup with bytecode, like the packed charm has it.
+    subprocess.run([python, "-m", "compileall", "-q"] + sources, check=True)
+
+    def run_dispatch(*options: str) -> subprocess.CompletedProcess:
+        try:
+            return subprocess.run(
+                [python, *options, "-c", "import charm"],
+                cwd=charm.build_path,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            raise RepositoryError(f"Failed to import charm `{charm.name}`:\n{e.stderr}")
+
+    run_dispatch()
+    startup_times = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        run_dispatch()
+        startup_times.append((time.perf_counter() - start) * 1000)
+    startup = statistics.median(startup_times)
+
+    # import time: self [us] | cumulative | imported package
+    self_times: dict[str, int] = {}
+    for line in run_dispatch("-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, module = line.removeprefix("import time:").split("|")
+        if not self_us.strip().isdigit():
+            continue
+        package = module.strip().split(".")[0]
+        self_times[package] = self_times.get(package, 0) + int(self_us)
+
+    report = BUILD_PATH / f"{charm.name}.importtime.txt"
+    with report.open("w") as f:
+        print(f"startup: {startup:.1f} ms (median of {STARTUP_RUNS} runs)", file=f)
+        print(f"imports: {sum(self_times.values()) / 1000:.1f} ms", file=f)
+        print(f"{'self [ms]':>10} | module", file=f)
+        for package, self_us in sorted(self_times.items(), key=lambda item: -item[1]):
+            print(f"{self_us / 1000:>10.1f} | {package}", file=f)
+    logger.info("startup of charm %s: %.1f ms, import profile at %s", charm.name, startup, report)
+
+    if budget and startup > budget:
+        raise RepositoryError(
+            f"Startup of charm `{charm.name}` takes {startup:.1f} ms, over the {budget} ms budget"
+        )
+
+
 ###############################################
 # Cli Definitions
 ###############################################
@@ -503,6 +1201,16 @@ def _add_charm_argument(parser: argparse.ArgumentParser):
     parser.add_argument("charm", type=str, nargs="*", help="The charms to operate on.")
 
 
+def _add_jobs_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Maximum number of steps run at once (default: number of CPUs).",
+    )
+
+
 def main_cli():
     """Run the main CLI tool."""
     main_parser = argparse.ArgumentParser(description="Repository utilities.")
@@ -519,10 +1227,24 @@ def main_cli():
         help="Clean the charm(s) first.",
     )
     stage_parser.add_argument("--dry-run", action="store_true", default=False, help="Dry run.")
+    _add_jobs_argument(stage_parser)
     stage_parser.set_defaults(func=stage_cli)
     _add_charm_argument(stage_parser)
 
     build_parser = subparsers.add_parser("build", help="Build all the specified charms.")
+    build_parser.add_argument(
+        "--startup-budget",
+        type=float,
+        default=None,
+        help="Maximum startup time of a hook dispatch in ms (0 disables the check).",
+    )
+    build_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Pack the charms even if a cached charm was built from the same files.",
+    )
+    _add_jobs_argument(build_parser)
     build_parser.set_defaults(func=build_cli)
     _add_charm_argument(build_parser)
 
@@ -534,10 +1256,10 @@ def main_cli():
 
     clean_parser = subparsers.add_parser("clean", help="Clean charm(s).")
     clean_parser.add_argument("--dry-run", action="store_true", default=False, help="Dry run.")
-    clean_parser.set_defaults(func=clean_cli)
+    clean_parser.set_defaults(func=clean_cli, load_repository=False)
 
     pythonpath_parser = subparsers.add_parser("pythonpath", help="Print the pythonpath.")
-    pythonpath_parser.set_defaults(func=pythonpath_cli)
+    pythonpath_parser.set_defaults(func=pythonpath_cli, load_repository=False)
 
     fmt_parser = subparsers.add_parser("fmt", help="Apply formatting standards to code.")
     fmt_parser.set_defaults(func=fmt_cli)
@@ -551,10 +1273,18 @@ def main_cli():
     _add_charm_argument(lint_parser)
 
     type_parser = subparsers.add_parser("typecheck", help="Type checking with pyright.")
+    _add_jobs_argument(type_parser)
     type_parser.set_defaults(func=typecheck_cli)
     _add_charm_argument(type_parser)
 
     unit_test_parser = subparsers.add_parser("unit", help="Run unit tests.")
+    unit_test_parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split the test files of each charm in as many test processes.",
+    )
+    _add_jobs_argument(unit_test_parser)
     unit_test_parser.set_defaults(func=unit_test_cli)
     _add_charm_argument(unit_test_parser)
 
@@ -562,21 +1292,35 @@ def main_cli():
     integration_test_parser.add_argument(
         "rest", type=str, nargs="*", help="Arguments forwarded to pytest"
     )
+    _add_jobs_argument(integration_test_parser)
     integration_test_parser.set_defaults(func=integration_tests_cli)
 
+    bench_parser = subparsers.add_parser(
+        "bench", help="Run the hook latency benchmarks and check them against the baseline."
+    )
+    bench_parser.add_argument(
+        "--update", action="store_true", default=False, help="Record a new baseline."
+    )
+    bench_parser.add_argument(
+        "rest", type=str, nargs="*", help="Arguments forwarded to the benchmark suite"
+    )
+    bench_parser.set_defaults(func=bench_cli, load_repository=False)
+
     args = main_parser.parse_args(args=None if sys.argv[1:] else ["--help"])
     level = logging.INFO
     if args.verbose:
         level = logging.DEBUG
     logger.setLevel(level)
-    repository = Repository()
     context = vars(args)
-    context["repository"] = repository
-    charms = context.pop("charm", "")
-    if not charms:
-        context["charms"] = repository.charms
-    else:
-        context["charms"] = [validate_charm(charm, repository) for charm in charms]
+    # Only load the repository for the sub-commands working on it.
+    if context.pop("load_repository", True):
+        repository = load_repository()
+        context["repository"] = repository
+        charms = context.pop("charm", "")
+        if not charms:
+            context["charms"] = repository.charms
+        else:
+            context["charms"] = [validate_charm(charm, repository) for charm in charms]
     args.func(**context)
 
 
@@ -585,10 +1329,11 @@ def stage_cli(
     repository: Repository,
     clean: bool = False,
     dry_run: bool = False,
+    jobs: int = 1,
     **kwargs,
 ):
     """Stage the specified charms into the build directory."""
-    stage_charms(charms, repository, clean, dry_run)
+    stage_charms(charms, repository, clean, dry_run, jobs)
 
 
 def gen_token_cli(
@@ -612,7 +1357,6 @@ def gen_token_cli(
 
 
 def clean_cli(
-    repository: Repository,
     dry_run: bool = False,
     **kwargs,
 ):
@@ -621,7 +1365,7 @@ def clean_cli(
         shutil.rmtree(BUILD_PATH, ignore_errors=True)
 
 
-def pythonpath_cli(repository: Repository, **kwargs):
+def pythonpath_cli(**kwargs):
     """Print the pythonpath."""
     print(LIBS_CHARM_PATH / "lib")
 
@@ -658,69 +1402,138 @@ def lint_cli(
 def typecheck_cli(
     charms: Iterable[Charm],
     repository: Repository,
+    jobs: int = 1,
     **kwargs,
 ):
     """Type checking with pyright."""
-    stage_charms(charms, repository)
 
-    def run_pyright(path: str) -> None:
-        uv_run(
-            ["pyright", path],
-            env={
-                **os.environ,
-                "PYTHONPATH": f"{charm.build_path}/src:{charm.build_path}/lib",
-            },
-        )
+    def run_pyright(path: str, charm: Charm | None = None) -> None:
+        env = dict(os.environ)
+        if charm is not None:
+            env["PYTHONPATH"] = f"{charm.build_path}/src:{charm.build_path}/lib"
+        uv_run(["pyright", path], env=env)
 
+    pipeline = stage_jobs(charms, repository)
     for charm in charms:
-        logger.info("running pyright...")
-        run_pyright(str(charm.build_path / "src"))
+        pipeline.append(
+            Job(
+                f"pyright:{charm.name}",
+                partial(run_pyright, str(charm.build_path / "src"), charm),
+                needs=[f"stage:{charm.name}"],
+            )
+        )
+    pipeline.append(Job("pyright:pkgs", partial(run_pyright, str(PKGS_PATH))))
+    run_jobs(pipeline, jobs)
 
-    run_pyright(PKGS_PATH)
-    
 
 def unit_test_cli(
     charms: Iterable[Charm],
     repository: Repository,
+    jobs: int = 1,
+    shards: int = 1,
     **kwargs,
 ):
-    """Run unit tests."""
-    stage_charms(charms, repository)
+    """Run unit tests.
 
+    The tests of each charm run as soon as it is staged, up to `jobs` test processes at once.
+    With `shards`, the test files of each charm are split in as many processes. When several
+    processes run at once, the output of each one is buffered and printed as a whole, in the
+    order of the charms and shards, once the ones before it are printed. All of them run even if
+    some fail, and the results are reported in order at the end.
+    """
     uv_run(["coverage", "erase"])
-
-    files = []
-
+    capture = jobs > 1
+    results: dict[str, str] = {}
+    outputs: dict[str, list[str]] = {}
+    printed = 0
+
+    def print_outputs(last: bool = False) -> None:
+        """Print the outputs not printed yet up to the first process still running.
+
+        With `last`, the processes that never ran are skipped instead.
+        """
+        nonlocal printed
+        with _print_lock:
+            while printed < len(names) and (last or names[printed] in outputs):
+                if output := outputs.get(names[printed]):
+                    print(f"===== {names[printed]} =====\n{''.join(output)}", end="", flush=True)
+                printed += 1
+
+    def run_unit_tests(name: str, charm: Charm, shard: int) -> None:
+        tests_path = charm.build_path / "tests" / "unit"
+        tests = [str(tests_path)]
+        if shards > 1:
+            files = sorted({*tests_path.rglob("test_*.py"), *tests_path.rglob("*_test.py")})
+            tests = [str(path) for path in files[shard::shards]]
+            if not tests:
+                results[name] = "no tests"
+                if capture:
+                    outputs[name] = []
+                    print_outputs()
+                return
+        logger.info("running unit tests for %s", name.removeprefix("unit:"))
+        output: list[str] | None = [] if capture else None
+        start = time.perf_counter()
+        try:
+            uv_run(
+                [
+                    "coverage",
+                    "run",
+                    "--source",
+                    str(charm.build_path / "src"),
+                    "-m",
+                    "pytest",
+                    "-v",
+                    "--tb",
+                    "native",
+                    "-s",
+                    *tests,
+                ],
+                env={
+                    **os.environ,
+                    "PYTHONPATH": f"{charm.build_path}/src:{charm.build_path}/lib",
+                    "COVERAGE_FILE": str(charm.build_path / f".coverage.{shard}"),
+                },
+                output=output,
+            )
+            results[name] = f"passed in {time.perf_counter() - start:.1f}s"
+        except subprocess.CalledProcessError:
+            results[name] = f"failed in {time.perf_counter() - start:.1f}s"
+            raise
+        finally:
+            if output is not None:
+                outputs[name] = output
+                print_outputs()
+
+    pipeline = stage_jobs(charms, repository)
+    names = []
     for charm in charms:
-        logger.info("running unit tests for %s", charm.path.name)
-        coverage_file = charm.build_path / ".coverage"
-        uv_run(
-            ["coverage", "erase"],
-            env={**os.environ, "COVERAGE_FILE": str(coverage_file)},
-        )
-        uv_run(
-            [
-                "coverage",
-                "run",
-                "--source",
-                str(charm.build_path / "src"),
-                "-m",
-                "pytest",
-                "-v",
-                "--tb",
-                "native",
-                "-s",
-                str(charm.build_path / "tests" / "unit"),
-            ],
-            env={
-                **os.environ,
-                "PYTHONPATH": f"{charm.build_path}/src:{charm.build_path}/lib",
-                "COVERAGE_FILE": str(coverage_file),
-            },
-        )
-        if coverage_file.is_file():
-            files.append(str(coverage_file))
+        # Data files of a previous run, possibly with other shards.
+        for path in charm.build_path.glob(".coverage*"):
+            path.unlink()
+        for shard in range(shards):
+            name = f"unit:{charm.name}" + (f":{shard + 1}/{shards}" if shards > 1 else "")
+            names.append(name)
+            pipeline.append(
+                Job(
+                    name,
+                    partial(run_unit_tests, name, charm, shard),
+                    needs=[f"stage:{charm.name}"],
+                )
+            )
+    try:
+        run_jobs(pipeline, jobs, keep_going=True)
+    finally:
+        print_outputs(last=True)
+        logger.info("unit test results:")
+        for name in names:
+            logger.info("  %s: %s", name, results.get(name, "not run"))
 
+    files = [
+        str(coverage_file)
+        for charm in charms
+        for coverage_file in sorted(charm.build_path.glob(".coverage.*"))
+    ]
     logger.info("generating global results...")
     uv_run(["coverage", "combine"] + files)
     uv_run(["coverage", "report"])
@@ -728,43 +1541,97 @@ def unit_test_cli(
     logger.info(f"XML report generated at {ROOT_DIR}/cover/coverage.xml")
 
 
+def charm_digest(charm: Charm, repository: Repository) -> str:
+    """Get the digest of the staged charm files the packed charm is built from.
+
+    That is the source, the `charmcraft.yaml` with its binary packages, the requirements, the
+    sdists of the internal packages and the libraries, along with any other staged file.
+    """
+    return files_digest(source_files(charm.build_path, [*repository.stage_ignore, "tests"]))
+
+
+def pack_charm(charm: Charm, repository: Repository, use_cache: bool = True):
+    """Pack the staged charm and move it to its path in the build directory.
+
+    The packed charm is stored in the cache under the digest of the staged files, and reused
+    from there instead of packing it again when the staged files are the same.
+    """
+    digest = charm_digest(charm, repository)
+    cached = cached_file(CHARM_CACHE_PATH, digest, charm.charm_path.name) if use_cache else None
+    if cached:
+        logger.info("cache hit for charm %s (%s)", charm.name, digest[:12])
+        charm.charm_path.unlink(missing_ok=True)
+        copy(cached, charm.charm_path)
+        logger.info("built charm %s", charm.charm_path)
+        return
+
+    logger.info("cache miss for charm %s (%s), building it", charm.name, digest[:12])
+    CHARMCRAFT.run_command(["-v", "pack"], cwd=charm.build_path)
+
+    charm_long_path = (
+        charm.build_path / glob.glob(f"{charm.path.name}_*.charm", root_dir=charm.build_path)[0]
+    )
+    logger.info("moving charm %s to %s", charm_long_path, charm.charm_path)
+
+    charm.charm_path.unlink(missing_ok=True)
+    copy(charm_long_path, charm.charm_path)
+    charm_long_path.unlink()
+
+    cache_file(CHARM_CACHE_PATH, digest, charm.charm_path)
+    logger.info("built charm %s", charm.charm_path)
+
+
 def build_cli(
     charms: Iterable[Charm],
     repository: Repository,
+    startup_budget: float | None = None,
+    jobs: int = 1,
+    no_cache: bool = False,
     **kwargs,
 ):
-    """Build all the specified charms."""
-    stage_charms(charms, repository)
+    """Build all the specified charms.
 
+    The startup of each charm is profiled alone once it is staged, so that the other jobs don't
+    skew it. Once all of them are profiled, the charms are packed at once, so building several
+    charms takes about as long as the slowest one. Charms whose staged files did not change
+    since a previous build are taken from the cache instead, unless `no_cache` is set.
+    """
+    if startup_budget is None:
+        startup_budget = repository.startup_budget
+
+    pipeline = stage_jobs(charms, repository)
+    profiles = [f"profile:{charm.name}" for charm in charms]
     for charm in charms:
-        logger.info("building the charm %s", charm.name)
-        subprocess.run(
-            "charmcraft -v pack".split(),
-            cwd=charm.build_path,
-            check=True,
+        pipeline.append(
+            Job(
+                f"profile:{charm.name}",
+                partial(profile_startup, charm, startup_budget),
+                needs=[f"stage:{charm.name}"],
+                exclusive=True,
+            )
         )
-
-        charm_long_path = (
-            charm.build_path
-            / glob.glob(f"{charm.path.name}_*.charm", root_dir=charm.build_path)[0]
+    # Packing waits for every profile: an exclusive job only starts once nothing else runs.
+    for charm in charms:
+        pipeline.append(
+            Job(
+                f"pack:{charm.name}",
+                partial(pack_charm, charm, repository, use_cache=not no_cache),
+                needs=profiles,
+            )
         )
-        logger.info("moving charm %s to %s", charm_long_path, charm.charm_path)
-
-        charm.charm_path.unlink(missing_ok=True)
-        copy(charm_long_path, charm.charm_path)
-        charm_long_path.unlink()
-        logger.info("built charm %s", charm.charm_path)
+    run_jobs(pipeline, jobs)
+    evict_cache(CHARM_CACHE_PATH, CHARM_CACHE_MAX_SIZE)
 
 
 def integration_tests_cli(
     charms: Iterable[Charm],
     repository: Repository,
     rest: Iterable[str],
+    jobs: int = 1,
     **kwargs,
 ):
     """Run integration tests."""
-    stage_charms(charms, repository)
-    build_cli(charms, repository)
+    build_cli(charms, repository, jobs=jobs)
 
     local_charms = {}
     for charm in charms:
@@ -786,5 +1653,22 @@ def integration_tests_cli(
     )
 
 
+def bench_cli(
+    update: bool,
+    rest: Iterable[str],
+    **kwargs,
+):
+    """Run the hook latency benchmarks, failing on regressions against the baseline."""
+    try:
+        uv_run(
+            ["python", str(BENCHMARKS_PATH / "bench_snapper.py")]
+            + (["--update"] if update else [])
+            + list(rest),
+            cwd=ROOT_DIR,
+        )
+    except subprocess.CalledProcessError:
+        raise RepositoryError("Benchmarks regressed against the baseline")
+
+
 if __name__ == "__main__":
     main_cli()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""Hook latency benchmarks of the AgentSnapper lifecycle.
+
+Every lifecycle path of a charm built on the AgentSnapper is dispatched through `ops.testing`
+against the fake snapd of the agent-snapper tests, once talking to its REST API and once through
+the fake `snap` command line tool. Latency is injected in every snapd request and snap command,
+so that the wall time reflects the number of round trips the way it does on a real machine.
+
+For each path, the median wall time, the number of snap commands (subprocesses) and the number
+of snapd requests are reported, and compared against the JSON baseline:
+
+    python tests/benchmarks/bench_snapper.py            # fail on regressions
+    python tests/benchmarks/bench_snapper.py --update   # record a new baseline
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import ops
+import yaml
+from agent_snapper import AgentSnapper, charmed_agent
+from ops import testing
+
+ROOT_DIR = Path(__file__).parents[2]
+sys.path.insert(0, str(ROOT_DIR / "pkgs" / "agent-snapper" / "tests"))
+
+from fakes import FakeSnapCli, FakeSnapd  # noqa: E402
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+SNAP = "vantage-agent"
+CHARMCRAFT = yaml.safe_load((ROOT_DIR / "charms" / SNAP / "charmcraft.yaml").read_text())
+CONFIG = {
+    f"{SNAP}-oidc-client-id": "client-id",
+    f"{SNAP}-oidc-client-secret": "client-secret",
+    f"{SNAP}-cluster-name": "bench",
+}
+
+
+class BenchCharm(ops.CharmBase):
+    """Charm managing the agent snap exactly like the vantage-agent charm."""
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self._snapper = AgentSnapper(self, SNAP, ["cluster-name"])
+
+
+def initial_state() -> testing.State:
+    return testing.State(leader=True, config=CONFIG)
+
+
+def installed(snapd: FakeSnapd) -> testing.State:
+    snapd.add_snap(SNAP, channel="latest/stable", services={"daemon": False})
+    return initial_state()
+
+
+def configured(snapd: FakeSnapd) -> testing.State:
+    _, state = dispatch(snapd, "config_changed", installed(snapd))
+    return state
+
+
+# Name of each lifecycle path: event to dispatch and setup of the fake snapd and of the unit
+# state, stored state included, before it.
+PATHS: dict[str, tuple[str, Callable[[FakeSnapd], testing.State]]] = {
+    "install": ("install", lambda snapd: initial_state()),
+    "config-changed": ("config_changed", installed),
+    "config-changed-noop": ("config_changed", configured),
+    "update-status": ("update_status", configured),
+    "stop": ("stop", configured),
+    "remove": ("remove", configured),
+}
+
+
+def dispatch(snapd: FakeSnapd, event: str, state: testing.State) -> tuple[float, testing.State]:
+    """Dispatch the event to the charm and return the wall time and the resulting state."""
+    ctx = testing.Context(
+        BenchCharm,
+        meta={"name": SNAP, "subordinate": True, "peers": CHARMCRAFT.get("peers", {})},
+        config=CHARMCRAFT["config"],
+        actions=CHARMCRAFT.get("actions"),
+    )
+    start = time.perf_counter()
+    state = ctx.run(getattr(ctx.on, event)(), state)
+    return time.perf_counter() - start, state
+
+
+def bench_path(
+    backend: str, event: str, setup: Callable[[FakeSnapd], testing.State], args: Any
+) -> dict[str, Any]:
+    """Run a lifecycle path `args.repeat` times on fresh fakes and return its measurements."""
+    wall_times, subprocesses, requests = [], 0, 0
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as tmp, FakeSnapd(Path(tmp) / "snapd.socket") as snapd:
+            cli = FakeSnapCli(snapd)
+            AgentSnapper._sys_exec = staticmethod(cli)  # type: ignore[method-assign]
+            charmed_agent.SNAPD_SOCKET = (
+                snapd.socket_path if backend == "snapd" else Path(tmp) / "missing.socket"
+            )
+            # Probe the daemon through the fakes, never through the host systemd.
+            charmed_agent.SYSTEM_BUS_SOCKET = Path(tmp) / "missing-bus.socket"
+            state = setup(snapd)
+
+            cli.calls.clear()
+            snapd.requests.clear()
+            snapd.latency = cli.latency = args.latency
+            wall_times.append(dispatch(snapd, event, state)[0])
+            subprocesses, requests = len(cli.calls), len(snapd.requests)
+
+    return {
+        "wall_time": round(statistics.median(wall_times), 4),
+        "subprocesses": subprocesses,
+        "snapd_requests": requests,
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Return the regressions of the results against the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        for counter in ("subprocesses", "snapd_requests"):
+            if result[counter] > base[counter]:
+                regressions.append(f"{name}: {counter} {base[counter]} -> {result[counter]}")
+        if result["wall_time"] > base["wall_time"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: wall time {base['wall_time']:.4f}s -> {result['wall_time']:.4f}s"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE, help="Baseline file.")
+    parser.add_argument("--update", action="store_true", help="Write the results as baseline.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each path.")
+    parser.add_argument(
+        "--latency", type=float, default=0.01, help="Seconds added to each snap call."
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Allowed relative wall time increase."
+    )
+    args = parser.parse_args()
+
+    results = {
+        f"{backend}/{name}": bench_path(backend, event, setup, args)
+        for backend in ("snapd", "cli")
+        for name, (event, setup) in PATHS.items()
+    }
+
+    print(f"{'path':<28} {'wall time':>10} {'subprocesses':>13} {'snapd requests':>15}")
+    for name, result in results.items():
+        print(
+            f"{name:<28} {result['wall_time']:>9.4f}s {result['subprocesses']:>13} "
+            f"{result['snapd_requests']:>15}"
+        )
+
+    if args.update:
+        args.baseline.write_text(
+            json.dumps({"latency": args.latency, "results": results}, indent=2) + "\n"
+        )
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    try:
+        baseline = json.loads(args.baseline.read_text())
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}, run with --update to record one.")
+        return 1
+    if baseline.get("latency") != args.latency:
+        print(f"Baseline recorded with a latency of {baseline.get('latency')}s, not comparable.")
+        return 1
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
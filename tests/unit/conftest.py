@@ -0,0 +1,21 @@
+"""Fixtures of the tests of the monorepo build tool."""
+
+import atexit
+import os
+import shutil
+import stat
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parents[2]
+sys.path.insert(0, str(ROOT_DIR))
+
+# The build tools are looked up when `repository.py` is imported, but none of the tests run them.
+_tools_dir = Path(tempfile.mkdtemp(prefix="repository-tools-"))
+atexit.register(shutil.rmtree, _tools_dir, ignore_errors=True)
+for _tool in ["uv", "charmcraft"]:
+    if shutil.which(_tool) is None:
+        (_tools_dir / _tool).write_text("#!/bin/sh\nexit 1\n")
+        (_tools_dir / _tool).chmod(stat.S_IRWXU)
+os.environ["PATH"] = f"{os.environ['PATH']}{os.pathsep}{_tools_dir}"
@@ -0,0 +1,666 @@
+"""Tests of the monorepo build tool."""
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+import yaml
+
+import repository
+from repository import (
+    COMPILE_BYTECODE_STEP,
+    Charm,
+    Job,
+    LockGraph,
+    RepositoryError,
+    cache_file,
+    cached_file,
+    evict_cache,
+    export_requirements,
+    load_charm,
+    load_repository,
+    pack_charm,
+    profile_startup,
+    run_jobs,
+    source_files,
+    stage_jobs,
+    sync_files,
+    unit_test_cli,
+)
+
+
+def lock(*packages: tuple[str, list[str]]) -> dict[str, Any]:
+    """Return a parsed `uv.lock` locking the packages, given with the names they depend on."""
+    return {
+        "package": [
+            {"name": name, "version": "1.0", "dependencies": [{"name": dep} for dep in deps]}
+            for name, deps in packages
+        ]
+    }
+
+
+def test_lock_graph_indexes_the_packages():
+    graph = LockGraph(lock(("ops", ["pyyaml", "websocket-client"]), ("pyyaml", [])))
+
+    assert "ops" in graph and "requests" not in graph
+    assert graph.version("ops") == "1.0"
+    assert graph.dependencies("ops") == {"pyyaml", "websocket-client"}
+    with pytest.raises(RepositoryError, match="`requests`"):
+        graph.version("requests")
+    with pytest.raises(RepositoryError, match="`requests`"):
+        graph.dependencies("requests")
+
+
+def test_lock_graph_merges_the_dependencies_of_every_locked_version():
+    graph = LockGraph(lock(("numpy", ["a"]), ("numpy", ["b"]), ("a", []), ("b", [])))
+
+    assert graph.dependencies("numpy") == {"a", "b"}
+    assert graph.closure("numpy") == {"numpy", "a", "b"}
+
+
+def test_lock_graph_closures():
+    graph = LockGraph(lock(("a", ["b", "c"]), ("b", ["d"]), ("c", ["d"]), ("d", []), ("e", [])))
+
+    assert graph.closure("a") == {"a", "b", "c", "d"}
+    # Resolved along with `a`.
+    assert graph._closures.keys() == {"a", "b", "c", "d"}
+    assert graph.closure("c") == {"c", "d"}
+    assert graph.closure("e") == {"e"}
+
+
+def test_lock_graph_closures_of_a_cycle():
+    graph = LockGraph(lock(("a", ["b"]), ("b", ["c"]), ("c", ["a", "d"]), ("d", []), ("e", ["b"])))
+
+    assert graph.closure("e") == {"a", "b", "c", "d", "e"}
+    assert graph.closure("a") == graph.closure("b") == graph.closure("c") == {"a", "b", "c", "d"}
+    assert graph.closure("a") is graph.closure("c")
+    assert graph.closure("d") == {"d"}
+
+
+def test_lock_graph_closure_of_a_self_dependency():
+    graph = LockGraph(lock(("a", ["a", "b"]), ("b", [])))
+
+    assert graph.closure("a") == {"a", "b"}
+
+
+def test_lock_graph_closure_of_a_long_chain():
+    # Deeper than the recursion limit.
+    names = [f"p{i}" for i in range(5000)]
+    graph = LockGraph(lock(*zip(names, [[name] for name in names[1:]] + [[]])))
+
+    assert graph.closure("p0") == set(names)
+    assert graph.closure("p4990") == set(names[4990:])
+
+
+def test_lock_graph_refuses_unknown_dependencies():
+    graph = LockGraph(lock(("a", ["b"])))
+
+    with pytest.raises(RepositoryError, match="`b`"):
+        graph.closure("a")
+
+
+class Recorder:
+    """Record the order the jobs start and finish in."""
+
+    def __init__(self) -> None:
+        self.events: list[str] = []
+        self._lock = threading.Lock()
+
+    def job(
+        self, name: str, needs: list[str] | None = None, fail: bool = False, **kwargs: Any
+    ) -> Job:
+        """Return a job recording its run, failing if `fail`."""
+
+        def run() -> None:
+            with self._lock:
+                self.events.append(f"start {name}")
+            time.sleep(0.01)
+            with self._lock:
+                self.events.append(f"end {name}")
+            if fail:
+                raise RuntimeError(f"{name} broke")
+
+        return Job(name, run, needs or [], **kwargs)
+
+    @property
+    def started(self) -> list[str]:
+        return [event.removeprefix("start ") for event in self.events if event.startswith("start")]
+
+
+def test_jobs_run_after_the_jobs_they_need():
+    recorder = Recorder()
+    jobs = [recorder.job("pack", ["stage", "lock"]), recorder.job("stage"), recorder.job("lock")]
+
+    run_jobs(jobs, workers=4)
+
+    assert recorder.events.index("start pack") > recorder.events.index("end stage")
+    assert recorder.events.index("start pack") > recorder.events.index("end lock")
+
+
+def test_jobs_run_in_parallel():
+    barrier = threading.Barrier(3, timeout=5)
+    jobs = [Job(f"stage:{i}", barrier.wait) for i in range(3)]
+
+    # Each job waits for the others to run.
+    run_jobs(jobs, workers=3)
+
+
+def test_exclusive_jobs_run_alone():
+    recorder = Recorder()
+    jobs = [
+        recorder.job("lock"),
+        recorder.job("stage:a", ["lock"]),
+        recorder.job("profile:a", ["lock"], exclusive=True),
+        recorder.job("stage:b", ["lock"]),
+    ]
+
+    run_jobs(jobs, workers=4)
+
+    # Started once the jobs running before it are done, and alone until it is done.
+    assert recorder.events[-2:] == ["start profile:a", "end profile:a"]
+
+
+def test_first_failure_stops_the_jobs():
+    recorder = Recorder()
+    jobs = [
+        recorder.job("bad", fail=True),
+        recorder.job("pack", ["bad"]),
+        recorder.job("other", ["bad"]),
+    ]
+
+    with pytest.raises(RepositoryError, match="^Job `bad` failed: bad broke$"):
+        run_jobs(jobs)
+    assert recorder.started == ["bad"]
+
+
+def test_first_failure_starts_no_other_job():
+    recorder = Recorder()
+    jobs = [recorder.job("bad", fail=True), recorder.job("stage:a"), recorder.job("stage:b")]
+
+    with pytest.raises(RepositoryError, match="`bad`"):
+        run_jobs(jobs, workers=1)
+    assert recorder.started == ["bad"]
+
+
+def test_keep_going_runs_the_jobs_not_needing_a_failure():
+    recorder = Recorder()
+    jobs = [
+        recorder.job("stage:a", fail=True),
+        recorder.job("pack:a", ["stage:a"]),
+        recorder.job("publish:a", ["pack:a"]),
+        recorder.job("stage:b"),
+        recorder.job("pack:b", ["stage:b"], fail=True),
+        recorder.job("stage:c"),
+        recorder.job("pack:c", ["stage:c"]),
+    ]
+
+    with pytest.raises(RepositoryError) as error:
+        run_jobs(jobs, workers=2, keep_going=True)
+
+    assert sorted(recorder.started) == ["pack:b", "pack:c", "stage:a", "stage:b", "stage:c"]
+    assert str(error.value) == (
+        "Jobs failed:\n"
+        "  stage:a: stage:a broke\n"
+        "  pack:a: skipped, a job it needs failed\n"
+        "  publish:a: skipped, a job it needs failed\n"
+        "  pack:b: pack:b broke"
+    )
+
+
+def test_unknown_needs_are_refused():
+    recorder = Recorder()
+
+    with pytest.raises(RepositoryError, match="`pack` needs unknown job `stage`"):
+        run_jobs([recorder.job("lock"), recorder.job("pack", ["stage"])])
+    assert recorder.started == []
+
+
+def test_cycles_are_refused_before_any_job_runs():
+    recorder = Recorder()
+    jobs = [
+        recorder.job("lock"),
+        recorder.job("stage", ["lock", "pack"]),
+        recorder.job("pack", ["stage"]),
+        recorder.job("publish", ["pack"]),
+    ]
+
+    with pytest.raises(RepositoryError, match="^Jobs needing each other: pack, stage$"):
+        run_jobs(jobs, workers=2)
+    assert recorder.started == []
+
+
+@pytest.fixture
+def charm_files(tmp_path: Path) -> dict[Path, Path]:
+    """Files of a charm, by path relative to the charm."""
+    charm = tmp_path / "charm"
+    (charm / "src").mkdir(parents=True)
+    (charm / "src" / "charm.py").write_text("import ops\n")
+    (charm / "metadata.yaml").write_text("name: charm\n")
+    return source_files(charm, [])
+
+
+def test_staged_files_are_hard_links(tmp_path: Path, charm_files: dict[Path, Path]):
+    stage = tmp_path / "stage"
+
+    assert sync_files(charm_files, stage) == (2, 0)
+
+    for relpath, src in charm_files.items():
+        assert (stage / relpath).stat().st_ino == src.stat().st_ino
+    assert sorted(path.name for path in stage.rglob("*")) == ["charm.py", "metadata.yaml", "src"]
+
+
+def test_unchanged_files_are_not_staged_again(tmp_path: Path, charm_files: dict[Path, Path]):
+    stage = tmp_path / "stage"
+    sync_files(charm_files, stage)
+    # Replaced by a copy, as on a filesystem without hard links.
+    staged = stage / "src" / "charm.py"
+    shutil.copy2(staged, staged.with_suffix(".copy"))
+    staged.with_suffix(".copy").replace(staged)
+    inode = staged.stat().st_ino
+
+    assert sync_files(charm_files, stage) == (0, 0)
+    # Touched only: compared by content, then not compared again.
+    os.utime(charm_files[Path("src/charm.py")])
+    assert sync_files(charm_files, stage) == (0, 0)
+    assert staged.stat().st_mtime_ns == charm_files[Path("src/charm.py")].stat().st_mtime_ns
+    assert staged.stat().st_ino == inode
+
+
+def test_changed_files_are_replaced(tmp_path: Path, charm_files: dict[Path, Path]):
+    stage = tmp_path / "stage"
+    sync_files(charm_files, stage)
+    src = charm_files[Path("src/charm.py")]
+    # Replaced, as editors and git do, so the staged link still has the old content.
+    partial = src.with_suffix(".new")
+    partial.write_text("import ops  # changed\n")
+    partial.replace(src)
+
+    assert sync_files(charm_files, stage) == (1, 0)
+    assert (stage / "src" / "charm.py").read_text() == "import ops  # changed\n"
+
+
+def test_stale_files_are_removed(tmp_path: Path, charm_files: dict[Path, Path]):
+    stage = tmp_path / "stage"
+    sync_files(charm_files, stage)
+    (stage / "lib" / "charms").mkdir(parents=True)
+    (stage / "src" / "old.py").write_text("")
+    (stage / "requirements.txt").write_text("ops\n")
+    (stage / ".tox").mkdir()
+    (stage / ".tox" / "log").write_text("")
+    (stage / "charm.charm").write_text("")
+
+    updated, removed = sync_files(
+        charm_files, stage, ignore=[".tox", "*.charm"], keep=[Path("requirements.txt")]
+    )
+
+    assert (updated, removed) == (0, 2)
+    assert not (stage / "lib").exists() and not (stage / "src" / "old.py").exists()
+    assert (stage / "requirements.txt").exists()
+    assert (stage / ".tox" / "log").exists() and (stage / "charm.charm").exists()
+
+
+def test_cached_files(tmp_path: Path):
+    cache = tmp_path / "cache"
+    packed = tmp_path / "charm.charm"
+    packed.write_bytes(b"zip")
+
+    assert cached_file(cache, "1234", packed.name) is None
+    cache_file(cache, "1234", packed)
+    os.utime(cache / "1234", (0, 0))
+
+    cached = cached_file(cache, "1234", packed.name)
+    assert cached is not None and cached.read_bytes() == b"zip"
+    # Marked as recently used.
+    assert (cache / "1234").stat().st_mtime > 0
+    assert sorted(path.name for path in cache.iterdir()) == ["1234"]
+
+
+def test_cache_eviction(tmp_path: Path):
+    cache = tmp_path / "cache"
+    now = time.time()
+    for digest, age in [("new", 0), ("used", 10), ("unused", 20), ("expired", 100)]:
+        (cache / digest).mkdir(parents=True)
+        (cache / digest / "charm.charm").write_bytes(b"x" * 10)
+        os.utime(cache / digest, (now - age, now - age))
+    for name, age in [(".filling.partial", 0), (".interrupted.partial", 100)]:
+        (cache / name).mkdir()
+        (cache / name / "charm.charm").write_bytes(b"x" * 10)
+        os.utime(cache / name, (now - age, now - age))
+
+    evict_cache(cache, max_size=20, max_age=50)
+
+    assert sorted(path.name for path in cache.iterdir()) == [".filling.partial", "new", "used"]
+
+
+def test_concurrent_cache_evictions(tmp_path: Path):
+    cache = tmp_path / "cache"
+    for digest in range(200):
+        (cache / str(digest)).mkdir(parents=True)
+        (cache / str(digest) / "charm.charm").write_bytes(b"x" * 10)
+    errors: list[Exception] = []
+
+    def evict():
+        try:
+            evict_cache(cache, max_size=0)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=evict) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert list(cache.iterdir()) == []
+
+
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_sdist_cache_is_evicted_once_after_the_sdists(dry_run: bool):
+    packages = [SimpleNamespace(name=name) for name in ("agent-snapper", "other")]
+    repository_ = SimpleNamespace(internal_packages=packages)
+    charm = SimpleNamespace(name="agent", packages=packages)
+
+    staged = stage_jobs([charm], repository_, dry_run=dry_run)  # type: ignore[list-item, arg-type]
+    jobs = {job.name: job for job in staged}
+
+    if dry_run:
+        assert "evict:sdist" not in jobs
+    else:
+        assert jobs["evict:sdist"].needs == ["sdist:agent-snapper", "sdist:other"]
+
+
+# Repository staging every file of the charms.
+PACKED_REPOSITORY: Any = SimpleNamespace(stage_ignore=[])
+
+
+@pytest.fixture
+def packs(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> list[Path]:
+    """Fake charmcraft packing charms into the test directory, recording each pack."""
+    packs: list[Path] = []
+
+    def run_command(args: list[str], cwd: Path, **kwargs: Any):
+        assert args == ["-v", "pack"]
+        packs.append(cwd)
+        (cwd / f"{cwd.name}_ubuntu-22.04-amd64.charm").write_text(f"pack {len(packs)}")
+
+    monkeypatch.setattr(repository, "CHARMCRAFT", SimpleNamespace(run_command=run_command))
+    monkeypatch.setattr(repository, "BUILD_PATH", tmp_path / "build")
+    monkeypatch.setattr(repository, "CHARM_CACHE_PATH", tmp_path / "build" / "cache")
+    return packs
+
+
+@pytest.fixture
+def staged_charm(packs: list[Path], tmp_path: Path) -> Charm:
+    """Charm staged in the build directory of the test."""
+    charm = Charm({}, tmp_path / "charms" / "agent", [], [])
+    (charm.build_path / "src").mkdir(parents=True)
+    (charm.build_path / "src" / "charm.py").write_text("import ops\n")
+    return charm
+
+
+def test_charm_is_packed_on_cache_miss(staged_charm: Charm, packs: list[Path], tmp_path: Path):
+    pack_charm(staged_charm, PACKED_REPOSITORY)
+
+    assert packs == [staged_charm.build_path]
+    assert staged_charm.charm_path.read_text() == "pack 1"
+    assert list(staged_charm.build_path.glob("*.charm")) == []
+    assert len(list((tmp_path / "build" / "cache").iterdir())) == 1
+
+
+def test_cached_charm_is_reused(staged_charm: Charm, packs: list[Path]):
+    pack_charm(staged_charm, PACKED_REPOSITORY)
+    staged_charm.charm_path.unlink()
+
+    pack_charm(staged_charm, PACKED_REPOSITORY)
+
+    assert len(packs) == 1
+    assert staged_charm.charm_path.read_text() == "pack 1"
+
+
+def test_changed_charm_is_packed_again(staged_charm: Charm, packs: list[Path]):
+    pack_charm(staged_charm, PACKED_REPOSITORY)
+    (staged_charm.build_path / "src" / "charm.py").write_text("import ops, yaml\n")
+
+    pack_charm(staged_charm, PACKED_REPOSITORY)
+
+    assert len(packs) == 2
+    assert staged_charm.charm_path.read_text() == "pack 2"
+
+
+def test_charm_is_packed_without_cache(staged_charm: Charm, packs: list[Path]):
+    pack_charm(staged_charm, PACKED_REPOSITORY)
+
+    pack_charm(staged_charm, PACKED_REPOSITORY, use_cache=False)
+
+    assert len(packs) == 2
+    assert staged_charm.charm_path.read_text() == "pack 2"
+    # The cache entry is replaced by the new pack.
+    staged_charm.charm_path.unlink()
+    pack_charm(staged_charm, PACKED_REPOSITORY)
+    assert (len(packs), staged_charm.charm_path.read_text()) == (2, "pack 2")
+
+
+@pytest.fixture
+def exports(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> list[list[str]]:
+    """Fake `uv export` writing the requirements into the test directory, recording each export."""
+    exports: list[list[str]] = []
+
+    def run_command(args: list[str], **kwargs: Any):
+        assert args[:2] == ["--quiet", "export"]
+        exports.append(args)
+        Path(args[-1]).write_text(f"ops==2.{len(exports)}.0\n")
+
+    monkeypatch.setattr(repository, "UV", SimpleNamespace(run_command=run_command))
+    monkeypatch.setattr(repository, "REQUIREMENTS_CACHE_PATH", tmp_path / "requirements")
+    return exports
+
+
+def test_exported_requirements_are_reused(exports: list[list[str]]):
+    assert export_requirements("agent", "lock1") == "ops==2.1.0\n"
+
+    assert export_requirements("agent", "lock1") == "ops==2.1.0\n"
+    assert len(exports) == 1
+    assert exports[0][2:4] == ["--package", "agent"]
+
+
+def test_requirements_are_exported_again_when_the_lock_changes(
+    exports: list[list[str]], tmp_path: Path
+):
+    export_requirements("agent", "lock1")
+
+    assert export_requirements("agent", "lock2") == "ops==2.2.0\n"
+    assert len(exports) == 2
+    # Only the export of the current lock is kept.
+    assert len(list((tmp_path / "requirements" / "agent").iterdir())) == 1
+
+
+def test_requirements_are_exported_per_package(exports: list[list[str]]):
+    export_requirements("agent", "lock1")
+
+    assert export_requirements("other-agent", "lock1") == "ops==2.2.0\n"
+    assert export_requirements("agent", "lock1") == "ops==2.1.0\n"
+    assert len(exports) == 2
+
+
+@pytest.fixture
+def loads(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> list[int]:
+    """Load a fake monorepo of the test directory, recording each time it is loaded again."""
+    loads: list[int] = []
+
+    def load() -> dict[str, int]:
+        loads.append(len(loads))
+        return {"load": len(loads)}
+
+    (tmp_path / "pyproject.toml").write_text("[project]\n")
+    monkeypatch.setattr(repository, "Repository", load)
+    monkeypatch.setattr(repository, "ROOT_DIR", tmp_path)
+    monkeypatch.setattr(repository, "BUILD_PATH", tmp_path / "_build")
+    monkeypatch.setattr(repository, "REPOSITORY_CACHE_FILE", tmp_path / "_build" / "repo.pickle")
+    monkeypatch.setattr(repository, "REPOSITORY_INPUTS", ["pyproject.toml", "charms/*/*.yaml"])
+    return loads
+
+
+def test_repository_is_loaded_once(loads: list[int]):
+    assert load_repository() == load_repository() == {"load": 1}
+    assert len(loads) == 1
+
+
+def test_touched_repository_files_are_compared_by_digest(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, loads: list[int]
+):
+    load_repository()
+    os.utime(tmp_path / "pyproject.toml", (0, 0))
+
+    assert load_repository() == {"load": 1}
+    # The new modification time was cached, so the files are not compared again.
+    monkeypatch.setattr(repository, "files_digest", None)
+    assert load_repository() == {"load": 1}
+
+
+@pytest.mark.parametrize("change", ["edit", "add", "corrupt"])
+def test_repository_is_loaded_again(tmp_path: Path, loads: list[int], change: str):
+    load_repository()
+    if change == "edit":
+        (tmp_path / "pyproject.toml").write_text("[project]\nname = 'monorepo'\n")
+    elif change == "add":
+        (tmp_path / "charms" / "agent").mkdir(parents=True)
+        (tmp_path / "charms" / "agent" / "charmcraft.yaml").write_text("name: agent\n")
+    else:
+        (tmp_path / "_build" / "repo.pickle").write_bytes(b"garbage")
+
+    assert load_repository() == {"load": 2}
+
+
+def test_unit_test_output_is_printed_in_shard_order(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, capsys: pytest.CaptureFixture
+):
+    charms = []
+    for name, test_files in [("vantage-agent", 3), ("jobbergate-agent", 1)]:
+        charm = SimpleNamespace(name=name, build_path=tmp_path / name)
+        (charm.build_path / "tests" / "unit").mkdir(parents=True)
+        for i in range(test_files):
+            (charm.build_path / "tests" / "unit" / f"test_{i}.py").write_text("")
+        charms.append(charm)
+    runs = []
+
+    def uv_run(args: list[str], output: list[str] | None = None, **kwargs: Any) -> None:
+        if args[:2] != ["coverage", "run"]:
+            return
+        tests = [Path(arg).name for arg in args if arg.endswith(".py")]
+        runs.append(tests)
+        # The first shards finish last.
+        time.sleep(0.1 if "test_0.py" in tests else 0)
+        assert output is not None
+        output.append(f"{' '.join(tests)} passed\n")
+
+    monkeypatch.setattr(
+        repository,
+        "stage_jobs",
+        lambda charms, repository: [Job(f"stage:{charm.name}", lambda: None) for charm in charms],
+    )
+    monkeypatch.setattr(repository, "uv_run", uv_run)
+
+    unit_test_cli(charms, None, jobs=4, shards=2)  # type: ignore[arg-type]
+
+    assert sorted(runs) == [["test_0.py"], ["test_0.py", "test_2.py"], ["test_1.py"]]
+    assert capsys.readouterr().out == (
+        "===== unit:vantage-agent:1/2 =====\ntest_0.py test_2.py passed\n"
+        "===== unit:vantage-agent:2/2 =====\ntest_1.py passed\n"
+        "===== unit:jobbergate-agent:1/2 =====\ntest_0.py passed\n"
+    )
+
+
+@pytest.mark.parametrize("override_build", [None, "craftctl default\n"])
+def test_charm_builds_ship_bytecode(tmp_path: Path, override_build: str | None):
+    charm_path = tmp_path / "agent"
+    charm_path.mkdir()
+    (charm_path / "pyproject.toml").write_text('[project]\nname = "agent"\n')
+    part = {"plugin": "uv", **({"override-build": override_build} if override_build else {})}
+    (charm_path / "charmcraft.yaml").write_text(yaml.safe_dump({"parts": {"charm": part}}))
+    graph = LockGraph(lock(("agent", ["pydantic-core"]), ("pydantic-core", [])))
+
+    charm = load_charm(charm_path, [], [], [], {"pydantic-core": "2.27.2"}, graph)
+
+    assert charm is not None
+    part = charm.metadata["parts"]["charm"]
+    assert part["charm-binary-python-packages"] == ["pydantic-core==2.27.2"]
+    if override_build:
+        # Charms building their own way are left alone.
+        assert part["override-build"] == override_build
+    else:
+        assert part["override-build"] == f"craftctl default\n{COMPILE_BYTECODE_STEP}\n"
+
+
+@pytest.fixture
+def dispatches(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> list[list[str]]:
+    """Fake the Python of the charm, importing it in 20 ms with a fixed import-time profile."""
+    dispatches: list[list[str]] = []
+    profile = [
+        "import time: self [us] | cumulative | imported package",
+        "import time:       900 |        900 | ops",
+        "import time:       300 |       1200 |   ops.model",
+        "import time:      2000 |       2000 | yaml",
+        "import time:       100 |       3300 | charm",
+    ]
+
+    def run(args: list[str], **kwargs: Any) -> subprocess.CompletedProcess:
+        stdout = stderr = ""
+        if args[-1] == "import sys; print(sys.executable)":
+            stdout = "/usr/bin/python3\n"
+        elif args[-1] == "import charm":
+            dispatches.append(args)
+            time.sleep(0.02)
+            if "importtime" in args:
+                stderr = "\n".join(profile) + "\n"
+        return subprocess.CompletedProcess(args, 0, stdout, stderr)
+
+    monkeypatch.setattr(repository.subprocess, "run", run)
+    monkeypatch.setattr(repository, "BUILD_PATH", tmp_path)
+    return dispatches
+
+
+def test_startup_profile(tmp_path: Path, dispatches: list[list[str]]):
+    charm = SimpleNamespace(name="agent", build_path=tmp_path / "agent")
+
+    profile_startup(charm, budget=10_000)  # type: ignore[arg-type]
+
+    assert len(dispatches) == 2 + repository.STARTUP_RUNS
+    startup, imports, header, *modules = (
+        (tmp_path / "agent.importtime.txt").read_text().split("\n")
+    )
+    assert startup.startswith("startup: ") and startup.endswith(" ms (median of 5 runs)")
+    assert 20 <= float(startup.split()[1]) < 10_000
+    assert (imports, header) == ("imports: 3.3 ms", " self [ms] | module")
+    assert modules == ["       2.0 | yaml", "       1.2 | ops", "       0.1 | charm", ""]
+
+
+def test_startup_over_budget(tmp_path: Path, dispatches: list[list[str]]):
+    charm = SimpleNamespace(name="agent", build_path=tmp_path / "agent")
+
+    with pytest.raises(
+        RepositoryError, match=r"^Startup of charm `agent` takes .* the 5 ms budget"
+    ):
+        profile_startup(charm, budget=5)  # type: ignore[arg-type]
+    assert (tmp_path / "agent.importtime.txt").exists()
+
+
+def test_startup_of_a_broken_charm(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, dispatches: list[list[str]]
+):
+    def run(args: list[str], **kwargs: Any) -> subprocess.CompletedProcess:
+        if args[-1] == "import charm":
+            raise subprocess.CalledProcessError(1, args, stderr="ModuleNotFoundError: ops\n")
+        return subprocess.CompletedProcess(args, 0, "/usr/bin/python3\n", "")
+
+    monkeypatch.setattr(repository.subprocess, "run", run)
+    charm = SimpleNamespace(name="agent", build_path=tmp_path / "agent")
+
+    with pytest.raises(RepositoryError, match="Failed to import charm `agent`:\nModuleNotFound"):
+        profile_startup(charm)  # type: ignore[arg-type]